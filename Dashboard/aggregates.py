@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+from loader import read_portfolio_csv, preprocess
+from cube import CUBE_KEYS, partial_cube, merge_cubes, period_cube
+from cohorts import build_cohorts, merge_cohorts
+from sketches import build_histograms, merge_histograms
+from geography import partial_zips, merge_zips
+
+# Categorical columns whose value counts are kept per purpose x month
+VALUE_COUNT_COLUMNS = ['employment length', 'BUILDING CLASS CATEGORY', 'TAX CLASS AT PRESENT']
+
+DEFAULT_CHUNK_ROWS = 100000
+
+
+## Mergeable aggregates of a portfolio.
+## Everything the figures and KPI cards need, without keeping the loans themselves:
+##   cube          count / sum / min / max per purpose x day (see cube.py)
+##   value_counts  counts per (column, purpose, year_month, value)
+##   loan_ids      sorted 64-bit hashes of the distinct loan_id values
+##   cohorts       vintage matrix, origination quarter x months on book (see cohorts.py)
+##   histograms    rate, LTV and mortgage constant histograms per purpose x month (see sketches.py)
+##   zips          exposure sums per purpose x month x ZIP code (see geography.py)
+##   rows          number of rows folded in
+def empty_aggregates():
+    return {'cube': None, 'value_counts': None, 'loan_ids': np.empty(0, dtype=np.uint64), 'cohorts': None,
+            'histograms': None, 'zips': None, 'rows': 0}
+
+
+def chunk_value_counts(chunk):
+    counts = {}
+    for column in VALUE_COUNT_COLUMNS:
+        counts[column] = chunk.groupby(CUBE_KEYS, observed=True)[column].value_counts()
+        counts[column].index = counts[column].index.set_names('value', level=-1)
+    return pd.concat(counts, names=['column'])
+
+
+def merge_value_counts(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return pd.concat([left, right]).groupby(level=['column'] + CUBE_KEYS + ['value'], observed=True).sum()
+
+
+def hash_loan_ids(loan_ids):
+    return np.unique(pd.util.hash_array(np.asarray(loan_ids, dtype=object)))
+
+
+# Hashes of new loans inserted into the sorted hashes: only the ones not seen yet,
+# at their place, so the running array is never sorted again
+def insert_loan_ids(hashes, loan_ids):
+    added = hash_loan_ids(loan_ids)
+    if not len(hashes):
+        return added
+    at = np.searchsorted(hashes, added)
+    seen = hashes[np.minimum(at, len(hashes) - 1)] == added
+    return np.insert(hashes, at[~seen], added[~seen])
+
+
+# Distinct values of a value-count column, sorted (the streaming filter dropdowns)
+def value_count_values(aggregates, column):
+    counts = aggregates['value_counts']
+    if counts is None or column not in counts.index.get_level_values('column'):
+        return []
+    return sorted(counts.xs(column, level='column').index.get_level_values('value').unique())
+
+
+## Fold one preprocessed chunk into the running aggregates
+def fold_chunk(aggregates, chunk):
+    return {
+        'cube': merge_cubes([aggregates['cube'], partial_cube(chunk)]),
+        'value_counts': merge_value_counts(aggregates['value_counts'], chunk_value_counts(chunk)),
+        'loan_ids': insert_loan_ids(aggregates['loan_ids'], chunk['loan_id']),
+        'cohorts': merge_cohorts(aggregates['cohorts'], build_cohorts(chunk)),
+        'histograms': merge_histograms(aggregates['histograms'], build_histograms(chunk)),
+        'zips': merge_zips(aggregates['zips'], partial_zips(chunk)),
+        'rows': aggregates['rows'] + len(chunk),
+    }
+
+
+# Aggregates of a frame that is already in memory
+def aggregate_portfolio(lp_df):
+    return fold_chunk(empty_aggregates(), lp_df)
+
+
+## Streaming ingestion: the CSV is read chunk_rows at a time and only the
+## aggregates are kept, so peak memory follows the chunk size, not the file size
+## (apart from the sorted loan id hashes: 8 bytes per distinct loan, deduplicated as
+## each chunk is folded in)
+def stream_portfolio(path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    aggregates = empty_aggregates()
+    for chunk in read_portfolio_csv(path, chunksize=chunk_rows):
+        aggregates = fold_chunk(aggregates, preprocess(chunk))
+    return aggregates
+
+
+# Final cube at a granularity, rolled up from the daily partial cube
+def aggregates_cube(aggregates, granularity='month'):
+    return period_cube(aggregates['cube'], granularity)
+
+
+def distinct_loans(aggregates):
+    return len(aggregates['loan_ids'])
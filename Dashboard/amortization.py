@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+from cube import ALL_PURPOSE
+
+# Vectorized amortization: the remaining schedule of every loan of a chunk is computed
+# at once as (loans x months) arrays, then summed per purpose, so memory is bounded by
+# the chunk size and never loops over loans.
+
+PROJECTION_COLUMNS = ['payment', 'interest', 'principal', 'balance']
+MAX_MONTHS = 360
+DEFAULT_CHUNK_ROWS = 20000
+
+
+## Balance left after each of the next `months` payments, as a (loans x months) array.
+## Each loan keeps paying its level payment on the current balance until the balance
+## is repaid or the term ends; a balance left at the last month is paid as a balloon.
+def remaining_balances(balance, monthly_rate, payment, remaining, months):
+    balance = np.maximum(np.asarray(balance, dtype='float64'), 0)
+    rate = np.asarray(monthly_rate, dtype='float64')
+    payment = np.asarray(payment, dtype='float64')
+    remaining = np.asarray(remaining)
+
+    # Closed form after t payments: B (1 + r)^t - P ((1 + r)^t - 1) / r
+    #                              = (B - P / r) (1 + r)^t + P / r, computed in place
+    end = np.cumprod(np.broadcast_to((1 + rate)[:, None], (len(balance), months)), axis=1)
+    paying = rate > 0
+    level = np.divide(payment, rate, out=np.zeros_like(payment), where=paying)
+    end *= (balance - level)[:, None]
+    end += level[:, None]
+    if not paying.all():
+        # Interest-free loans repay linearly
+        end[~paying] = balance[~paying, None] - payment[~paying, None] * np.arange(1, months + 1)
+    np.maximum(end, 0, out=end)
+
+    # Term ended: everything left is repaid at the last month
+    end *= np.arange(1, months + 1)[None, :] < remaining[:, None]
+    return end
+
+
+## Full schedules of one chunk of loans, as (loans x months) arrays
+def amortize(balance, monthly_rate, payment, remaining, months):
+    end = remaining_balances(balance, monthly_rate, payment, remaining, months)
+    start = np.empty_like(end)
+    start[:, 0] = np.maximum(np.asarray(balance, dtype='float64'), 0)
+    start[:, 1:] = end[:, :-1]
+
+    interest = start * np.asarray(monthly_rate, dtype='float64')[:, None]
+    principal = start - end
+    return {'payment': interest + principal, 'interest': interest, 'principal': principal, 'balance': end}
+
+
+## Monthly cash flows per purpose of a preprocessed chunk of loans: (purposes x months) sums.
+## Interest and principal are linear in the balances, so only the balances are
+## materialized per loan and everything else is derived from their per-purpose sums.
+def project_chunk(chunk, purposes, months=MAX_MONTHS):
+    balance = np.maximum(chunk['loan balance'].to_numpy(dtype='float64'), 0)
+    rate = chunk['interest rate'].to_numpy(dtype='float64') / 12
+    remaining = (chunk['duration months'] - chunk['total past payments']).clip(lower=0).to_numpy()
+    end = remaining_balances(balance, rate, chunk['payments'].to_numpy(dtype='float64'), remaining, months)
+
+    codes = pd.Categorical(chunk['purpose'], categories=purposes).codes
+    onehot = np.zeros((len(purposes), len(chunk)))
+    onehot[codes[codes >= 0], np.flatnonzero(codes >= 0)] = 1
+
+    sums = {}
+    for name, weights in (('balance', onehot), ('rated', onehot * rate)):
+        end_sum = weights @ end
+        start_sum = np.empty_like(end_sum)
+        start_sum[:, 0] = weights @ balance
+        start_sum[:, 1:] = end_sum[:, :-1]
+        sums[name] = (start_sum, end_sum)
+
+    (start, end), (interest, _) = sums['balance'], sums['rated']
+    principal = start - end
+    return {'payment': interest + principal, 'interest': interest, 'principal': principal, 'balance': end}
+
+
+## Projection of a whole portfolio, from an iterable of preprocessed chunks.
+## Returns the (purposes x months) sums and the month the projection starts after;
+## progress, if given, is called with the number of loans projected so far.
+def project_portfolio(chunks, purposes, months=MAX_MONTHS, progress=None):
+    totals = {column: np.zeros((len(purposes), months)) for column in PROJECTION_COLUMNS}
+    start = None
+    rows = 0
+    for chunk in chunks:
+        for column, values in project_chunk(chunk, purposes, months).items():
+            totals[column] += values
+        chunk_start = projection_start(chunk)
+        start = chunk_start if start is None or chunk_start > start else start
+        rows += len(chunk)
+        if progress is not None:
+            progress(rows)
+    return totals, start
+
+
+def frame_chunks(lp_df, chunk_rows=DEFAULT_CHUNK_ROWS):
+    for start in range(0, len(lp_df), chunk_rows):
+        yield lp_df.iloc[start:start + chunk_rows]
+
+
+# Month after which the projection starts: the latest month a payment was made in
+def projection_start(lp_df):
+    paid = lp_df['funded_date'].dt.to_period('M') + lp_df['total past payments'].astype(int)
+    return paid.max()
+
+
+## Long table: one row per purpose (and "All") and projected month
+def projection_frame(totals, purposes, start):
+    months = pd.period_range(start + 1, periods=totals['payment'].shape[1], freq='M').strftime('%Y-%m')
+    frames = []
+    for i, purpose in enumerate(list(purposes) + [ALL_PURPOSE]):
+        values = {column: (totals[column][i] if i < len(purposes) else totals[column].sum(axis=0))
+                  for column in PROJECTION_COLUMNS}
+        frames.append(pd.DataFrame(values, index=pd.Index(months, name='month')).assign(purpose=purpose))
+    projection = pd.concat(frames).reset_index().set_index(['purpose', 'month'])
+    return projection
@@ -0,0 +1,43 @@
+import functools
+
+import dash
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+# Long-running callbacks in background processes, through Dash's DiskcacheManager: no
+# broker, jobs are child processes of the web worker and results are kept on disk,
+# keyed by the callback inputs (and cache_by), for every worker to reuse.
+# A job still running when its callback fires again is terminated by Dash.
+
+EXPIRE_SECONDS = 3600
+
+
+## Background callback manager, or None when diskcache is not installed
+def callback_manager(directory, cache_by=None, expire=EXPIRE_SECONDS):
+    if diskcache is None:
+        return None
+    return dash.DiskcacheManager(diskcache.Cache(directory), cache_by=cache_by, expire=expire)
+
+
+## Register a heavy callback. The function gets a set_progress function first, which is
+## None when it runs in the request (no manager), so it can always be called the same way.
+def heavy_callback(app, manager, outputs, inputs, progress=None, running=None):
+    def register(function):
+        if manager is None:
+            @functools.wraps(function)
+            def in_request(*args):
+                return function(None, *args)
+            app.callback(outputs, inputs)(in_request)
+        else:
+            app.callback(outputs, inputs, background=True, manager=manager,
+                         progress=progress, running=running)(function)
+        return function
+    return register
+
+
+def report_progress(set_progress, done, total):
+    if set_progress is not None:
+        set_progress((str(done), str(total)))
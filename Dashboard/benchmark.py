@@ -0,0 +1,181 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# Benchmark suite: times ingestion, pre-processing, every figure builder and the
+# purpose_selection callback on synthetic portfolios of growing size.
+#
+#   python benchmark.py --sizes 10k 1M 10M
+#   python benchmark.py --sizes 10k --compare benchmarks/previous.json
+#
+# Each size runs in its own process, so peak memory is not inherited from the
+# previous size. Results are written to benchmarks/ as JSON.
+
+BENCHMARK_DIR = "benchmarks"
+DEFAULT_SIZES = ['10k', '1M', '10M']
+REGRESSION_RATIO = 1.2
+
+
+TRACE_MEMORY = True
+
+
+## Timing of one phase: best wall time over `repeat` runs, then (tracing slows
+## everything down, so in one extra run) the peak allocation during the phase,
+## numpy and pandas buffers included
+def measure(results, name, function, *args, repeat=1):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = function(*args)
+        times.append(time.perf_counter() - start)
+    results[name] = {'seconds': min(times), 'mean_seconds': sum(times) / len(times), 'repeat': repeat}
+
+    if TRACE_MEMORY and name != 'app_import':
+        del value
+        tracemalloc.start()
+        value = function(*args)
+        results[name]['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        tracemalloc.stop()
+    return value
+
+
+## Benchmark of one portfolio file, run inside a fresh process
+def run_one(path, repeat, trace_memory=True):
+    global TRACE_MEMORY
+    TRACE_MEMORY = trace_memory
+    os.environ['LOAN_DATA_PATH'] = path
+    os.environ['LOAN_WARMUP'] = '0'
+
+    from loader import read_portfolio_csv, preprocess
+    from aggregates import aggregate_portfolio, aggregates_cube
+    from date_range import build_date_index, range_totals
+
+    results = {}
+    raw = measure(results, 'ingestion', read_portfolio_csv, path)
+    lp_df = measure(results, 'preprocessing', preprocess, raw)
+    frame_mb = round(lp_df.memory_usage(deep=True).sum() / 2 ** 20, 1)
+    del raw
+    aggregates = measure(results, 'aggregation', aggregate_portfolio, lp_df)
+    cube = measure(results, 'cube', aggregates_cube, aggregates)
+    index = measure(results, 'date_index', build_date_index, cube)
+    totals = range_totals(index)
+    del lp_df, aggregates
+
+    # The app itself, loading the same file (through its columnar cache when warm)
+    main = measure(results, 'app_import', __import__, 'main')
+
+    measure(results, 'demographic', main.demographic, totals, repeat=repeat)
+    measure(results, 'draw_interest_graph', main.draw_interest_graph, cube, repeat=repeat)
+    measure(results, 'draw_interest_purpose_graph', main.draw_interest_purpose_graph, cube, repeat=repeat)
+    measure(results, 'avg_funding_duration', main.avg_funding_duration, totals, repeat=repeat)
+    measure(results, 'loan_constant', main.loan_constant, cube, 'All', repeat=repeat)
+    measure(results, 'loan_value', main.loan_value, cube, 'All', repeat=repeat)
+    for purpose in main.PURPOSE_OPTIONS:
+        measure(results, f'purpose_selection[{purpose}]', main.purpose_selection, purpose, repeat=repeat)
+
+    return {
+        'rows': main.portfolio_state()['aggregates']['rows'],
+        'file_mb': round(os.path.getsize(path) / 2 ** 20, 1),
+        'frame_mb': frame_mb,
+        'startup': main.startup_timings,
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'phases': results,
+    }
+
+
+def environment():
+    import numpy
+    import pandas
+    import plotly
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': numpy.__version__,
+        'pandas': pandas.__version__,
+        'plotly': plotly.__version__,
+    }
+
+
+## Phases slower than REGRESSION_RATIO times the previous run
+def compare(current, previous):
+    regressions = []
+    for size, run in current['sizes'].items():
+        before = previous.get('sizes', {}).get(size)
+        if not before or 'phases' not in before or 'phases' not in run:
+            continue
+        for phase, result in run['phases'].items():
+            old = before['phases'].get(phase)
+            if old and old['seconds'] > 0:
+                ratio = result['seconds'] / old['seconds']
+                flag = '  REGRESSION' if ratio > REGRESSION_RATIO else ''
+                print(f"{size:>6} {phase:<40} {old['seconds']:9.4f}s -> {result['seconds']:9.4f}s  x{ratio:5.2f}{flag}")
+                if flag:
+                    regressions.append((size, phase, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard on synthetic portfolios')
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help='portfolio sizes, e.g. 10k 1M 10M')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each figure builder (best is kept)')
+    parser.add_argument('--out', help='JSON file to write (default benchmarks/benchmark_<timestamp>.json)')
+    parser.add_argument('--compare', help='previous results JSON to compare against')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced run measuring peak memory per phase')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_one:
+        json.dump(run_one(args.run_one, args.repeat, not args.no_memory), sys.stdout)
+        return 0
+
+    from synthetic import parse_rows, synthetic_path, generate
+
+    report = {'environment': environment(), 'sizes': {}}
+    for size in args.sizes:
+        rows = parse_rows(size)
+        path = synthetic_path(rows)
+        if not os.path.exists(path):
+            print(f"generating {rows} loans -> {path}")
+            generate(rows, path)
+
+        print(f"benchmarking {size}")
+        command = [sys.executable, os.path.abspath(__file__), '--run-one', path, '--repeat', str(args.repeat)]
+        if args.no_memory:
+            command.append('--no-memory')
+        process = subprocess.run(command, capture_output=True, text=True)
+        if process.returncode != 0:
+            report['sizes'][size] = {'error': process.stderr.strip().splitlines()[-1:]}
+            print(process.stderr)
+            continue
+        report['sizes'][size] = json.loads(process.stdout.strip().splitlines()[-1])
+
+    out = args.out or os.path.join(BENCHMARK_DIR, f"benchmark_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(out)
+
+    if args.compare:
+        with open(args.compare) as f:
+            return 1 if compare(report, json.load(f)) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+# Categorical columns that can filter the dashboard
+FILTER_COLUMNS = ['purpose', 'BUILDING CLASS CATEGORY', 'TAX CLASS AT PRESENT', 'employment length']
+
+
+## Bitmap index: for every distinct value of every filter column, a packed
+## boolean array (one bit per loan) of the rows holding that value
+def build_bitmaps(lp_df, columns=FILTER_COLUMNS):
+    index = {'rows': len(lp_df), 'columns': {}}
+    for column in columns:
+        codes, uniques = pd.factorize(lp_df[column], sort=True)
+        index['columns'][column] = {
+            to_python(value): np.packbits(codes == code) for code, value in enumerate(uniques)
+        }
+    return index
+
+
+## Bitmaps after new rows were merged in (see loader.merge_positions): the old rows
+## moved to old_rows and the new ones landed at new_rows. Rows appended at the end
+## only add their bits after the existing ones.
+def insert_bitmaps(index, new_df, old_rows, new_rows, columns=FILTER_COLUMNS):
+    rows = index['rows'] + len(new_df)
+    appended = not len(new_rows) or new_rows[0] >= index['rows']
+    merged = {'rows': rows, 'columns': {}}
+    for column in columns:
+        codes, uniques = pd.factorize(new_df[column], sort=True)
+        new_bits = {to_python(value): codes == code for code, value in enumerate(uniques)}
+        bitmaps = index['columns'][column]
+        merged['columns'][column] = {}
+        for value in sorted(set(bitmaps) | set(new_bits)):
+            packed = bitmaps.get(value, np.zeros((index['rows'] + 7) // 8, dtype=np.uint8))
+            added = new_bits.get(value, np.zeros(len(new_df), dtype=bool))
+            if appended:
+                merged['columns'][column][value] = append_bits(packed, index['rows'], added)
+            else:
+                bits = np.zeros(rows, dtype=bool)
+                bits[old_rows] = np.unpackbits(packed, count=index['rows'])
+                bits[new_rows] = added
+                merged['columns'][column][value] = np.packbits(bits)
+    return merged
+
+
+# Packed bits of rows, then bits: only the last partial byte is shared
+def append_bits(packed, rows, bits):
+    offset = rows % 8
+    tail = np.packbits(np.concatenate([np.zeros(offset, dtype=bool), bits]))
+    if not offset:
+        return np.concatenate([packed, tail])
+    return np.concatenate([packed[:-1], packed[-1:] | tail[:1], tail[1:]])
+
+
+# Numpy scalars do not survive the trip through JSON
+def to_python(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def filter_values(index, column):
+    return list(index['columns'][column])
+
+
+## Selection: values of one column are OR-ed, columns are AND-ed.
+## filters maps a column to the list of selected values; empty lists are ignored.
+## Returns None when nothing is filtered.
+def select_bitmap(index, filters):
+    selection = None
+    for column, values in filters.items():
+        if not values:
+            continue
+        bitmaps = index['columns'][column]
+        column_bits = np.zeros((index['rows'] + 7) // 8, dtype=np.uint8)
+        for value in values:
+            if value in bitmaps:
+                column_bits |= bitmaps[value]
+        selection = column_bits if selection is None else selection & column_bits
+    return selection
+
+
+def bitmap_rows(bitmap, rows):
+    return np.flatnonzero(np.unpackbits(bitmap, count=rows))
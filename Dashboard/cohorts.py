@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+# Vintage analysis: outstanding balance as a share of the funded amount, per origination
+# quarter (cohort) and months on book, kept as a mergeable cohorts x months matrix.
+# New vintages are folded in by adding their matrix; picking cohorts slices its rows.
+
+COHORT_COLUMNS = ['funded_date', 'funded_amount', 'interest rate', 'duration months', 'total past payments',
+                  'loan balance']
+MAX_MONTHS = 360
+DEFAULT_CHUNK_ROWS = 20000
+
+
+## Cohort matrix: sums per cohort (rows, quarter ordinals year * 4 + quarter - 1) and
+## months on book (columns) over the loans observed at that age:
+##   funded   funded amount
+##   repaid   principal repaid since funding
+##   loans    number of loans
+def empty_cohorts():
+    return {'cohorts': np.empty(0, dtype='int64'), 'funded': np.zeros((0, 1)), 'repaid': np.zeros((0, 1)),
+            'loans': np.zeros((0, 1))}
+
+
+def quarter_ordinals(dates):
+    return (dates.dt.year * 4 + (dates.dt.month - 1) // 3).to_numpy(dtype='int64')
+
+
+def quarter_label(ordinal):
+    return f"{int(ordinal) // 4}-Q{int(ordinal) % 4 + 1}"
+
+
+## Principal repaid after each of months 0..months-1 of every loan, as (loans x months).
+## Only the principal repaid to date is known; before that the repayment follows the
+## shape of a level-payment schedule, where the principal repaid after m payments is
+## proportional to (1 + r)^m - 1 (to m for an interest-free loan).
+def repaid_principal(repaid_today, monthly_rate, age, months):
+    repaid = np.log1p(monthly_rate)[:, None] * np.arange(months)
+    np.expm1(repaid, out=repaid)
+    interest_free = monthly_rate <= 0
+    if interest_free.any():
+        repaid[interest_free] = np.arange(months)
+
+    shape_today = np.take_along_axis(repaid, age[:, None], axis=1)[:, 0]
+    scale = np.divide(repaid_today, shape_today, out=np.zeros_like(repaid_today), where=shape_today > 0)
+    repaid *= scale[:, None]
+    repaid *= np.arange(months)[None, :] <= age[:, None]
+    return repaid
+
+
+# Matrix of up to chunk_rows loans
+def chunk_matrix(chunk):
+    if not len(chunk):
+        return empty_cohorts()
+    funded = chunk['funded_amount'].to_numpy(dtype='float64')
+    balance = np.clip(chunk['loan balance'].to_numpy(dtype='float64'), 0, None)
+    age = np.minimum(chunk['total past payments'].to_numpy(), chunk['duration months'].to_numpy())
+    age = np.clip(age, 0, MAX_MONTHS).astype('int64')
+    monthly_rate = chunk['interest rate'].to_numpy(dtype='float64') / 12
+    return cohort_sums(quarter_ordinals(chunk['funded_date']), funded, funded - balance, np.ones_like(funded),
+                       monthly_rate, age)
+
+
+## Matrix of rows of loans sharing a cohort, monthly rate and age: their funded amount,
+## principal repaid to date and number of loans (one row per loan, or the sums of a
+## GROUP BY on those three keys). Rows are sorted by cohort so each cohort is one
+## reduceat slice.
+def cohort_sums(cohorts, funded, repaid_today, loans, monthly_rate, age):
+    order = np.argsort(cohorts, kind='stable')
+    cohorts, funded, repaid_today, loans, monthly_rate, age = (
+        values[order] for values in (cohorts, funded, repaid_today, loans, monthly_rate, age))
+    months = int(age.max()) + 1
+
+    labels, starts = np.unique(cohorts, return_index=True)
+    repaid = np.add.reduceat(repaid_principal(repaid_today, monthly_rate, age, months), starts, axis=0)
+
+    # A loan is observed at every age up to its own: reverse cumulative sums over its age
+    rows = np.searchsorted(labels, cohorts)
+    sums = {}
+    for name, weights in (('funded', funded), ('loans', loans)):
+        at_age = np.zeros((len(labels), months))
+        np.add.at(at_age, (rows, age), weights)
+        sums[name] = np.cumsum(at_age[:, ::-1], axis=1)[:, ::-1]
+    return {'cohorts': labels, 'funded': sums['funded'], 'repaid': repaid, 'loans': sums['loans']}
+
+
+## Merge two cohort matrices (the cohorts are unioned, the months padded with zeros)
+def merge_cohorts(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    cohorts = np.union1d(left['cohorts'], right['cohorts'])
+    months = max(left['funded'].shape[1], right['funded'].shape[1])
+    merged = {'cohorts': cohorts}
+    for name in ('funded', 'repaid', 'loans'):
+        values = np.zeros((len(cohorts), months))
+        for part in (left, right):
+            values[np.searchsorted(cohorts, part['cohorts']), :part[name].shape[1]] += part[name]
+        merged[name] = values
+    return merged
+
+
+## Cohort matrix of preprocessed loans, chunk_rows at a time to bound the (loans x months) arrays
+def build_cohorts(lp_df, chunk_rows=DEFAULT_CHUNK_ROWS):
+    matrix = empty_cohorts()
+    for start in range(0, len(lp_df), chunk_rows):
+        matrix = merge_cohorts(matrix, chunk_matrix(lp_df.iloc[start:start + chunk_rows]))
+    return matrix
+
+
+def cohort_labels(matrix):
+    return [quarter_label(cohort) for cohort in matrix['cohorts']]
+
+
+## Vintage curves of the picked cohorts (labels, default all): outstanding share of the
+## funded amount per months on book, NaN past the oldest loan of the cohort
+def vintage_curves(matrix, labels=None):
+    rows = np.arange(len(matrix['cohorts']))
+    if labels is not None:
+        positions = {label: row for row, label in enumerate(cohort_labels(matrix))}
+        rows = np.array([positions[label] for label in labels if label in positions], dtype='int64')
+    funded = matrix['funded'][rows]
+    share = 1 - np.divide(matrix['repaid'][rows], funded, out=np.full(funded.shape, np.nan), where=funded > 0)
+    return pd.DataFrame(share, index=pd.Index([quarter_label(c) for c in matrix['cohorts'][rows]], name='cohort'),
+                        columns=pd.RangeIndex(funded.shape[1], name='months_on_book'))
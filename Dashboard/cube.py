@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+
+# Metrics kept in the aggregate cube
+CUBE_METRICS = ['mortgage_constant', 'ltv', 'interest rate percent', 'funded_amount', 'duration years']
+CUBE_KEYS = ['purpose', 'year_month']
+ALL_PURPOSE = 'All'
+
+# The mergeable base aggregate is kept per purpose x funded day (day ordinals, days since
+# 1970-01-01), the finest granularity; every coarser period is rolled up from it
+BASE_KEYS = ['purpose', 'day']
+GRANULARITIES = ['week', 'month', 'quarter', 'year']
+
+# How each stored statistic combines when two partial cubes are merged
+STAT_MERGE = {'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'}
+
+
+def day_ordinals(dates):
+    return np.asarray(dates, dtype='datetime64[D]').astype('int64')
+
+
+## Partial cube: count, sum, min and max per purpose x day (mergeable)
+def partial_cube(lp_df):
+    grouped = lp_df.groupby([lp_df['purpose'], pd.Series(day_ordinals(lp_df['funded_date']), index=lp_df.index,
+                                                          name='day')], observed=True)
+    metrics = grouped[CUBE_METRICS]
+
+    part = pd.concat({'count': metrics.count(), 'sum': metrics.sum(),
+                      'min': metrics.min(), 'max': metrics.max()}, axis=1)
+    part = part.swaplevel(axis=1)
+    part[('loans', 'count')] = grouped.size()
+    part.index = cube_keys(part.index)
+    return part.sort_index(axis=1)
+
+
+# The loans are grouped on categorical purposes; the cubes are keyed by plain purpose strings
+def cube_keys(index):
+    purposes = pd.Index(index.levels[0].astype(str), dtype=object, name='purpose')
+    return index.set_levels(purposes, level=0)
+
+
+## Period labels of day ordinals: the Monday of the week ("YYYY-MM-DD"), the month
+## ("YYYY-MM"), the first month of the quarter ("YYYY-MM") or the year ("YYYY")
+def period_labels(days, granularity='month'):
+    days = np.asarray(days, dtype='int64')
+    if granularity == 'week':
+        # 1970-01-01 was a Thursday
+        return np.datetime_as_string((days - (days + 3) % 7).astype('datetime64[D]'), unit='D')
+    months = days.astype('datetime64[D]').astype('datetime64[M]')
+    if granularity == 'quarter':
+        ordinals = months.astype('int64')
+        months = (ordinals - ordinals % 3).astype('datetime64[M]')
+    elif granularity == 'year':
+        return np.datetime_as_string(months.astype('datetime64[Y]'), unit='Y')
+    return np.datetime_as_string(months, unit='M')
+
+
+# Day ordinal of the first day of a "YYYY-MM" month
+def month_day(year_month):
+    return int(np.datetime64(year_month, 'M').astype('datetime64[D]').astype('int64'))
+
+
+# Combine rows sharing the same group keys, statistic by statistic
+def combine_stats(part, level):
+    return part.groupby(level=level, observed=True).agg({column: STAT_MERGE[column[1]] for column in part.columns})
+
+
+## Merge partial cubes built from different slices of the portfolio
+def merge_cubes(parts):
+    parts = [part for part in parts if part is not None and len(part)]
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    return combine_stats(pd.concat(parts), BASE_KEYS).sort_index()
+
+
+## Roll a partial cube up from days to periods of a granularity, keeping only the days
+## in [start, end) (day ordinals, None leaves that side open). Only the distinct days
+## are labelled, each row takes its day's label.
+def rollup_cube(part, granularity='month', start=None, end=None):
+    if start is not None or end is not None:
+        days = part.index.get_level_values('day')
+        keep = np.ones(len(part), dtype=bool)
+        if start is not None:
+            keep &= days >= start
+        if end is not None:
+            keep &= days < end
+        part = part[keep]
+    labels = period_labels(part.index.levels[1], granularity)
+    part = part.copy()
+    part.index = pd.MultiIndex.from_arrays([part.index.get_level_values('purpose'),
+                                            pd.Index(labels[part.index.codes[1]], dtype=object)], names=CUBE_KEYS)
+    return combine_stats(part, CUBE_KEYS)
+
+
+## Final cube: adds the "All" rollup and the mean of every metric
+def finalize_cube(part):
+    rollup = combine_stats(part, 'year_month')
+    rollup.index = pd.MultiIndex.from_product([[ALL_PURPOSE], rollup.index], names=CUBE_KEYS)
+
+    cube = pd.concat([part, rollup]).sort_index()
+    for metric in CUBE_METRICS:
+        cube[(metric, 'mean')] = cube[(metric, 'sum')] / cube[(metric, 'count')].where(cube[(metric, 'count')] > 0)
+    return cube.sort_index(axis=1)
+
+
+# Final cube of a partial cube at a granularity (the time level keeps the year_month name)
+def period_cube(part, granularity='month', start=None, end=None):
+    return finalize_cube(rollup_cube(part, granularity, start, end))
+
+
+def build_cube(lp_df, granularity='month'):
+    return period_cube(partial_cube(lp_df), granularity)
+
+
+## Cube readers used by the figure builders
+def cube_purposes(cube):
+    return [p for p in cube.index.get_level_values('purpose').unique() if p != ALL_PURPOSE]
+
+
+# Monthly series of one metric for a purpose (or "All"), indexed by year_month
+def cube_series(cube, metric, purpose=ALL_PURPOSE, stat='mean'):
+    if purpose not in cube.index.get_level_values('purpose'):
+        return pd.Series(dtype='float64', name=metric, index=pd.Index([], name='year_month'))
+    series = cube.loc[purpose, (metric, stat)]
+    series.name = metric
+    return series
+
+
+# Monthly series of one metric for every purpose, long format
+def cube_frame(cube, metric, stat='mean'):
+    frame = cube[(metric, stat)].drop(ALL_PURPOSE, level='purpose', errors='ignore')
+    frame.name = metric
+    return frame.reset_index()
+
+
+## Readers of a totals table: one row per purpose (plus "All"), count / sum / mean
+## per metric over a range of months (see date_range.range_totals)
+def purpose_totals(totals, metric):
+    totals = totals.drop(ALL_PURPOSE, errors='ignore')
+    return totals[metric]
+
+
+# Number of loans per purpose, largest first
+def purpose_counts(totals):
+    counts = totals[('loans', 'count')].drop(ALL_PURPOSE, errors='ignore')
+    return counts[counts > 0].sort_values(ascending=False)
+
+
+# Portfolio-wide total of one metric, read from the "All" row
+def cube_total(totals, metric, stat='sum'):
+    return totals.loc[ALL_PURPOSE, (metric, stat)]
+
+
+## Cube restricted to some purposes, with the "All" rollup recomputed over them
+def select_purposes(cube, purposes):
+    part = cube.drop(ALL_PURPOSE, level='purpose', errors='ignore')
+    part = part[part.index.get_level_values('purpose').isin(purposes)]
+    return finalize_cube(part[[column for column in part.columns if column[1] != 'mean']])
+
+
+# Partial cube restricted to some purposes
+def select_base(part, purposes):
+    return part[part.index.get_level_values('purpose').isin(purposes)]
@@ -0,0 +1,365 @@
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+from loader import (LOAN_COLUMNS, CACHE_VERSION, read_portfolio_csv, preprocess, cache_path, source_signature,
+                    write_cache_meta, valid_cache, load_portfolio)
+from cube import CUBE_METRICS, BASE_KEYS, cube_keys, build_cube, period_cube, partial_cube, merge_cubes
+from bitmaps import FILTER_COLUMNS, to_python
+from drilldown import TABLE_COLUMNS, split_filter_part, page_records
+from cohorts import MAX_MONTHS, empty_cohorts, cohort_sums, merge_cohorts, build_cohorts
+from sketches import SKETCH_METRICS, SKETCH_KEYS, BINS, empty_histograms, merge_histograms, build_histograms
+from geography import ZIP_KEYS, ZIP_SUMS, empty_zips, partial_zips, merge_zips, zip_totals
+
+# Embedded SQL backend: the preprocessed portfolio in an SQLite file next to the
+# columnar cache, with the cube, cohort, histogram and ZIP aggregations pushed down as
+# GROUP BY queries. Only the grouped rows are read back into Python.
+#
+#   python database.py --check    # both backends must return the same numbers
+
+TABLE = 'loans'
+DEFAULT_CHUNK_ROWS = 100000
+
+INDEXED_COLUMNS = ['funded_date', 'purpose', 'BUILDING CLASS CATEGORY', 'BUILDING CLASS AT PRESENT',
+                   'TAX CLASS AT PRESENT', 'TAX CLASS AT TIME OF SALE']
+
+
+def quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def database_path(path):
+    return cache_path(path) + '-sqlite'
+
+
+## Connections: read-only, one per thread and process (forked background jobs open their own).
+## A rebuild replaces loans.sqlite with a new file, so a connection is kept only while
+## the file it was opened on is still there (same inode and modification time).
+local = threading.local()
+
+
+def connect(database):
+    if getattr(local, 'pid', None) != os.getpid():
+        local.pid, local.connections = os.getpid(), {}
+    path = os.path.join(database, 'loans.sqlite')
+    stat = os.stat(path)
+    stamp = (stat.st_ino, stat.st_mtime_ns)
+    opened, conn = local.connections.get(database, (None, None))
+    if opened != stamp:
+        if conn is not None:
+            conn.close()
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        local.connections[database] = (stamp, conn)
+    return conn
+
+
+## Load the CSV into the database chunk by chunk, then index it
+def build_database(path, directory, chunk_rows=DEFAULT_CHUNK_ROWS):
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, 'loans.sqlite.tmp')
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    signature = source_signature(path)
+    rows = 0
+    with sqlite3.connect(tmp) as conn:
+        for chunk in read_portfolio_csv(path, chunksize=chunk_rows):
+            insert_loans(conn, preprocess(chunk))
+            rows += len(chunk)
+        for column in INDEXED_COLUMNS:
+            conn.execute(f"CREATE INDEX {quote('ix_' + column)} ON {TABLE} ({quote(column)})")
+        conn.execute(f"CREATE INDEX ix_purpose_day ON {TABLE} (purpose, funded_date)")
+    conn.close()
+
+    os.replace(tmp, os.path.join(directory, 'loans.sqlite'))
+    write_cache_meta(directory, {'version': CACHE_VERSION, 'source': signature, 'rows': rows})
+
+
+def insert_loans(conn, lp_df):
+    lp_df = lp_df.assign(funded_date=lp_df['funded_date'].dt.strftime('%Y-%m-%d'))
+    lp_df.to_sql(TABLE, conn, if_exists='append', index=False, chunksize=10000)
+
+
+## Database of the CSV, (re)built when the CSV changed. Returns the database directory.
+def open_database(path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    directory = database_path(path)
+    if valid_cache(path, directory) is None or not os.path.exists(os.path.join(directory, 'loans.sqlite')):
+        build_database(path, directory, chunk_rows)
+    return directory
+
+
+# New loans (live refresh) go straight into the database
+def append_loans(database, frames):
+    with sqlite3.connect(os.path.join(database, 'loans.sqlite')) as conn:
+        for frame in frames:
+            insert_loans(conn, frame)
+    conn.close()
+
+
+## WHERE clause of the cross-filters: values of one column are OR-ed, columns are AND-ed
+def filter_clause(filters):
+    clauses, params = [], []
+    for column, values in (filters or {}).items():
+        if not values:
+            continue
+        clauses.append(f"{quote(column)} IN ({', '.join('?' * len(values))})")
+        params.extend(to_python(value) for value in values)
+    return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+
+## Partial cube (see cube.partial_cube) computed by the database
+def query_partial_cube(database, filters=None):
+    where, params = filter_clause(filters)
+    stats = ['COUNT(*) AS "loans|count"']
+    for metric in CUBE_METRICS:
+        for stat, function in (('count', 'COUNT'), ('sum', 'TOTAL'), ('min', 'MIN'), ('max', 'MAX')):
+            stats.append(f'{function}({quote(metric)}) AS "{metric}|{stat}"')
+
+    # Dates are stored as "YYYY-MM-DD": the day ordinal is the julian day of 1970-01-01 away
+    part = pd.read_sql_query(
+        f"SELECT purpose, CAST(julianday(funded_date) - 2440587.5 AS INTEGER) AS day, {', '.join(stats)} "
+        f"FROM {TABLE}{where} GROUP BY purpose, funded_date ORDER BY purpose, funded_date",
+        connect(database), params=params).set_index(BASE_KEYS)
+    part.index = cube_keys(part.index)
+    part.columns = pd.MultiIndex.from_tuples([tuple(column.split('|')) for column in part.columns])
+
+    # TOTAL() is always a float; sums of integer columns stay integers as in pandas
+    for metric in CUBE_METRICS:
+        if np.dtype(LOAN_COLUMNS.get(metric, 'float64')).kind == 'i':
+            part[(metric, 'sum')] = part[(metric, 'sum')].astype('int64')
+    return part.sort_index(axis=1)
+
+
+def query_rows(database):
+    return connect(database).execute(f"SELECT COUNT(*) FROM {TABLE}").fetchone()[0]
+
+
+def query_distinct_loans(database):
+    return connect(database).execute(f"SELECT COUNT(DISTINCT loan_id) FROM {TABLE}").fetchone()[0]
+
+
+def query_filter_values(database, column):
+    rows = connect(database).execute(
+        f"SELECT DISTINCT {quote(column)} FROM {TABLE} WHERE {quote(column)} IS NOT NULL ORDER BY 1").fetchall()
+    return [row[0] for row in rows]
+
+
+## Loans in chunks (or only some columns of them, or only the ones matching the
+## cross-filters), for the engines that need every loan
+def query_chunks(database, chunk_rows=DEFAULT_CHUNK_ROWS, columns=None, filters=None):
+    select = ', '.join(quote(column) for column in columns) if columns else '*'
+    where, params = filter_clause(filters)
+    for chunk in pd.read_sql_query(f"SELECT {select} FROM {TABLE}{where}", connect(database), params=params,
+                                   chunksize=chunk_rows):
+        if 'funded_date' in chunk:
+            chunk['funded_date'] = pd.to_datetime(chunk['funded_date'])
+        yield chunk
+
+
+def query_columns(database, columns):
+    return pd.concat(query_chunks(database, columns=columns), ignore_index=True)
+
+
+## Aggregates (see aggregates.py) of the database: the cube, the cohort matrix, the
+## histograms and the ZIP table, each from GROUP BY queries, the loans stay on disk
+def database_aggregates(database):
+    return {'cube': query_partial_cube(database), 'value_counts': None, 'loan_ids': None,
+            'cohorts': query_cohorts(database), 'histograms': query_histograms(database), 'zips': query_zips(database),
+            'rows': query_rows(database)}
+
+
+# New loans (live refresh) folded into the aggregates of the database, like
+# aggregates.fold_chunk, without reading the loans already there
+def fold_database_chunk(aggregates, chunk):
+    return dict(aggregates,
+                cube=merge_cubes([aggregates['cube'], partial_cube(chunk)]),
+                cohorts=merge_cohorts(aggregates['cohorts'], build_cohorts(chunk)),
+                histograms=merge_histograms(aggregates['histograms'], build_histograms(chunk)),
+                zips=merge_zips(aggregates['zips'], partial_zips(chunk)),
+                rows=aggregates['rows'] + len(chunk))
+
+
+## Cohort matrix (see cohorts.py) computed by the database: loans of one cohort (the
+## quarter ordinal is the stored month ordinal / 3), age and rate share their repayment
+## shape, so one GROUP BY on those keys leaves a row per group to expand into months
+def query_cohorts(database):
+    age = f'MIN(MAX(MIN("total past payments", "duration months"), 0), {MAX_MONTHS})'
+    groups = pd.read_sql_query(
+        f'SELECT year_month / 3 AS cohort, {age} AS age, "interest rate" AS rate, TOTAL(funded_amount) AS funded, '
+        f'TOTAL(funded_amount - MAX("loan balance", 0)) AS repaid, COUNT(*) AS loans '
+        f'FROM {TABLE} GROUP BY cohort, age, rate', connect(database))
+    if groups.empty:
+        return empty_cohorts()
+    return cohort_sums(groups['cohort'].to_numpy(dtype='int64'), groups['funded'].to_numpy(dtype='float64'),
+                       groups['repaid'].to_numpy(dtype='float64'), groups['loans'].to_numpy(dtype='float64'),
+                       groups['rate'].to_numpy(dtype='float64') / 12, groups['age'].to_numpy(dtype='int64'))
+
+
+## Histograms (see sketches.py) computed by the database: one GROUP BY per metric on the
+## bin expression of build_histograms, so only the non-empty bins are read back
+def query_histograms(database, filters=None):
+    where, params = filter_clause(filters)
+    keys = pd.read_sql_query(f"SELECT DISTINCT purpose, year_month AS month FROM {TABLE}{where} ORDER BY purpose, month",
+                             connect(database), params=params)
+    if keys.empty:
+        return empty_histograms()
+    keys = pd.MultiIndex.from_arrays([keys['purpose'].astype(object), keys['month'].astype('int64')],
+                                     names=SKETCH_KEYS)
+
+    counts = np.zeros((len(keys), len(SKETCH_METRICS), BINS), dtype='int64')
+    for position, (metric, (low, high)) in enumerate(SKETCH_METRICS.items()):
+        column = quote(metric)
+        valid = f"{column} IS NOT NULL AND ABS({column}) <= {sys.float_info.max!r}"
+        bins = pd.read_sql_query(
+            f"SELECT purpose, year_month AS month, "
+            f"MIN(MAX(CAST(({column} - {low!r}) * {BINS / (high - low)!r} AS INTEGER), 0), {BINS - 1}) AS bin, "
+            f"COUNT(*) AS loans FROM {TABLE}{where + ' AND ' if where else ' WHERE '}{valid} "
+            f"GROUP BY purpose, month, bin", connect(database), params=params)
+        rows = keys.get_indexer(pd.MultiIndex.from_arrays([bins['purpose'], bins['month']]))
+        counts[rows, position, bins['bin'].to_numpy()] = bins['loans'].to_numpy()
+    return {'keys': keys, 'counts': counts}
+
+
+## ZIP table (see geography.partial_zips) computed by the database: one GROUP BY on the
+## stored month ordinal, so only the purpose x month x ZIP rows are read back
+def query_zips(database, filters=None):
+    where, params = filter_clause(filters)
+    sums = ['COUNT(*) AS loans', 'TOTAL(funded_amount) AS funded_amount']
+    for metric in ('ltv', 'interest rate percent'):
+        sums += [f'TOTAL({quote(metric)}) AS "{metric} sum"', f'COUNT({quote(metric)}) AS "{metric} count"']
+    zips = pd.read_sql_query(
+        f'SELECT purpose, year_month AS month, "ZIP CODE" AS zip, {", ".join(sums)} '
+        f'FROM {TABLE}{where} GROUP BY purpose, year_month, "ZIP CODE" ORDER BY purpose, year_month, "ZIP CODE"',
+        connect(database), params=params)
+    if zips.empty:
+        return empty_zips()
+
+    # TOTAL() is always a float and COUNT() an integer, as the pandas sums and counts
+    zips['purpose'] = zips['purpose'].astype(object)
+    for column in ZIP_SUMS:
+        zips[column] = zips[column].astype('int64' if column == 'loans' or column.endswith(' count') else 'float64')
+    return zips.set_index(ZIP_KEYS)
+
+
+## One page of the drill-down table (see drilldown.table_page) read from the database.
+## The date range (first day, day after the last), cross-filters and table filter are
+## the WHERE clause; the page is a LIMIT / OFFSET in the order of the in-memory table
+## (funded date, then file order; missing values last when ascending).
+def query_table_page(database, days, filters, sort_by, filter_query, page_current, page_size):
+    where, params = filter_clause(filters)
+    conditions = []
+    if days:
+        conditions.append('funded_date >= ? AND funded_date < ?')
+        params.extend(days)
+    for filter_part in (filter_query or '').split(' && '):
+        column, operator, value = split_filter_part(filter_part)
+        if column in TABLE_COLUMNS:
+            condition, value = table_condition(column, operator, value)
+            conditions.append(condition)
+            params.extend(value)
+    if conditions:
+        where += (' AND ' if where else ' WHERE ') + ' AND '.join(conditions)
+
+    order = ['funded_date', 'rowid']
+    direction = ''
+    if sort_by and sort_by[0]['column_id'] in TABLE_COLUMNS:
+        column = quote(sort_by[0]['column_id'])
+        order = [f'{column} IS NULL', column] + order
+        direction = ' DESC' if sort_by[0]['direction'] == 'desc' else ''
+
+    conn = connect(database)
+    loans = conn.execute(f"SELECT COUNT(*) FROM {TABLE}{where}", params).fetchone()[0]
+    page = pd.read_sql_query(
+        f"SELECT {', '.join(quote(column) for column in TABLE_COLUMNS)} FROM {TABLE}{where} "
+        f"ORDER BY {', '.join(key + direction for key in order)} LIMIT ? OFFSET ?",
+        conn, params=params + [page_size, page_current * page_size])
+    return page_records(page), max(1, -(-loans // page_size))
+
+
+# SQL of one table filter (see drilldown.filter_mask) and its parameters. Ordering a text
+# column against a number, or a number against text, matches nothing as in pandas.
+def table_condition(column, operator, value):
+    name = quote(column)
+    text = LOAN_COLUMNS.get(column) is object
+    if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+        if operator not in ('eq', 'ne') and text != isinstance(value, str):
+            return '0', []
+        sql = {'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>='}[operator]
+        return f'{name} {sql} ?', [value]
+    if operator == 'contains':
+        return f'instr(lower(CAST({name} AS TEXT)), lower(?)) > 0', [str(value)]
+    if operator == 'datestartswith':
+        return f'substr(CAST({name} AS TEXT), 1, ?) = ?', [len(str(value)), str(value)]
+    return '1', []
+
+
+## Parity check: the cube of both backends, whole portfolio and with filters
+def compare_cubes(expected, actual):
+    if not expected.index.equals(actual.index) or list(expected.columns) != list(actual.columns):
+        return float('inf')
+    left, right = expected.to_numpy(dtype='float64'), actual.to_numpy(dtype='float64')
+    both = np.isnan(left) & np.isnan(right)
+    scale = np.maximum(np.abs(left), 1)
+    difference = np.where(both, 0, np.abs(left - right) / scale)
+    return float(np.nanmax(difference, initial=0)) if not np.isnan(difference).any() else float('inf')
+
+
+def parity_check(path, rtol=1e-9):
+    lp_df = load_portfolio(path)
+    database = open_database(path)
+    first = {column: [to_python(lp_df[column].iloc[0])] for column in FILTER_COLUMNS}
+    cases = [{}] + [{column: values} for column, values in first.items()]
+    cases.append({FILTER_COLUMNS[0]: first[FILTER_COLUMNS[0]], FILTER_COLUMNS[-1]: first[FILTER_COLUMNS[-1]]})
+    # A selection matching no loans
+    cases.append({FILTER_COLUMNS[0]: first[FILTER_COLUMNS[0]], FILTER_COLUMNS[1]: ['no such value']})
+
+    failures = 0
+    for filters in cases:
+        mask = np.ones(len(lp_df), dtype=bool)
+        for column, values in filters.items():
+            mask &= lp_df[column].isin(values).to_numpy()
+        difference = max(compare_cubes(build_cube(lp_df[mask]), period_cube(query_partial_cube(database, filters))),
+                         compare_cubes(zip_totals(partial_zips(lp_df[mask])), zip_totals(query_zips(database, filters))),
+                         compare_histograms(build_histograms(lp_df[mask]), query_histograms(database, filters)))
+        ok = difference <= rtol
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {filters or 'all loans'}: max relative difference {difference:.3g}")
+
+    difference = compare_cohorts(build_cohorts(lp_df), query_cohorts(database))
+    ok = difference <= rtol
+    print(f"{'ok  ' if ok else 'FAIL'} cohort matrix: max relative difference {difference:.3g}")
+    return failures + (not ok)
+
+
+def compare_histograms(expected, actual):
+    if not expected['keys'].equals(actual['keys']):
+        return float('inf')
+    return 0.0 if np.array_equal(expected['counts'], actual['counts']) else float('inf')
+
+
+def compare_cohorts(expected, actual):
+    if not np.array_equal(expected['cohorts'], actual['cohorts']):
+        return float('inf')
+    difference = 0.0
+    for name in ('funded', 'repaid', 'loans'):
+        if expected[name].shape != actual[name].shape:
+            return float('inf')
+        scale = np.maximum(np.abs(expected[name]), 1)
+        difference = max(difference, float(np.max(np.abs(expected[name] - actual[name]) / scale, initial=0)))
+    return difference
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the SQLite backend of a portfolio and check it against pandas')
+    parser.add_argument('path', nargs='?', default=os.environ.get('LOAN_DATA_PATH', "Data/LuxuryLoanPortfolio.csv"))
+    parser.add_argument('--check', action='store_true', help='compare the aggregates of both backends')
+    args = parser.parse_args()
+
+    print(open_database(args.path))
+    if args.check:
+        sys.exit(1 if parity_check(args.path) else 0)
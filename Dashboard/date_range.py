@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from cube import CUBE_KEYS, CUBE_METRICS, ALL_PURPOSE
+
+
+## Prefix-sum index over the cube.
+## For every purpose (and "All") the additive columns (counts and sums) are laid
+## out over every month in order and accumulated, so the totals of any month
+## range are two searchsorted calls and one subtraction, whatever the portfolio size.
+def build_date_index(cube):
+    columns = [column for column in cube.columns if column[1] in ('count', 'sum')]
+    months = np.array(sorted(cube.index.get_level_values('year_month').unique()))
+    purposes = list(cube.index.get_level_values('purpose').unique()) or [ALL_PURPOSE]
+
+    full = pd.MultiIndex.from_product([purposes, months], names=CUBE_KEYS)
+    values = cube[columns].reindex(full, fill_value=0).to_numpy(dtype='float64')
+    values = values.reshape(len(purposes), len(months), len(columns))
+
+    cumsum = np.zeros((len(purposes), len(months) + 1, len(columns)))
+    np.cumsum(values, axis=1, out=cumsum[:, 1:])
+    return {'months': months, 'purposes': purposes, 'columns': pd.MultiIndex.from_tuples(columns), 'cumsum': cumsum}
+
+
+# Positions [lo, hi) of the months inside [start, end]; None leaves that side open
+def month_bounds(index, start=None, end=None):
+    months = index['months']
+    lo = 0 if start is None else int(np.searchsorted(months, start, side='left'))
+    hi = len(months) if end is None else int(np.searchsorted(months, end, side='right'))
+    return lo, max(lo, hi)
+
+
+## Totals per purpose between two months (inclusive), from prefix-sum differences
+def range_totals(index, start=None, end=None):
+    lo, hi = month_bounds(index, start, end)
+    values = index['cumsum'][:, hi] - index['cumsum'][:, lo]
+
+    totals = pd.DataFrame(values, index=pd.Index(index['purposes'], name='purpose'), columns=index['columns'])
+    for metric in CUBE_METRICS:
+        totals[(metric, 'mean')] = totals[(metric, 'sum')] / totals[(metric, 'count')].where(totals[(metric, 'count')] > 0)
+    return totals.sort_index(axis=1)
+
+
+## Cube restricted to the months between start and end (inclusive)
+def range_cube(cube, index, start=None, end=None):
+    lo, hi = month_bounds(index, start, end)
+    if lo == 0 and hi == len(index['months']):
+        return cube
+    if lo == hi:
+        return cube.iloc[:0]
+    months = cube.index.get_level_values('year_month')
+    return cube[(months >= index['months'][lo]) & (months <= index['months'][hi - 1])]
+
+
+## Slider positions are month ordinals (year * 12 + month - 1)
+def month_ordinal(year_month):
+    year, month = str(year_month).split('-')
+    return int(year) * 12 + int(month) - 1
+
+
+def ordinal_month(ordinal):
+    return f"{int(ordinal) // 12:04d}-{int(ordinal) % 12 + 1:02d}"
+
+
+# Min, max and one mark per January for the date range slider
+def slider_range(index):
+    first, last = month_ordinal(index['months'][0]), month_ordinal(index['months'][-1])
+    marks = {o: {'label': str(o // 12)} for o in range(first, last + 1) if o % 12 == 0}
+    return first, last, marks
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+# Loan-level columns shown in the drill-down table, with the decimals they are sent with
+TABLE_COLUMNS = {
+    'loan_id': None,
+    'funded_amount': 2,
+    'interest rate percent': 3,
+    'ltv': 3,
+    'loan balance': 2,
+    'purpose': None,
+}
+
+FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='],
+                    ['contains '], ['datestartswith ']]
+
+
+## Sort permutations: for every table column, the row order sorting it ascending
+def build_sort_index(lp_df):
+    return {column: np.argsort(lp_df[column].to_numpy(), kind='stable') for column in TABLE_COLUMNS}
+
+
+# Sort permutations after new rows were merged in (see loader.merge_positions): the old
+# order is remapped to the moved rows and the sorted new rows are inserted into it
+def insert_sort_index(sort_index, lp_df, old_rows, new_rows):
+    merged = {}
+    for column, order in sort_index.items():
+        values = lp_df[column].to_numpy()
+        order = old_rows[order]
+        added = new_rows[np.argsort(values[new_rows], kind='stable')]
+        merged[column] = np.insert(order, np.searchsorted(values[order], values[added], side='right'), added)
+    return merged
+
+
+## DataTable filter query ("{ltv} > 0.8 && {purpose} contains Home") to (column, operator, value)
+def split_filter_part(filter_part):
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+                value_part = value_part.strip()
+                v0 = value_part[0] if value_part else ''
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                return name, operator_type[0].strip(), value
+    return [None] * 3
+
+
+# Categoricals are tested once per category, then mapped to the rows through their codes
+def column_mask(values, test):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        matches = test(pd.Series(values.cat.categories)).to_numpy(dtype=bool)
+        return np.append(matches, False)[values.cat.codes.to_numpy()]
+    return test(values).to_numpy(dtype=bool)
+
+
+def filter_mask(lp_df, filter_query):
+    mask = np.ones(len(lp_df), dtype=bool)
+    for filter_part in (filter_query or '').split(' && '):
+        column, operator, value = split_filter_part(filter_part)
+        if column not in TABLE_COLUMNS:
+            continue
+        values = lp_df[column]
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            try:
+                mask &= column_mask(values, lambda v: getattr(v, operator)(value))
+            except TypeError:
+                # e.g. "{purpose} > 3": nothing matches
+                mask[:] = False
+        elif operator == 'contains':
+            mask &= column_mask(values, lambda v: v.astype(str).str.contains(str(value), case=False, regex=False))
+        elif operator == 'datestartswith':
+            mask &= column_mask(values, lambda v: v.astype(str).str.startswith(str(value)))
+    return mask
+
+
+## One page of the selection.
+## `selected` is a boolean mask of the rows in the current selection (None for all).
+## Only the requested page is converted to records.
+def table_page(lp_df, sort_index, selected, sort_by, filter_query, page_current, page_size):
+    if filter_query:
+        selected = filter_mask(lp_df, filter_query) if selected is None else selected & filter_mask(lp_df, filter_query)
+
+    if sort_by and sort_by[0]['column_id'] in sort_index:
+        order = sort_index[sort_by[0]['column_id']]
+        if sort_by[0]['direction'] == 'desc':
+            order = order[::-1]
+        if selected is not None:
+            order = order[selected[order]]
+    elif selected is not None:
+        order = np.flatnonzero(selected)
+    else:
+        order = np.arange(len(lp_df))
+
+    page_count = max(1, -(-len(order) // page_size))
+    rows = order[page_current * page_size: (page_current + 1) * page_size]
+
+    return page_records(lp_df.iloc[rows][list(TABLE_COLUMNS)]), page_count
+
+
+def page_records(page):
+    page = page.copy()
+    for column, decimals in TABLE_COLUMNS.items():
+        if decimals is not None:
+            page[column] = page[column].round(decimals)
+    return page.to_dict('records')
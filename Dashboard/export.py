@@ -0,0 +1,238 @@
+import argparse
+import concurrent.futures
+import datetime
+import html
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+
+from scenarios import shutdown_pools
+
+# Static snapshot of the dashboard: every figure for every purpose and the KPI cards,
+# pre-rendered to JSON figure specs next to one HTML page. Any static web server or
+# CDN can serve the bundle; the purpose dropdown only swaps which JSON file is drawn.
+#
+#   python export.py --out snapshot
+#   python -m http.server --directory snapshot
+#
+# Figures are built in parallel by forked worker processes that share the loaded data.
+
+DEFAULT_OUT = "snapshot"
+# The snapshot has no metric dropdowns: the distribution and geographic exposure are
+# drawn for the dashboard's defaults
+DISTRIBUTION_METRIC = 'interest rate percent'
+GEO_METRIC = 'funded_amount'
+
+main = None
+portfolio = None
+
+
+## What gets exported: graph id -> builder of the whole-portfolio figures, and of the
+## figures drawn for one purpose
+def portfolio_figures():
+    lp = main.portfolio_state(portfolio)
+    totals = main.range_totals(lp['index'])
+    figures = {
+        'demographic-graph': lambda: main.demographic(totals),
+        'interest-purpose-graph': lambda: main.draw_interest_purpose_graph(lp['cube']),
+        'interest-graph': lambda: main.draw_interest_graph(lp['cube']),
+        'funding-duration-graph': lambda: main.avg_funding_duration(totals),
+        'vintage-graph': lambda: main.vintage_graph(main.vintage_curves(
+            main.cohort_matrix(lp), main.default_cohorts(main.cohort_labels(main.cohort_matrix(lp))))),
+        'geo-zip-graph': lambda: main.geo_zip_graph(main.zip_selection(portfolio=portfolio), GEO_METRIC),
+    }
+    # The map needs the ZIP centroid lookup, like on the dashboard
+    if len(main.ZIP_CENTROIDS):
+        figures['geo-map'] = lambda: main.geo_map(main.map_points(
+            main.zip_selection(portfolio=portfolio), main.ZIP_CENTROIDS, main.MAX_MAP_POINTS), GEO_METRIC)
+    return figures
+
+
+def purpose_figures():
+    lp = main.portfolio_state(portfolio)
+    return {
+        'loan-constant-graph': lambda purpose: main.loan_constant(lp['cube'], purpose),
+        'ltv-graph': lambda purpose: main.loan_value(lp['cube'], purpose),
+        'distribution-graph': lambda purpose: main.distribution_graph(
+            main.histogram_selection(DISTRIBUTION_METRIC, purpose, portfolio=portfolio)),
+        'cashflow-graph': lambda purpose: main.projected_cash_flows(
+            main.cash_flow_projection(portfolio), purpose),
+        'scenario-mortgage-constant-graph': lambda purpose: main.scenario_comparison(
+            main.scenario_results(list(main.SCENARIOS), portfolio=portfolio), 'mortgage_constant', purpose),
+        'scenario-ltv-graph': lambda purpose: main.scenario_comparison(
+            main.scenario_results(list(main.SCENARIOS), portfolio=portfolio), 'ltv', purpose),
+    }
+
+
+def slug(purpose):
+    return purpose.lower().replace(' ', '-')
+
+
+def figure_file(graph, purpose=None):
+    return os.path.join('figures', graph + '.json' if purpose is None else os.path.join(graph, slug(purpose) + '.json'))
+
+
+## Worker side: build one figure and write its JSON spec, return the file and its size
+def render_figure(out, graph, purpose=None):
+    if purpose is None:
+        fig = portfolio_figures()[graph]()
+    else:
+        fig = purpose_figures()[graph](purpose)
+    path = figure_file(graph, purpose)
+    os.makedirs(os.path.dirname(os.path.join(out, path)), exist_ok=True)
+    with open(os.path.join(out, path), 'w') as f:
+        f.write(fig.to_json())
+    return path, os.path.getsize(os.path.join(out, path))
+
+
+## HTML page of the bundle: the KPI cards are inlined, figures are fetched as JSON
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Luxury Loan Dashboard</title>
+<link rel="stylesheet" href="assets/file.css">
+<script src="assets/plotly.min.js"></script>
+</head>
+<body style="background-color: {background}; color: {text};">
+<div class="row">
+  <div class="header">
+    <h1 class="title" style="text-align: center; color: {text}; background-color: {background};">Luxury Loan Dashboard</h1>
+    <div class="sub-title"><span>Snapshot of {generated}</span></div>
+  </div>
+  {cards}
+  {sections}
+</div>
+<script>
+var manifest = {manifest};
+function draw(id, path) {{
+  fetch(path).then(function(response) {{ return response.json(); }}).then(function(fig) {{
+    Plotly.react(id, fig.data, fig.layout, {{responsive: true}});
+  }});
+}}
+function selectPurpose(purpose) {{
+  manifest.purpose_figures.forEach(function(id) {{ draw(id, manifest.files[id][purpose]); }});
+}}
+manifest.static_figures.forEach(function(id) {{ draw(id, manifest.files[id]); }});
+document.getElementById('purpose').addEventListener('change', function(event) {{ selectPurpose(event.target.value); }});
+selectPurpose(manifest.purposes[0]);
+</script>
+</body>
+</html>
+"""
+
+CARDS = [('Number of Loan Given: ', 'number_of_loan'), ('Total Funded Amount: ', 'total_funded_amount'),
+         ('Average Interest Rate: ', 'interest_rate')]
+
+SECTIONS = [
+    ('Purpose Demographic', [('demographic-graph', 'graph demographic columns')]),
+    ('Interest Rate', [('interest-purpose-graph', 'interest columns'), ('interest-graph', 'interest columns')]),
+    ('Average Funding and Duration', [('funding-duration-graph', 'graph average funding duration columns')]),
+    ('Mortgage Constant and Loan to Value Ratio', [('loan-constant-graph', 'lc ltv columns'), ('ltv-graph', 'lc ltv columns')]),
+    ('Interest Rate Distribution', [('distribution-graph', 'twelve columns')]),
+    ('Geographic Exposure', [('geo-map', 'twelve columns'), ('geo-zip-graph', 'twelve columns')]),
+    ('Projected Cash Flows', [('cashflow-graph', 'twelve columns')]),
+    ('Rate-Shock Scenarios', [('scenario-mortgage-constant-graph', 'lc ltv columns'), ('scenario-ltv-graph', 'lc ltv columns')]),
+    ('Vintage Curves', [('vintage-graph', 'twelve columns')]),
+]
+
+
+def render_page(kpis, manifest):
+    colors = main.colors
+    cards = ''.join(
+        f'<div class="loan descriptive columns" style="background-color: #393939; border-radius: 12px;">'
+        f'<h4 style="text-align: center; color: {colors[color]};">{html.escape(title)}</h4>'
+        f'<p style="text-align: center; color: {colors[color]}; font-size: 30px;">{html.escape(value)}</p></div>'
+        for (title, color), value in zip(CARDS, kpis))
+
+    options = ''.join(f'<option value="{html.escape(p)}">{html.escape(p)}</option>' for p in manifest['purposes'])
+    sections = []
+    for title, graphs in SECTIONS:
+        section = f'<h4 class="twelve columns" style="text-align: center;">{html.escape(title)}</h4>'
+        if title == 'Mortgage Constant and Loan to Value Ratio':
+            section += (f'<div style="width: 100%; display: flex; justify-content: center;">'
+                        f'<select id="purpose" style="width: 50%; color: #000000;">{options}</select></div>')
+        section += ''.join(f'<div class="{css}"><div id="{graph}"></div></div>' for graph, css in graphs
+                           if graph in manifest['files'])
+        sections.append(f'<div class="twelve columns">{section}</div>')
+
+    return PAGE.format(background=colors['background'], text=colors['text'], generated=manifest['generated'],
+                       cards=cards, sections='\n  '.join(sections), manifest=json.dumps(manifest))
+
+
+def copy_assets(out):
+    import plotly
+    assets = os.path.join(out, 'assets')
+    os.makedirs(assets, exist_ok=True)
+    shutil.copy(os.path.join(os.path.dirname(plotly.__file__), 'package_data', 'plotly.min.js'), assets)
+    for name in os.listdir('Assets'):
+        shutil.copy(os.path.join('Assets', name), assets)
+
+
+## Export the bundle of a portfolio (default: the first registered) to `out`, building
+## the figures in `workers` processes
+def export(out=DEFAULT_OUT, workers=None, name=None):
+    global main, portfolio
+    os.environ.setdefault('LOAN_WARMUP', '0')
+    import main as dashboard
+    main = dashboard
+    portfolio = name or main.DEFAULT_PORTFOLIO
+    start = time.perf_counter()
+
+    # Shared inputs are computed once here, before the workers are forked. The scenario
+    # pool is stopped first: forking a process with live pool threads could hand a child
+    # one of their locks, held forever.
+    kpis, _ = main.static_figures(portfolio)
+    main.cash_flow_projection(portfolio)
+    main.scenario_results(list(main.SCENARIOS), portfolio=portfolio)
+    shutdown_pools()
+
+    tasks = [(graph, None) for graph in portfolio_figures()]
+    tasks += [(graph, purpose) for graph in purpose_figures() for purpose in main.PURPOSE_OPTIONS]
+
+    os.makedirs(out, exist_ok=True)
+    sizes = {}
+    context = multiprocessing.get_context('fork')
+    with concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count(), mp_context=context) as pool:
+        futures = [pool.submit(render_figure, out, graph, purpose) for graph, purpose in tasks]
+        for future in concurrent.futures.as_completed(futures):
+            path, size = future.result()
+            sizes[path] = size
+
+    manifest = {
+        'generated': datetime.datetime.now().isoformat(timespec='seconds'),
+        'portfolio': portfolio,
+        'data_path': main.PORTFOLIOS[portfolio],
+        'kpis': list(kpis),
+        'purposes': main.PURPOSE_OPTIONS,
+        'static_figures': list(portfolio_figures()),
+        'purpose_figures': list(purpose_figures()),
+        'files': {graph: figure_file(graph) for graph in portfolio_figures()},
+    }
+    for graph in purpose_figures():
+        manifest['files'][graph] = {purpose: figure_file(graph, purpose) for purpose in main.PURPOSE_OPTIONS}
+
+    copy_assets(out)
+    with open(os.path.join(out, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    with open(os.path.join(out, 'index.html'), 'w') as f:
+        f.write(render_page(kpis, manifest))
+
+    print(f"{len(sizes)} figures, {sum(sizes.values()) / 2 ** 20:.1f} MB, in {time.perf_counter() - start:.1f}s -> {out}")
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a static snapshot of the dashboard')
+    parser.add_argument('--out', default=DEFAULT_OUT, help='bundle directory (default snapshot/)')
+    parser.add_argument('--workers', type=int, help='processes building figures (default: one per core)')
+    parser.add_argument('--portfolio', help='registered portfolio to export (default: the first one)')
+    args = parser.parse_args()
+
+    out = os.path.abspath(args.out)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    export(out, args.workers, args.portfolio)
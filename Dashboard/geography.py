@@ -0,0 +1,143 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# Geographic exposure: a ZIP-level aggregate table per purpose x month x ZIP code, kept
+# with the other aggregates, and an offline ZIP centroid lookup to place it on a map.
+#
+# The lookup is a small CSV (zip, lat, lon) built once from the US Census ZCTA gazetteer
+# file (https://www.census.gov/geographies/reference-files/time-series/geo/gazetteer-files.html),
+# downloaded on the way, or from a copy already on disk:
+#
+#   python geography.py
+#   python geography.py 2020_Gaz_zcta_national.txt
+
+CENTROIDS_PATH = "Data/zip_centroids.csv"
+GAZETTEER_URL = "https://www2.census.gov/geo/docs/maps-data/data/gazetteer/2020_Gazetteer/2020_Gaz_zcta_national.zip"
+MAX_MAP_POINTS = 500
+
+ZIP_KEYS = ['purpose', 'month', 'zip']
+ZIP_SUMS = ['loans', 'funded_amount', 'ltv sum', 'ltv count', 'interest rate percent sum',
+            'interest rate percent count']
+ZIP_METRICS = {
+    'funded_amount': 'Funded Amount',
+    'loans': 'Number of Loans',
+    'ltv': 'Average LTV',
+    'interest rate percent': 'Average Interest Rate',
+}
+
+
+## ZIP table of preprocessed loans: sums per purpose, month ordinal (year * 12 + month - 1)
+## and ZIP code, mergeable like the cube
+def partial_zips(lp_df):
+    dates = lp_df['funded_date'].dt
+    grouped = lp_df.groupby([lp_df['purpose'], (dates.year * 12 + dates.month - 1).rename('month'),
+                             lp_df['ZIP CODE'].rename('zip')], observed=True)
+    part = pd.DataFrame({
+        'loans': grouped.size(),
+        'funded_amount': grouped['funded_amount'].sum(),
+        'ltv sum': grouped['ltv'].sum(),
+        'ltv count': grouped['ltv'].count(),
+        'interest rate percent sum': grouped['interest rate percent'].sum(),
+        'interest rate percent count': grouped['interest rate percent'].count(),
+    })
+    purposes, months, zips = part.index.levels
+    part.index = part.index.set_levels([pd.Index(purposes.astype(str), dtype=object), months.astype('int64'),
+                                        zips.astype('int64')])
+    return part
+
+
+def merge_zips(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return pd.concat([left, right]).groupby(level=ZIP_KEYS).sum()
+
+
+## Exposure per ZIP for some purposes (None for all) and months between two ordinals
+## (inclusive): the summed columns and the averages read from them
+def zip_totals(zips, purposes=None, start=None, end=None):
+    if zips is None:
+        zips = empty_zips()
+    keep = np.ones(len(zips), dtype=bool)
+    if purposes is not None:
+        keep &= zips.index.get_level_values('purpose').isin(purposes)
+    months = zips.index.get_level_values('month')
+    if start is not None:
+        keep &= months >= start
+    if end is not None:
+        keep &= months <= end
+    return exposure(zips[keep].groupby(level='zip').sum())
+
+
+def empty_zips():
+    keys = pd.MultiIndex.from_arrays([pd.Index([], dtype=object), pd.Index([], dtype='int64'),
+                                      pd.Index([], dtype='int64')], names=ZIP_KEYS)
+    return pd.DataFrame({column: pd.Series(dtype='float64') for column in ZIP_SUMS}).set_index(keys)
+
+
+def exposure(sums):
+    sums = sums.copy()
+    for metric in ('ltv', 'interest rate percent'):
+        count = sums[f'{metric} count']
+        sums[metric] = sums[f'{metric} sum'] / count.where(count > 0)
+    return sums
+
+
+## Offline centroid lookup: latitude and longitude per ZIP code, empty when not built
+def load_centroids(path=CENTROIDS_PATH):
+    if not os.path.exists(path):
+        return pd.DataFrame({'lat': [], 'lon': []}, index=pd.Index([], dtype='int64', name='zip'))
+    return pd.read_csv(path, dtype={'zip': 'int64', 'lat': 'float64', 'lon': 'float64'}).set_index('zip')
+
+
+# The gazetteer is a path or URL, zipped or not
+def build_centroids(gazetteer=GAZETTEER_URL, path=CENTROIDS_PATH):
+    table = pd.read_csv(gazetteer, sep='\t', dtype={'GEOID': str}, compression='infer')
+    table.columns = table.columns.str.strip()
+    centroids = pd.DataFrame({'zip': table['GEOID'].astype('int64'), 'lat': table['INTPTLAT'].round(5),
+                              'lon': table['INTPTLONG'].round(5)})
+    centroids.to_csv(path, index=False)
+    return len(centroids)
+
+
+## Map points of the ZIP exposure. Past max_points ZIPs, they are binned on a
+## latitude / longitude grid, coarser until it fits; each bin is drawn at the
+## funded-weighted centroid of its ZIPs with their summed exposure.
+def map_points(totals, centroids, max_points=MAX_MAP_POINTS):
+    located = totals.join(centroids, how='inner')
+    located = located[located['loans'] > 0]
+    if len(located) <= max_points:
+        points = located.copy()
+        points['label'] = [f"{zip_code:05d}" for zip_code in points.index]
+        return points
+
+    weights = located['funded_amount'].where(located['funded_amount'] > 0, 1)
+    sums = located[ZIP_SUMS].assign(lat=located['lat'] * weights, lon=located['lon'] * weights, weight=weights,
+                                    zips=1)
+    size = 0.05
+    while True:
+        cells = [np.floor(located['lat'] / size).astype('int64'), np.floor(located['lon'] / size).astype('int64')]
+        binned = sums.groupby(cells).sum()
+        if len(binned) <= max_points:
+            break
+        size *= 2
+
+    points = exposure(binned)
+    points['lat'] = binned['lat'] / binned['weight']
+    points['lon'] = binned['lon'] / binned['weight']
+    points['label'] = [f"{int(zips)} ZIPs" for zips in binned['zips']]
+    return points.reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the offline ZIP centroid lookup from the Census ZCTA gazetteer')
+    parser.add_argument('gazetteer', nargs='?', default=GAZETTEER_URL,
+                        help='gazetteer ZCTA file (tab separated, GEOID / INTPTLAT / INTPTLONG), '
+                             'downloaded from the Census Bureau by default')
+    parser.add_argument('--out', default=CENTROIDS_PATH)
+    args = parser.parse_args()
+    print(f"{build_centroids(args.gazetteer, args.out)} ZIP centroids -> {args.out}")
@@ -0,0 +1,40 @@
+import multiprocessing
+import os
+
+# Production settings for: gunicorn -c gunicorn.conf.py wsgi:server
+# Every value can be overridden with the LOAN_* environment variables below.
+
+bind = os.environ.get('LOAN_BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('LOAN_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('LOAN_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.environ.get('LOAN_TIMEOUT', 120))
+
+# The portfolio is loaded once in the master and the workers are forked from it, so
+# the numpy arrays behind the aggregates, bitmaps and sort indexes are shared
+# copy-on-write; the loan columns themselves are memory-mapped from the cache files.
+preload_app = True
+os.environ.setdefault('LOAN_MMAP', '1')
+
+# Live refresh (LOAN_REFRESH_SECONDS) tails the data file in every worker on its own, so
+# the data version and loan counts would differ from one request to the next: it only
+# runs with a single worker (scale it with LOAN_THREADS instead)
+if workers > 1 and float(os.environ.get('LOAN_REFRESH_SECONDS', 0)):
+    print(f"LOAN_REFRESH_SECONDS ignored with {workers} workers: live refresh needs LOAN_WORKERS=1")
+    os.environ['LOAN_REFRESH_SECONDS'] = '0'
+
+# Figures are warmed up in each worker after the fork, not in the master (a thread
+# running across fork() is not safe), unless LOAN_WARMUP=0 turned warmup off
+warmup = os.environ.get('LOAN_WARMUP', '1') not in ('', '0')
+os.environ['LOAN_WARMUP'] = '0'
+
+
+def post_fork(server, worker):
+    if warmup:
+        from main import start_warmup
+        start_warmup()
+
+
+def post_worker_init(worker):
+    from memory import process_memory
+    worker.log.info("worker %s memory: %s", worker.pid, process_memory())
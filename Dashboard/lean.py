@@ -0,0 +1,149 @@
+import functools
+import gzip
+import sys
+
+import numpy as np
+import plotly.graph_objects as go
+import plotly.express as px
+import plotly.io as pio
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Lean figures: one small shared template instead of the full "plotly" template in
+# every figure, long line series downsampled with LTTB, compressed callback responses.
+#
+#   python lean.py    # long scatter and scattergl lines must come back downsampled
+
+# Only what the builders do not set themselves
+LEAN_TEMPLATE = go.layout.Template(layout=go.Layout(
+    colorway=px.colors.qualitative.Plotly,
+    hovermode='closest',
+    xaxis=dict(automargin=True, showgrid=True, gridcolor='#3A3A3A', zerolinecolor='#3A3A3A'),
+    yaxis=dict(automargin=True, showgrid=True, gridcolor='#3A3A3A', zerolinecolor='#3A3A3A'),
+))
+
+# Bytes saved are measured on the first build of a figure and then every REPORT_EVERY builds,
+# since it means serializing the figure twice
+REPORT_EVERY = 20
+
+settings = {'enabled': False, 'max_points': 1000, 'report': None}
+builds = {}
+
+
+def configure(enabled, max_points=1000, report=None):
+    settings.update(enabled=enabled, max_points=max_points, report=report)
+
+
+## Largest-Triangle-Three-Buckets: indices of `threshold` points keeping the shape of y.
+## x is taken as the point position (the series here are evenly spaced in time).
+def lttb(y, threshold):
+    y = np.asarray(y, dtype='float64')
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype='float64')
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        following = slice(edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x, avg_y = x[following].mean(), np.nanmean(y[following]) if np.isfinite(y[following]).any() else 0
+
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.nanargmax(area)) if np.isfinite(area).any() else start
+        selected[i + 1] = a
+    return selected
+
+
+# Plotly Express draws lines of 1000 points and more as scattergl, so both are downsampled
+LINE_TRACES = ('scatter', 'scattergl')
+
+
+def lean_figure(fig):
+    fig.update_layout(template=LEAN_TEMPLATE)
+    for trace in fig.data:
+        if trace.type in LINE_TRACES and trace.y is not None and len(trace.y) > settings['max_points']:
+            keep = lttb(trace.y, settings['max_points'])
+            trace.update(x=np.asarray(trace.x, dtype=object)[keep], y=np.asarray(trace.y)[keep])
+    return fig
+
+
+## Decorator for the figure builders: a no-op unless lean mode is on
+def leaned(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        fig = function(*args, **kwargs)
+        if not settings['enabled']:
+            return fig
+
+        count = builds[function.__name__] = builds.get(function.__name__, 0) + 1
+        measure = settings['report'] is not None and count % REPORT_EVERY == 1
+        before = len(pio.to_json(fig, validate=False)) if measure else None
+        fig = lean_figure(fig)
+        if measure:
+            settings['report'](function.__name__, before - len(pio.to_json(fig, validate=False)))
+        return fig
+    return wrapper
+
+
+## Response compression (brotli when installed and accepted, else gzip)
+COMPRESSIBLE = ('application/json', 'text/html', 'text/css', 'application/javascript', 'text/javascript')
+
+
+def compress_response(response, min_size, report=None):
+    accept = flask.request.headers.get('Accept-Encoding', '')
+    if (response.direct_passthrough or response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE):
+        return response
+
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+    if brotli is not None and 'br' in accept:
+        compressed, encoding = brotli.compress(body, quality=4), 'br'
+    elif 'gzip' in accept:
+        compressed, encoding = gzip.compress(body, compresslevel=5), 'gzip'
+    else:
+        return response
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Content-Length'] = len(compressed)
+    response.vary.add('Accept-Encoding')
+    if report is not None:
+        report(flask.request.path, len(body) - len(compressed))
+    return response
+
+
+def install_compression(server, min_size=1024, report=None):
+    server.after_request(lambda response: compress_response(response, min_size, report))
+
+
+## Check: long lines of both trace types come back downsampled to max_points
+def downsample_check(points=2000):
+    x = np.arange(points)
+    y = np.sin(x / 50.0)
+    figures = {
+        'scatter': go.Figure(go.Scatter(x=x, y=y, mode='lines')),
+        'scattergl': go.Figure(go.Scattergl(x=x, y=y, mode='lines')),
+        'px.line': px.line(x=x, y=y),
+    }
+    failures = 0
+    for name, fig in figures.items():
+        trace = lean_figure(fig).data[0]
+        ok = len(trace.y) == settings['max_points'] and trace.y[0] == y[0] and trace.y[-1] == y[-1]
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name} ({trace.type}): {points} -> {len(trace.y)} points")
+    return failures
+
+
+if __name__ == '__main__':
+    sys.exit(1 if downsample_check() else 0)
@@ -0,0 +1,283 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Columns kept by the feature selector and the dtype each one is read with.
+# Everything else in the CSV (names, social, phone, address...) is never parsed.
+LOAN_COLUMNS = {
+    "loan_id": object,
+    "funded_amount": "float64",
+    "funded_date": object,
+    "duration years": "int64",
+    "duration months": "int64",
+    "10 yr treasury index date funded": "float64",
+    "interest rate percent": "float64",
+    "interest rate": "float64",
+    "payments": "float64",
+    "total past payments": "int64",
+    "loan balance": "float64",
+    "property value": "float64",
+    "purpose": object,
+    "employment length": "int64",
+    "BUILDING CLASS CATEGORY": object,
+    "BUILDING CLASS AT PRESENT": object,
+    "TAX CLASS AT PRESENT": object,
+    "TAX CLASS AT TIME OF SALE": "int64",
+    "TOTAL UNITS": "int64",
+    "ZIP CODE": "int64",
+    "LAND SQUARE FEET": object,
+    "GROSS SQUARE FEET": object,
+}
+
+# Low-cardinality string columns, kept as stripped categoricals
+CATEGORY_COLUMNS = ["purpose", "BUILDING CLASS CATEGORY", "BUILDING CLASS AT PRESENT", "TAX CLASS AT PRESENT"]
+
+CACHE_DIR = ".cache"
+
+# concat() copies unless told otherwise before pandas 3 (copy-on-write, no copy keyword)
+NO_COPY = {'copy': False} if int(pd.__version__.split('.')[0]) < 3 else {}
+CACHE_VERSION = 6
+
+
+## Read the CSV, only the selected columns
+def read_portfolio_csv(path, **kwargs):
+    lp_df = pd.read_csv(path, usecols=list(LOAN_COLUMNS), dtype={k: v for k, v in LOAN_COLUMNS.items() if k != "funded_date"},
+                        **kwargs)
+    return lp_df
+
+
+## Pre-processing and Feature Engineering
+def preprocess(lp_df, compact=True):
+    lp_df = lp_df[list(LOAN_COLUMNS)].copy()
+    lp_df['funded_date'] = pd.to_datetime(lp_df['funded_date'])
+    if compact:
+        lp_df['year_month'] = month_ordinals(lp_df['funded_date'])
+    else:
+        lp_df['year_month'] = lp_df['funded_date'].dt.strftime('%Y-%m')
+    lp_df['purpose'] = lp_df['purpose'].str.title()
+    lp_df['mortgage_constant'] = (lp_df['payments']*12)/lp_df['funded_amount']
+    lp_df['ltv'] = lp_df['funded_amount'] / lp_df['property value']
+    return compact_frame(lp_df) if compact else lp_df
+
+
+# Month ordinals (year * 12 + month - 1), the loans' year_month
+def month_ordinals(dates):
+    return dates.dt.year * 12 + dates.dt.month - 1
+
+
+## Compaction: stripped categoricals for the low-cardinality strings and the narrowest
+## integer type for every integer column. Floats stay float64: the cube sums them,
+## and float32 sums of amounts would not match to the cent.
+def compact_frame(lp_df):
+    for column in lp_df.columns:
+        values = lp_df[column]
+        if column in CATEGORY_COLUMNS:
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                lp_df[column] = values.str.strip().astype('category')
+        elif values.dtype.kind in 'iu':
+            lp_df[column] = pd.to_numeric(values, downcast='integer')
+    return lp_df
+
+
+## Merge of new loans into loans kept in funded_date order, without sorting them again.
+## Positions in the merged frame of the old rows and of the new ones (sorted by date,
+## each after the old loans of the same day): appended loans only land at the end.
+def merge_positions(dates, new_dates):
+    insert = np.searchsorted(dates.to_numpy(), new_dates.to_numpy(), side='right')
+    new_rows = insert + np.arange(len(new_dates))
+    old_rows = np.arange(len(dates)) + np.searchsorted(insert, np.arange(len(dates)), side='right')
+    return old_rows, new_rows
+
+
+# Merged frame of compacted frames: new categories are added after the existing ones,
+# so the codes of lp_df stay valid, and the rows are only moved when loans were not
+# appended in date order
+def merge_frames(lp_df, new_df, old_rows, new_rows):
+    for column in CATEGORY_COLUMNS:
+        if isinstance(lp_df[column].dtype, pd.CategoricalDtype):
+            categories = lp_df[column].cat.categories
+            added = pd.Index(new_df[column].dropna().unique()).difference(categories)
+            if len(added):
+                categories = categories.append(added)
+                lp_df = lp_df.assign(**{column: lp_df[column].cat.set_categories(categories)})
+            new_df = new_df.assign(**{column: pd.Categorical(new_df[column], categories=categories)})
+    merged = pd.concat([lp_df, new_df], ignore_index=True)
+    if not len(new_rows) or new_rows[0] >= len(lp_df):
+        return merged
+    order = np.empty(len(merged), dtype=np.int64)
+    order[old_rows] = np.arange(len(lp_df))
+    order[new_rows] = np.arange(len(lp_df), len(merged))
+    return merged.take(order).reset_index(drop=True)
+
+
+## Memory of every column before and after compaction, in MB
+def memory_report(before, after):
+    report = pd.DataFrame({
+        'dtype before': before.dtypes.astype(str),
+        'MB before': before.memory_usage(deep=True, index=False) / 2 ** 20,
+        'dtype after': after.dtypes.astype(str),
+        'MB after': after.memory_usage(deep=True, index=False) / 2 ** 20,
+    })
+    report.loc['total'] = ['', report['MB before'].sum(), '', report['MB after'].sum()]
+    return report.round({'MB before': 3, 'MB after': 3})
+
+
+## Source signature: size and mtime are checked first, the hash only when they moved
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_signature(path, with_hash=True):
+    stat = os.stat(path)
+    signature = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if with_hash:
+        signature['sha1'] = file_digest(path)
+    return signature
+
+
+def cache_path(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, CACHE_DIR, os.path.splitext(name)[0])
+
+
+# Smallest signed type holding the codes; the one pandas itself uses for categoricals,
+# so mapped codes can back a Categorical without a copy
+def code_dtype(categories):
+    for dtype in (np.int8, np.int16, np.int32):
+        if categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+## Columnar cache: one .npy per column so numeric columns can be memory-mapped.
+## String columns are stored as integer codes plus their distinct values in meta.json.
+def write_cache(lp_df, directory, signature):
+    os.makedirs(directory, exist_ok=True)
+    columns = []
+    for column in lp_df.columns:
+        values = lp_df[column]
+        entry = {'name': column, 'file': f"{len(columns):03d}.npy"}
+        if values.dtype.kind in 'biufcM':
+            np.save(os.path.join(directory, entry['file']), values.to_numpy())
+            entry['kind'] = 'array'
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            categories = values.cat.categories
+            np.save(os.path.join(directory, entry['file']), values.cat.codes.to_numpy().astype(code_dtype(len(categories))))
+            entry['kind'] = 'category'
+            entry['categories'] = [str(c) for c in categories]
+        else:
+            codes, uniques = pd.factorize(values, use_na_sentinel=True)
+            np.save(os.path.join(directory, entry['file']), codes.astype(code_dtype(len(uniques))))
+            entry['kind'] = 'codes'
+            entry['categories'] = [str(u) for u in uniques]
+        columns.append(entry)
+
+    meta = {'version': CACHE_VERSION, 'source': signature, 'rows': len(lp_df), 'columns': columns}
+    write_cache_meta(directory, meta)
+
+
+# meta.json is written last and atomically, so a half-written cache is never picked up
+def write_cache_meta(directory, meta):
+    tmp = os.path.join(directory, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(directory, 'meta.json'))
+
+
+def read_cache_meta(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION:
+        return None
+    return meta
+
+
+# With mmap_mode the columns stay backed by the cache files, so every process that
+# maps them shares one copy in the page cache; string columns then come back as
+# categoricals over the mapped codes instead of being decoded to Python strings.
+def read_cache(directory, meta, mmap_mode=None):
+    columns = []
+    for entry in meta['columns']:
+        values = np.load(os.path.join(directory, entry['file']), mmap_mode=mmap_mode)
+        if entry['kind'] == 'category':
+            values = pd.Categorical.from_codes(values, categories=entry['categories'])
+        elif entry['kind'] == 'codes':
+            if mmap_mode:
+                values = pd.Categorical.from_codes(values, categories=entry['categories'])
+            else:
+                categories = np.array(entry['categories'] + [None], dtype=object)
+                values = categories[values]
+        columns.append(pd.Series(values, name=entry['name'], copy=False))
+    # Columns joined one block each: a frame built from a dict consolidates the columns
+    # of one dtype into a single block, i.e. copies them out of the mapping
+    return pd.concat(columns, axis=1, **NO_COPY)
+
+
+# Returns the cache metadata when it still matches the CSV, otherwise None
+def valid_cache(path, directory):
+    meta = read_cache_meta(directory)
+    if meta is None:
+        return None
+
+    cached = meta['source']
+    current = source_signature(path, with_hash=False)
+    if current['size'] != cached['size']:
+        return None
+    if current['mtime_ns'] == cached['mtime_ns']:
+        return meta
+
+    # Touched but possibly not changed (copied, re-downloaded...): compare content
+    if file_digest(path) != cached.get('sha1'):
+        return None
+    meta['source']['mtime_ns'] = current['mtime_ns']
+    try:
+        write_cache_meta(directory, meta)
+    except OSError:
+        pass
+    return meta
+
+
+## Load the preprocessed portfolio, from the cache when the CSV did not change
+def load_portfolio(path, use_cache=True, mmap_mode=None):
+    directory = cache_path(path)
+    if use_cache:
+        meta = valid_cache(path, directory)
+        if meta is not None:
+            return read_cache(directory, meta, mmap_mode)
+
+    # Loans are kept in funded_date order
+    lp_df = preprocess(read_portfolio_csv(path))
+    lp_df = lp_df.sort_values('funded_date', kind='stable', ignore_index=True)
+    if use_cache:
+        try:
+            write_cache(lp_df, directory, source_signature(path))
+        except OSError:
+            # Read-only data directory: serve from the CSV every time
+            return lp_df
+        if mmap_mode:
+            return read_cache(directory, read_cache_meta(directory), mmap_mode)
+    return lp_df
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    from cube import build_cube
+
+    raw = read_portfolio_csv(sys.argv[1] if len(sys.argv) > 1 else "Data/LuxuryLoanPortfolio.csv")
+    before, after = preprocess(raw, compact=False), preprocess(raw)
+    print(memory_report(before, after).to_string())
+    for name, frame in (('before', before), ('after', after)):
+        start = time.perf_counter()
+        build_cube(frame)
+        print(f"cube groupby {name} compaction: {time.perf_counter() - start:.4f}s")
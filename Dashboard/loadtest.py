@@ -0,0 +1,428 @@
+import argparse
+import collections
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from benchmark import REGRESSION_RATIO, environment
+
+# Load test: virtual analysts replaying callback sequences against /_dash-update-component.
+# Every virtual user loads the page (all initial callbacks), then changes dropdowns,
+# the date range and the cross-filters with some think time in between. Like the browser,
+# a change fires every callback that takes the changed property as input, and outputs
+# that are inputs of other callbacks (the cross-filter store) fire those in turn.
+#
+#   python loadtest.py --users 1 5 20 --duration 60
+#   python loadtest.py --size 1M --workers 2 --threads 8 --env LOAN_BACKEND=sqlite
+#   python loadtest.py --url http://analytics:8050 --users 10 --compare loadtests/previous.json
+#
+# Without --url a server is started locally (gunicorn when installed). Results are
+# written to loadtests/ as JSON.
+
+LOADTEST_DIR = "loadtests"
+DEFAULT_PORT = 8057
+
+# Interactions and their weights: the purpose dropdown dominates, as in real sessions.
+# Components missing from the layout are skipped; every "*-filter" dropdown is added.
+ACTIONS = {
+    'demo-dropdown': 8,
+    'date-range': 3,
+    'granularity': 1,
+    'line-style': 1,
+    'distribution-dropdown': 1,
+    'geo-dropdown': 1,
+    'cohort-dropdown': 1,
+}
+FILTER_WEIGHT = 1
+
+# Parallel requests of one page, as the browser's connections per host
+PAGE_CONNECTIONS = 6
+
+
+## Page description read from the server: callbacks (see /_dash-dependencies) and the
+## initial value of every component property, with the options of the pickers
+def callback_outputs(output):
+    if output.startswith('..'):
+        return [tuple(part.split('.', 1)) for part in output[2:-2].split('...')]
+    return [tuple(output.split('.', 1))]
+
+
+def read_page(url, session):
+    callbacks = []
+    for dependency in session.get(url + '/_dash-dependencies').json():
+        if dependency.get('clientside_function') or dependency.get('long'):
+            continue
+        if any(item['id'].startswith('{') for item in dependency['inputs'] + dependency['state']):
+            continue
+        dependency['outputs'] = callback_outputs(dependency['output'])
+        dependency['name'] = dependency['outputs'][0][0]
+        callbacks.append(dependency)
+
+    values, components = {}, {}
+    stack = [session.get(url + '/_dash-layout').json()]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+            continue
+        if not isinstance(node, dict) or 'props' not in node:
+            continue
+        props = node['props']
+        if isinstance(props.get('id'), str):
+            components[props['id']] = dict(props, type=node['type'])
+            for prop, value in props.items():
+                if prop not in ('id', 'children'):
+                    values[(props['id'], prop)] = value
+        stack.append(props.get('children'))
+    return {'callbacks': callbacks, 'values': values, 'components': components}
+
+
+def option_values(component):
+    return [option['value'] if isinstance(option, dict) else option for option in component.get('options') or []]
+
+
+## Weighted interactions available on this page
+def page_actions(page, weights=None):
+    if weights is None:
+        weights = dict(ACTIONS, **{name: FILTER_WEIGHT for name in page['components'] if name.endswith('-filter')})
+    actions = []
+    for name, weight in weights.items():
+        component = page['components'].get(name)
+        if not weight or component is None or component.get('disabled'):
+            continue
+        if component['type'] == 'RangeSlider' or option_values(component):
+            actions.append((name, weight))
+    return actions
+
+
+# A new value for an interaction: a sub-range of the slider, some values of a
+# multi-select (none clears it) or one option
+def pick_value(component, rng):
+    if component['type'] == 'RangeSlider':
+        low, high = component['min'], component['max']
+        start = rng.randint(low, high)
+        return [start, rng.randint(start, high)]
+    options = option_values(component)
+    if component.get('multi'):
+        return rng.sample(options, rng.randint(0, min(2, len(options))))
+    return rng.choice(options)
+
+
+## Requests: one callback of the page, timed and recorded
+def request_payload(callback, values, changed):
+    outputs = [{'id': id_, 'property': prop} for id_, prop in callback['outputs']]
+    return {
+        'output': callback['output'],
+        'outputs': outputs if callback['output'].startswith('..') else outputs[0],
+        'inputs': [dict(item, value=values.get((item['id'], item['property']))) for item in callback['inputs']],
+        'state': [dict(item, value=values.get((item['id'], item['property']))) for item in callback['state']],
+        'changedPropIds': [f"{id_}.{prop}" for id_, prop in changed],
+    }
+
+
+def fire(url, session, callback, values, changed, record, timeout):
+    start = time.perf_counter()
+    error, updates = None, {}
+    payload = request_payload(callback, values, changed)
+    try:
+        try:
+            response = session.post(url + '/_dash-update-component', json=payload, timeout=timeout)
+        except requests.ConnectionError:
+            # A keep-alive connection closed by the server: retried once, as browsers do
+            response = session.post(url + '/_dash-update-component', json=payload, timeout=timeout)
+        if response.status_code == 200:
+            for id_, props in response.json().get('response', {}).items():
+                updates.update({(id_, prop): value for prop, value in props.items()})
+        elif response.status_code != 204:
+            error = f"http {response.status_code}"
+    except requests.Timeout:
+        error = 'timeout'
+    except requests.ConnectionError:
+        error = 'connection'
+    except ValueError:
+        error = 'invalid response'
+    record(callback['name'], time.perf_counter() - start, error)
+    return updates
+
+
+## One round of callbacks for changed properties, in parallel like the browser, then the
+## callbacks depending on what they updated, until nothing changes (or depth rounds)
+def propagate(url, session, pool, page, values, changed, record, timeout, depth=4):
+    for _ in range(depth):
+        triggered = [(callback, [key for key in changed if key in inputs]) for callback, inputs in page['inputs']]
+        triggered = [(callback, keys) for callback, keys in triggered if keys]
+        if not triggered:
+            return
+        futures = [pool.submit(fire, url, session, callback, dict(values), keys, record, timeout)
+                   for callback, keys in triggered]
+        changed = set()
+        for future in futures:
+            for key, value in future.result().items():
+                if values.get(key) != value:
+                    values[key] = value
+                    changed.add(key)
+
+
+## A virtual analyst: page load, then interactions with think time, a new page load
+## every session_actions interactions, until the deadline
+def virtual_user(url, page, actions, options, deadline, record, record_interaction, seed):
+    rng = random.Random(seed)
+    session = requests.Session()
+    with ThreadPoolExecutor(PAGE_CONNECTIONS) as pool:
+        while time.perf_counter() < deadline:
+            values = dict(page['values'])
+            if options.page_load:
+                start = time.perf_counter()
+                initial = [callback for callback in page['callbacks'] if not callback.get('prevent_initial_call')]
+                futures = [pool.submit(fire, url, session, callback, dict(values), [], record, options.timeout)
+                           for callback in initial]
+                for future in futures:
+                    values.update(future.result())
+                record_interaction('page_load', time.perf_counter() - start)
+
+            for _ in range(options.session_actions):
+                if time.perf_counter() >= deadline:
+                    return
+                if options.think:
+                    time.sleep(min(rng.expovariate(1 / options.think), max(deadline - time.perf_counter(), 0)))
+                name = rng.choices([name for name, _ in actions], [weight for _, weight in actions])[0]
+                component = page['components'][name]
+                prop = 'value'
+                values[(name, prop)] = pick_value(component, rng)
+
+                start = time.perf_counter()
+                propagate(url, session, pool, page, values, {(name, prop)}, record, options.timeout)
+                record_interaction(name, time.perf_counter() - start)
+
+
+## Latency summary in milliseconds
+def summarize(latencies, errors=None, seconds=None):
+    values = np.array(latencies) * 1000
+    summary = {'requests': len(values)}
+    if seconds:
+        summary['throughput_rps'] = round(len(values) / seconds, 2)
+    if errors is not None:
+        summary['errors'] = sum(errors.values())
+        summary['error_rate'] = round(summary['errors'] / len(values), 4) if len(values) else None
+        summary['error_kinds'] = dict(errors)
+    if len(values):
+        for name, quantile in (('p50_ms', 50), ('p95_ms', 95), ('p99_ms', 99)):
+            summary[name] = round(float(np.percentile(values, quantile)), 1)
+        summary['mean_ms'] = round(float(values.mean()), 1)
+        summary['max_ms'] = round(float(values.max()), 1)
+    return summary
+
+
+## One load level: users virtual users for duration seconds, started over ramp seconds
+def run_level(url, page, actions, users, options):
+    lock = threading.Lock()
+    requests_by_name = collections.defaultdict(list)
+    errors_by_name = collections.defaultdict(collections.Counter)
+    interactions = collections.defaultdict(list)
+
+    def record(name, seconds, error):
+        with lock:
+            requests_by_name[name].append(seconds)
+            if error:
+                errors_by_name[name][error] += 1
+
+    def record_interaction(name, seconds):
+        with lock:
+            interactions[name].append(seconds)
+
+    start = time.perf_counter()
+    deadline = start + options.ramp + options.duration
+    threads = []
+    for user in range(users):
+        thread = threading.Thread(target=virtual_user, daemon=True,
+                                  args=(url, page, actions, options, deadline, record, record_interaction,
+                                        options.seed * 1000 + user))
+        threads.append(thread)
+        thread.start()
+        time.sleep(options.ramp / users)
+    for thread in threads:
+        thread.join(max(deadline - time.perf_counter(), 0) + options.timeout * 2)
+    seconds = time.perf_counter() - start
+
+    every, every_error = [], collections.Counter()
+    for name, latencies in requests_by_name.items():
+        every.extend(latencies)
+        every_error.update(errors_by_name[name])
+    return {
+        'users': users,
+        'seconds': round(seconds, 1),
+        'requests': summarize(every, every_error, seconds),
+        'callbacks': {name: summarize(latencies, errors_by_name[name], seconds)
+                      for name, latencies in sorted(requests_by_name.items())},
+        'interactions': {name: summarize(latencies) for name, latencies in sorted(interactions.items())},
+    }
+
+
+def print_level(level):
+    total = level['requests']
+    print(f"{level['users']:>4} users  {total['requests']:>7} requests  {total.get('throughput_rps', 0):8.1f} req/s  "
+          f"p50 {total.get('p50_ms', 0):7.1f}ms  p95 {total.get('p95_ms', 0):7.1f}ms  p99 {total.get('p99_ms', 0):7.1f}ms  "
+          f"errors {total['error_rate'] or 0:.2%}")
+    for name, summary in level['callbacks'].items():
+        print(f"       {name:<36} {summary['requests']:>7}  p50 {summary.get('p50_ms', 0):7.1f}ms  "
+              f"p95 {summary.get('p95_ms', 0):7.1f}ms  p99 {summary.get('p99_ms', 0):7.1f}ms  errors {summary['errors']}")
+
+
+## Local server: the production entry point on a free port, with the given settings
+def start_server(path, port, options):
+    env = dict(os.environ, LOAN_DATA_PATH=path, LOAN_BIND=f"127.0.0.1:{port}")
+    if options.workers:
+        env['LOAN_WORKERS'] = str(options.workers)
+    if options.threads:
+        env['LOAN_THREADS'] = str(options.threads)
+    for setting in options.env:
+        name, _, value = setting.partition('=')
+        env[name] = value
+
+    try:
+        import gunicorn  # noqa: F401
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:server']
+    except ImportError:
+        command = [sys.executable, '-c', f"from wsgi import server; server.run('127.0.0.1', {port}, threaded=True)"]
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.perf_counter() + options.startup_timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise RuntimeError('server exited:\n' + log.read().decode(errors='replace')[-2000:])
+        try:
+            if requests.get(url + '/_dash-layout', timeout=5).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    stop_server(process)
+    raise RuntimeError(f"server not ready after {options.startup_timeout}s")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+## Levels slower than REGRESSION_RATIO times the previous run (p95), or with less throughput
+def compare(current, previous):
+    regressions = []
+    for users, level in current['levels'].items():
+        before = previous.get('levels', {}).get(users)
+        if not before:
+            continue
+        for name, summary in [('all', level['requests'])] + list(level['callbacks'].items()):
+            old = before['requests'] if name == 'all' else before['callbacks'].get(name)
+            if not old or not old.get('p95_ms') or not summary.get('p95_ms'):
+                continue
+            ratio = summary['p95_ms'] / old['p95_ms']
+            flag = '  REGRESSION' if ratio > REGRESSION_RATIO else ''
+            print(f"{users:>4} users {name:<36} p95 {old['p95_ms']:8.1f}ms -> {summary['p95_ms']:8.1f}ms  "
+                  f"x{ratio:5.2f}  {old.get('throughput_rps', 0):7.1f} -> {summary.get('throughput_rps', 0):7.1f} req/s{flag}")
+            if flag:
+                regressions.append((users, name, ratio))
+        if level['requests']['error_rate'] and level['requests']['error_rate'] > (before['requests']['error_rate'] or 0):
+            print(f"{users:>4} users error rate {before['requests']['error_rate'] or 0:.2%} -> "
+                  f"{level['requests']['error_rate']:.2%}  REGRESSION")
+            regressions.append((users, 'errors', level['requests']['error_rate']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the dashboard callbacks with concurrent virtual users')
+    parser.add_argument('--users', nargs='+', type=int, default=[1, 5, 20], help='concurrent users, one run per level')
+    parser.add_argument('--duration', type=float, default=60, help='seconds per level, after the ramp-up')
+    parser.add_argument('--ramp', type=float, default=5, help='seconds over which the users start')
+    parser.add_argument('--think', type=float, default=1.0, help='mean think time between interactions (0: none)')
+    parser.add_argument('--session-actions', type=int, default=20, help='interactions before the page is reloaded')
+    parser.add_argument('--no-page-load', dest='page_load', action='store_false',
+                        help='skip the initial callbacks of every page load')
+    parser.add_argument('--actions', nargs='+', metavar='ID=WEIGHT',
+                        help='interactions to replay and their weights (default: every picker, mostly the purpose)')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds before a request counts as an error')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help='dashboard to test (default: start one locally)')
+    parser.add_argument('--data', help='portfolio CSV of the local server (default LOAN_DATA_PATH or the sample)')
+    parser.add_argument('--size', help='synthetic portfolio size of the local server instead, e.g. 100k')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, help='LOAN_WORKERS of the local server')
+    parser.add_argument('--threads', type=int, help='LOAN_THREADS of the local server')
+    parser.add_argument('--env', nargs='*', default=[], metavar='NAME=VALUE', help='more settings of the local server')
+    parser.add_argument('--startup-timeout', type=float, default=600)
+    parser.add_argument('--out', help='JSON file to write (default loadtests/loadtest_<timestamp>.json)')
+    parser.add_argument('--compare', help='previous results JSON to compare against')
+    args = parser.parse_args(argv)
+
+    weights = None
+    if args.actions:
+        weights = {name: float(weight or 1) for name, _, weight in (action.partition('=') for action in args.actions)}
+
+    process, path = None, None
+    if args.url:
+        url = args.url.rstrip('/')
+    else:
+        path = args.data or os.environ.get('LOAN_DATA_PATH', "Data/LuxuryLoanPortfolio.csv")
+        if args.size:
+            from synthetic import parse_rows, synthetic_path, generate
+            path = synthetic_path(parse_rows(args.size))
+            if not os.path.exists(path):
+                print(f"generating {parse_rows(args.size)} loans -> {path}")
+                generate(parse_rows(args.size), path)
+        print(f"starting the dashboard on {path}")
+        process, url = start_server(path, args.port, args)
+
+    report = {
+        'environment': environment(),
+        'config': {'url': args.url, 'data': path, 'size': args.size, 'workers': args.workers, 'threads': args.threads,
+                   'env': args.env, 'duration': args.duration, 'ramp': args.ramp, 'think': args.think,
+                   'session_actions': args.session_actions, 'page_load': args.page_load, 'seed': args.seed},
+        'levels': {},
+    }
+    try:
+        page = read_page(url, requests.Session())
+        page['inputs'] = [(callback, {(item['id'], item['property']) for item in callback['inputs']})
+                          for callback in page['callbacks']]
+        actions = page_actions(page, weights)
+        report['config']['actions'] = dict(actions)
+        print(f"replaying {', '.join(f'{name} x{weight:g}' for name, weight in actions)}")
+        for users in args.users:
+            level = run_level(url, page, actions, users, args)
+            report['levels'][str(users)] = level
+            print_level(level)
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    out = args.out or os.path.join(LOADTEST_DIR, f"loadtest_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(out)
+
+    if args.compare:
+        with open(args.compare) as f:
+            return 1 if compare(report, json.load(f)) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
@@ -1,3 +1,6 @@
+import time
+STARTUP = time.perf_counter()
+
 from tkinter import Label
 import pandas as pd
 import numpy as np
@@ -11,6 +14,52 @@ import plotly.graph_objects as go
 import plotly.express as px
 from plotly.subplots import make_subplots
 import datetime
+import os
+import threading
+import contextlib
+import collections
+from dash.exceptions import PreventUpdate
+import flask
+
+from loader import LOAN_COLUMNS, load_portfolio, read_portfolio_csv, preprocess, cache_path, source_signature, \
+    merge_positions, merge_frames
+from aggregates import aggregate_portfolio, stream_portfolio, fold_chunk, aggregates_cube, distinct_loans, \
+    value_count_values
+from refresh import watch_state, poll_new_loans
+from cube import ALL_PURPOSE, GRANULARITIES, partial_cube, period_cube, month_day, select_base, select_purposes, cube_purposes, cube_series, cube_frame, cube_total, purpose_totals, purpose_counts
+from bitmaps import FILTER_COLUMNS, build_bitmaps, insert_bitmaps, filter_values, select_bitmap, bitmap_rows
+from drilldown import TABLE_COLUMNS, build_sort_index, insert_sort_index, table_page
+from date_range import build_date_index, range_totals, range_cube, ordinal_month, slider_range
+from scenarios import SCENARIOS, INPUT_COLUMNS as SCENARIO_COLUMNS, scenario_inputs, run_scenarios, release_portfolio
+from amortization import project_portfolio, frame_chunks, projection_frame
+from sketches import SKETCH_METRICS, empty_histograms, build_histograms, percentile_bands, \
+    selection_histogram
+from geography import CENTROIDS_PATH, ZIP_METRICS, partial_zips, zip_totals, load_centroids, map_points
+from cohorts import empty_cohorts, cohort_labels, vintage_curves
+from database import open_database, append_loans, database_aggregates, fold_database_chunk, query_partial_cube, \
+    query_distinct_loans, query_filter_values, query_chunks, query_columns, query_histograms, query_zips, \
+    query_table_page
+from background import callback_manager, heavy_callback, report_progress
+from portfolios import portfolio_registry, deep_size, memory_lru, lru_get, lru_replace, lru_peek, lru_stats
+from memory import mapped_columns
+from metrics import install_metrics, saved_bytes, timer, timed_figure, timed_callback
+import lean
+
+## Startup timing report: seconds spent in each phase until the figures are ready
+startup_timings = {'import': time.perf_counter() - STARTUP}
+
+
+@contextlib.contextmanager
+def startup_phase(name):
+    start = time.perf_counter()
+    yield
+    startup_timings.setdefault(name, time.perf_counter() - start)
+
+
+def startup_report():
+    phases = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in startup_timings.items())
+    return f"Startup: {phases}"
+
 
 external_stylesheets = ['Assets/file.css','https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/font-awesome.min.css']
 
@@ -44,27 +93,430 @@ boxBorderStyle = {
 }
 
 
-# Read Data
-lp_df = pd.read_csv("Data/LuxuryLoanPortfolio.csv")
+# Set LOAN_DATA_PATH to serve another portfolio CSV with the same columns
+DATA_PATH = os.environ.get('LOAN_DATA_PATH', "Data/LuxuryLoanPortfolio.csv")
+
+# Set LOAN_STREAM_CHUNK_ROWS to read the CSV in chunks of that many rows and keep
+# only the aggregates, for portfolios that do not fit in memory
+STREAM_CHUNK_ROWS = int(os.environ.get('LOAN_STREAM_CHUNK_ROWS', 0))
+
+# Set LOAN_MMAP=1 to memory-map the columnar cache instead of reading it, so that
+# every worker process serves the same copy of the loans from the page cache
+MMAP = os.environ.get('LOAN_MMAP', '') not in ('', '0')
+
+# Set LOAN_BACKEND=sqlite to load the portfolio into an SQLite file next to the CSV and
+# push the aggregations down to it: only grouped rows are read into Python
+SQLITE = os.environ.get('LOAN_BACKEND', 'pandas') == 'sqlite'
+
+# Set LOAN_REFRESH_SECONDS to poll for new loans appended to the data file (or
+# dropped as CSV files into LOAN_DROP_DIR) and push them to open pages
+REFRESH_SECONDS = float(os.environ.get('LOAN_REFRESH_SECONDS', 0))
+DROP_DIR = os.environ.get('LOAN_DROP_DIR')
+
+# Set LOAN_CLIENTSIDE_PURPOSE=1 to send every purpose's Mortgage Constant and LTV series
+# to the page once and switch the purpose dropdown in the browser
+CLIENTSIDE_PURPOSE = os.environ.get('LOAN_CLIENTSIDE_PURPOSE', '') not in ('', '0')
+
+# Callback and figure timings are served on /metrics; set LOAN_SLOW_CALLBACK_MS to also
+# log every callback response slower than that
+SLOW_CALLBACK_MS = os.environ.get('LOAN_SLOW_CALLBACK_MS')
+
+# Set LOAN_LEAN=1 for lean figures: a small shared template, line series downsampled
+# to LOAN_MAX_POINTS (about the plot width in pixels) and compressed responses
+LEAN = os.environ.get('LOAN_LEAN', '') not in ('', '0')
+MAX_POINTS = int(os.environ.get('LOAN_MAX_POINTS', 1000))
+lean.configure(LEAN, MAX_POINTS, report=saved_bytes('lean'))
+
+# Set LOAN_BACKGROUND=1 to run the heavy callbacks (cash-flow projection, rate-shock
+# scenarios) in background processes with progress on the page (needs diskcache)
+BACKGROUND = os.environ.get('LOAN_BACKGROUND', '') not in ('', '0')
+
+# Rate-shock scenarios run in a pool of LOAN_SCENARIO_WORKERS processes (default: one per core)
+SCENARIO_WORKERS = int(os.environ.get('LOAN_SCENARIO_WORKERS', 0)) or None
+
+# Set LOAN_PORTFOLIOS="name=path,name=path" to serve several portfolios (by default every
+# CSV next to LOAN_DATA_PATH). They are loaded on first pick and kept in memory up to
+# LOAN_PORTFOLIO_BUDGET_MB, least recently used first out; statistics on /portfolios
+PORTFOLIOS = portfolio_registry(DATA_PATH, os.environ.get('LOAN_PORTFOLIOS'), LOAN_COLUMNS)
+DEFAULT_PORTFOLIO = next(iter(PORTFOLIOS))
+PORTFOLIO_BUDGET_MB = float(os.environ.get('LOAN_PORTFOLIO_BUDGET_MB', 2048))
+
+# Geographic exposure is drawn on a map when the ZIP centroid lookup exists (build it with
+# `python geography.py`, which downloads the Census gazetteer; LOAN_ZIP_CENTROIDS to use
+# another file). Past
+# LOAN_MAX_MAP_POINTS ZIPs, nearby ZIPs are binned together on the server.
+ZIP_CENTROIDS = load_centroids(os.environ.get('LOAN_ZIP_CENTROIDS', CENTROIDS_PATH))
+MAX_MAP_POINTS = int(os.environ.get('LOAN_MAX_MAP_POINTS', 500))
+
+PURPOSE_OPTIONS = ['All', 'Boat', 'Commerical Property', 'Home', 'Investment Property', 'Plane']
+
+# Read Data (feature selection, pre-processing and the columnar cache live in loader.py)
+def load_loans(path):
+    if STREAM_CHUNK_ROWS or SQLITE:
+        return None
+    return load_portfolio(path, mmap_mode='r' if MMAP else None)
+
+
+# In streaming mode the CSV is read while aggregating, with the SQLite backend the database aggregates
+def aggregate_loans(lp):
+    if lp['database'] is not None:
+        return database_aggregates(lp['database'])
+    if lp['df'] is None:
+        return stream_portfolio(lp['path'], STREAM_CHUNK_ROWS)
+    return aggregate_portfolio(lp['df'])
+
+
+def load_data(lp):
+    lp['database'] = open_database(lp['path']) if SQLITE else None
+    lp['df'] = load_loans(lp['path'])
+    lp['aggregates'] = aggregate_loans(lp)
+
+
+def index_portfolio(lp):
+    # Aggregate cube (purpose x month), built once so the figures never rescan the loans,
+    # and its prefix sums over months for the date range filter
+    lp['cube'] = aggregates_cube(lp['aggregates'])
+    lp['index'] = build_date_index(lp['cube'])
+
+    # Bitmap indexes of the categorical filter columns (needs the loans, so not in streaming mode)
+    lp['bitmaps'] = build_bitmaps(lp['df']) if lp['df'] is not None else None
+
+    # Sort permutations of the drill-down table columns
+    lp['sort_index'] = build_sort_index(lp['df']) if lp['df'] is not None else None
+
+    # Figures, projections and filtered cubes of this data, dropped with it
+    lp['memo'] = {}
+    lp['cubes'] = collections.OrderedDict()
+
+
+## State of one portfolio: its loans, aggregates and indexes (see index_portfolio)
+def load_state(name):
+    lp = {'name': name, 'path': PORTFOLIOS[name], 'lock': threading.Lock(), 'version': 0}
+    with startup_phase('data load'):
+        load_data(lp)
+    if MMAP and lp['df'] is not None:
+        mapped = mapped_columns(lp['df'])
+        print(f"{name}: {mapped['mapped']} of {mapped['columns']} columns memory-mapped"
+              + (f", copied: {', '.join(mapped['copied'])}" if mapped['copied'] else ''))
+    with startup_phase('preprocessing'):
+        index_portfolio(lp)
+    # New loans dropped into LOAN_DROP_DIR belong to the default portfolio
+    drop_dir = DROP_DIR if name == DEFAULT_PORTFOLIO else None
+    lp['watch'] = watch_state(lp['path'], drop_dir) if REFRESH_SECONDS else None
+    return lp
+
+
+portfolio_cache = memory_lru(PORTFOLIO_BUDGET_MB * 2 ** 20, on_evict=release_portfolio)
+
+
+def portfolio_state(name=None):
+    return lru_get(portfolio_cache, name if name in PORTFOLIOS else DEFAULT_PORTFOLIO, load_state)
+
+
+portfolio_state()
+
+
+## Live refresh: only the new loans are folded into the aggregates and merged into the
+## loans and their indexes. The new state is built aside and swapped into the cache in
+## one assignment, so a callback reads either the old state or the new one, never a mix.
+def refresh_portfolio(lp):
+    with lp['lock']:
+        lp = lru_peek(portfolio_cache, lp['name']) or lp
+        new_loans = poll_new_loans(lp['watch'])
+        if new_loans == []:
+            return lp
+
+        if new_loans is None:
+            # Data file was replaced rather than appended to
+            state = dict(lp, watch=watch_state(lp['path'], lp['watch']['drop_dir']))
+            load_data(state)
+            index_portfolio(state)
+            grown = None
+        else:
+            state = lp
+            for frame in new_loans:
+                state = merge_new_loans(state, frame)
+            grown = sum(deep_size(frame) for frame in new_loans) * 2
+        state['version'] = lp['version'] + 1
+        lru_replace(portfolio_cache, lp['name'], state, grown)
+    return state
+
+
+# State with one preprocessed frame of new loans added: the frame is sorted on its own
+# and merged into the loans, the bitmaps and the sort permutations
+def merge_new_loans(lp, new_df):
+    new_df = new_df.sort_values('funded_date', kind='stable', ignore_index=True)
+    if lp['database'] is not None:
+        append_loans(lp['database'], [new_df])
+        aggregates = fold_database_chunk(lp['aggregates'], new_df)
+    else:
+        aggregates = fold_chunk(lp['aggregates'], new_df)
+
+    cube = aggregates_cube(aggregates)
+    state = dict(lp, aggregates=aggregates, cube=cube, index=build_date_index(cube), memo={},
+                 cubes=collections.OrderedDict())
+    if lp['df'] is not None:
+        old_rows, new_rows = merge_positions(lp['df']['funded_date'], new_df['funded_date'])
+        state['df'] = merge_frames(lp['df'], new_df, old_rows, new_rows)
+        state['bitmaps'] = insert_bitmaps(lp['bitmaps'], new_df, old_rows, new_rows)
+        state['sort_index'] = insert_sort_index(lp['sort_index'], state['df'], old_rows, new_rows)
+    return state
+
+
+def loan_count(lp):
+    if lp['database'] is not None:
+        return query_distinct_loans(lp['database'])
+    return distinct_loans(lp['aggregates'])
+
+
+def data_version(lp):
+    return lp['version']
+
+
+# Background results are cached per portfolio files (and the data version, an input)
+def portfolio_sources():
+    return [(name, source_signature(path, with_hash=False)) for name, path in PORTFOLIOS.items()]
+
+
+## Results derived from a portfolio are kept in its state (cleared on refresh, and
+## evicted with it); maxsize bounds the filtered cubes
+memo_lock = threading.Lock()
+
+
+def memoized(memo, key, build, maxsize=None):
+    with memo_lock:
+        if key in memo:
+            if maxsize:
+                memo.move_to_end(key)
+            return memo[key]
+    value = build()
+    with memo_lock:
+        memo[key] = value
+        while maxsize and len(memo) > maxsize:
+            memo.popitem(last=False)
+    return value
+
+
+def filters_key(filters):
+    return tuple(sorted((column, tuple(values)) for column, values in (filters or {}).items() if values))
+
+
+## Cube and date index of the loans matching the cross-filters.
+## A purpose-only selection slices the cube; any other filter ANDs the bitmaps and
+## aggregates only the matching rows (or is a WHERE clause with the SQLite backend).
+## The daily partial cube of the selection comes along for the other granularities.
+## The last 32 selections of each portfolio are cached.
+def filtered_cube(lp, key):
+    if not key:
+        return lp['aggregates']['cube'], lp['cube'], lp['index']
+    return memoized(lp['cubes'], key, lambda: build_filtered_cube(lp, dict(key)), maxsize=32)
+
+
+def build_filtered_cube(lp, filters):
+    if set(filters) == {'purpose'}:
+        base = select_base(lp['aggregates']['cube'], filters['purpose'])
+        cube = select_purposes(lp['cube'], filters['purpose'])
+    else:
+        if lp['database'] is not None:
+            base = query_partial_cube(lp['database'], filters)
+        else:
+            rows = bitmap_rows(select_bitmap(lp['bitmaps'], filters), lp['bitmaps']['rows'])
+            base = partial_cube(lp['df'].take(rows))
+        cube = period_cube(base)
+    return base, cube, build_date_index(cube)
+
+
+## Cube and per-purpose totals for the months picked on the date range slider.
+## The cube is monthly unless another granularity is asked for: it is then rolled up
+## from the daily partial cube over the same days.
+def date_selection(date_range=None, filters=None, portfolio=None, granularity='month'):
+    lp, key = portfolio_state(portfolio), filters_key(filters)
+    base, cube, index = filtered_cube(lp, key)
+    start = end = None
+    if date_range:
+        start, end = ordinal_month(date_range[0]), ordinal_month(date_range[1])
+    totals = range_totals(index, start, end)
+    if granularity in GRANULARITIES and granularity != 'month':
+        days = (month_day(start), month_day(ordinal_month(date_range[1] + 1))) if date_range else (None, None)
+        return memoized(lp['cubes'], (key, granularity, days), lambda: period_cube(base, granularity, *days),
+                        maxsize=32), totals
+    return range_cube(cube, index, start, end), totals
+
+
+# Whole portfolio selected: the loan count is the number of distinct loan_ids
+def full_selection(lp, date_range, filters=None):
+    first, last, _ = slider_range(lp['index'])
+    full_range = not date_range or (date_range[0] <= first and date_range[1] >= last)
+    return full_range and not filters_key(filters)
+
+
+## Loan-level selection for the drill-down table: the loans are in funded_date
+## order, so the date range is one contiguous block; the cross-filters are the bitmap AND
+def selected_loans(lp, date_range=None, filters=None):
+    lp_df = lp['df']
+    selected = None
+    if date_range:
+        start = lp_df['funded_date'].searchsorted(pd.Timestamp(ordinal_month(date_range[0]) + '-01'), side='left')
+        end = lp_df['funded_date'].searchsorted(pd.Timestamp(ordinal_month(date_range[1] + 1) + '-01'), side='left')
+        if start > 0 or end < len(lp_df):
+            selected = np.zeros(len(lp_df), dtype=bool)
+            selected[start:end] = True
+
+    bitmap = select_bitmap(lp['bitmaps'], filters or {})
+    if bitmap is not None:
+        matching = np.unpackbits(bitmap, count=len(lp_df)).astype(bool)
+        selected = matching if selected is None else selected & matching
+    return selected
+
+
+## Histograms of a selection: purposes and months are picked when they are read, any
+## other cross-filter needs the histograms of the matching loans (cached like the cubes)
+def filtered_histograms(lp, key):
+    filters = {column: values for column, values in key if column != 'purpose'}
+    if not filters:
+        return lp['aggregates']['histograms'] or empty_histograms()
+    return memoized(lp['cubes'], ('histograms', filters_key(filters)),
+                    lambda: build_filtered_histograms(lp, filters), maxsize=32)
+
+
+def build_filtered_histograms(lp, filters):
+    if lp['database'] is not None:
+        return query_histograms(lp['database'], filters) or empty_histograms()
+    rows = bitmap_rows(select_bitmap(lp['bitmaps'], filters), lp['bitmaps']['rows'])
+    return build_histograms(lp['df'].take(rows))
+
+
+# Purposes to read for one purpose (or "All") under the cross-filters
+def sketch_purposes(purpose, filters):
+    selected = dict(filters_key(filters)).get('purpose')
+    if purpose == ALL_PURPOSE:
+        return list(selected) if selected else None
+    return [purpose] if not selected or purpose in selected else []
+
+
+## p5 / p50 / p95 of a metric per period for a purpose, over the date range and cross-filters
+def band_selection(metric, purpose=ALL_PURPOSE, date_range=None, filters=None, portfolio=None, granularity='month'):
+    histograms = filtered_histograms(portfolio_state(portfolio), filters_key(filters))
+    start, end = date_range or (None, None)
+    return percentile_bands(histograms, metric, sketch_purposes(purpose, filters), start, end, granularity)
+
+
+def histogram_selection(metric, purpose=ALL_PURPOSE, date_range=None, filters=None, portfolio=None):
+    histograms = filtered_histograms(portfolio_state(portfolio), filters_key(filters))
+    start, end = date_range or (None, None)
+    return selection_histogram(histograms, metric, sketch_purposes(purpose, filters), start, end)
+
+
+## ZIP table of a selection: like the histograms, purposes and months are picked from the
+## pre-aggregated table and any other cross-filter rebuilds it from the matching loans
+def filtered_zips(lp, key):
+    filters = {column: values for column, values in key if column != 'purpose'}
+    if not filters:
+        return lp['aggregates']['zips']
+    return memoized(lp['cubes'], ('zips', filters_key(filters)), lambda: build_filtered_zips(lp, filters), maxsize=32)
+
+
+def build_filtered_zips(lp, filters):
+    if lp['database'] is not None:
+        return query_zips(lp['database'], filters)
+    rows = bitmap_rows(select_bitmap(lp['bitmaps'], filters), lp['bitmaps']['rows'])
+    return partial_zips(lp['df'].take(rows))
+
+
+## Exposure per ZIP code over the date range and cross-filters
+def zip_selection(date_range=None, filters=None, portfolio=None):
+    zips = filtered_zips(portfolio_state(portfolio), filters_key(filters))
+    start, end = date_range or (None, None)
+    return zip_totals(zips, sketch_purposes(ALL_PURPOSE, filters), start, end)
+
+
+## Cash-flow projection of every outstanding loan, per purpose and month. Built on first
+## use, chunk by chunk (re-reading the CSV in streaming mode), and cached until the data
+## changes (in a background job set_progress is given, and the job's result is cached instead).
+def cash_flow_projection(portfolio=None, set_progress=None):
+    lp = portfolio_state(portfolio)
+    return memoized(lp['memo'], 'projection', lambda: build_projection(lp, set_progress))
+
+
+def build_projection(lp, set_progress=None):
+    if lp['df'] is not None:
+        chunks = frame_chunks(lp['df'])
+    elif lp['database'] is not None:
+        chunks = query_chunks(lp['database'])
+    else:
+        chunks = (preprocess(chunk) for chunk in read_portfolio_csv(lp['path'], chunksize=STREAM_CHUNK_ROWS))
+    purposes = cube_purposes(lp['cube'])
+    totals, start = project_portfolio(chunks, purposes,
+                                      progress=lambda rows: report_progress(set_progress, rows, lp['aggregates']['rows']))
+    return projection_frame(totals, purposes, start)
+
+
+## Rate-shock scenarios of a loaded portfolio (not in streaming mode)
+def scenario_data(lp):
+    if lp['df'] is None:
+        return memoized(lp['memo'], 'scenario inputs',
+                        lambda: scenario_inputs(query_columns(lp['database'], ['purpose'] + SCENARIO_COLUMNS)))
+    return memoized(lp['memo'], 'scenario inputs', lambda: scenario_inputs(lp['df']))
+
+
+def scenario_enabled(lp):
+    return lp['df'] is not None or lp['database'] is not None
+
+
+def scenario_results(names, set_progress=None, portfolio=None):
+    lp = portfolio_state(portfolio)
+    if not scenario_enabled(lp) or not names:
+        return {}
+    return run_scenarios(scenario_data(lp), names, lp['name'], data_version(lp), workers=SCENARIO_WORKERS,
+                         progress=lambda done, total: report_progress(set_progress, done, total))
+
+
+## Vintage cohorts: the matrix is part of the aggregates (built at load, new loans folded in).
+## One cohort per year is picked by default.
+def cohort_matrix(lp):
+    return lp['aggregates']['cohorts'] or empty_cohorts()
+
+
+def default_cohorts(labels):
+    return [label for label in labels if label.endswith('-Q1')]
+
+
+## Note under the panels computed over every loan of the portfolio
+def whole_portfolio_note():
+    return html.P('Whole portfolio: the date range and cross-filters do not apply to this panel.',
+                  style={'textAlign': 'center', 'color': colors['text']}, className='twelve columns')
+
+
+## Filter dropdowns
+def filter_id(column):
+    return column.lower().replace(' ', '-') + '-filter'
+
+
+def filter_options(column, lp):
+    if lp['database'] is not None:
+        values = query_filter_values(lp['database'], column)
+    elif lp['bitmaps'] is not None:
+        values = filter_values(lp['bitmaps'], column)
+    else:
+        values = value_count_values(lp['aggregates'], column)
+    return [{'label': str(value).strip(), 'value': value} for value in values]
 
-# Feature Selector
-lp_df = lp_df[["loan_id", "funded_amount", "funded_date", "duration years", "duration months", "10 yr treasury index date funded",
-      "interest rate percent", "interest rate", "payments", "total past payments", "loan balance", "property value", "purpose",
-      "employment length", "BUILDING CLASS CATEGORY","BUILDING CLASS AT PRESENT", "TAX CLASS AT PRESENT",
-       "TAX CLASS AT TIME OF SALE", "TOTAL UNITS", "LAND SQUARE FEET", "GROSS SQUARE FEET"]]
 
-# Pre-processing and Feature Engineering
-lp_df['funded_date'] = pd.to_datetime(lp_df['funded_date'])
-lp_df['year_month'] = lp_df['funded_date'].dt.strftime('%Y-%m')
-lp_df['purpose'] = lp_df['purpose'].str.title()
-lp_df['mortgage_constant'] = (lp_df['payments']*12)/lp_df['funded_amount']
-lp_df['ltv'] = lp_df['funded_amount'] / lp_df['property value']
+## KPI card values
+def kpi_values(totals, loan_count=None):
+    if loan_count is None:
+        loan_count = int(cube_total(totals, 'loans', 'count'))
+    return (f"{loan_count}",
+            f"{np.round(cube_total(totals, 'funded_amount') / 1000000, 2)}" + "M",
+            f"{np.round(cube_total(totals, 'interest rate percent', 'mean'), 2)}" + "%")
 
 # Create Plot
 
 ## Demographic
-def demographic(lp_df):
-    temp = lp_df["purpose"].value_counts()
+@timed_figure
+@lean.leaned
+def demographic(totals):
+    temp = purpose_counts(totals)
 
     df = pd.DataFrame({'labels': temp.index,
                     'values': temp.values
@@ -84,8 +536,10 @@ def demographic(lp_df):
 ## Interest Rate
 
 # Change date index to datetimeindex and share x-axis with all the plot
-def draw_interest_graph(lp_df):
-    group = lp_df.groupby(['year_month'])['interest rate percent'].mean().round(decimals = 1).reset_index()
+@timed_figure
+@lean.leaned
+def draw_interest_graph(cube):
+    group = cube_series(cube, 'interest rate percent').round(decimals = 1).reset_index()
     group['purpose'] = "All"
 
     fig = px.line(group, x='year_month', y="interest rate percent", color = "purpose",)
@@ -127,8 +581,10 @@ def draw_interest_graph(lp_df):
 
 
 # Interest Rate group by Purpose
-def draw_interest_purpose_graph(lp_df):
-    group = lp_df.groupby(['purpose', 'year_month'])['interest rate percent'].mean().round(decimals = 1).reset_index()
+@timed_figure
+@lean.leaned
+def draw_interest_purpose_graph(cube):
+    group = cube_frame(cube, 'interest rate percent').round(decimals = 1)
 
     fig = px.line(group, x='year_month', y="interest rate percent", color="purpose",
                 color_discrete_sequence = px.colors.qualitative.Light24)
@@ -169,16 +625,18 @@ def draw_interest_purpose_graph(lp_df):
     return fig
 
 ## Average funding and duration - purpose
-def avg_funding_duration(lp_df):
+@timed_figure
+@lean.leaned
+def avg_funding_duration(totals):
     
-    avg_funding = lp_df.groupby('purpose')['funded_amount'].mean().reset_index()
-    avg_duration = lp_df.groupby(['purpose'])['duration years'].mean().reset_index()
+    avg_funding = purpose_totals(totals, 'funded_amount')
+    avg_duration = purpose_totals(totals, 'duration years')
     
-    y_duration = avg_duration['duration years'].unique().tolist()
+    y_duration = avg_duration['mean'].tolist()
 
-    y_funded = avg_funding['funded_amount'].unique().tolist()
+    y_funded = avg_funding['mean'].tolist()
 
-    x = avg_funding['purpose'].unique().tolist()
+    x = avg_funding.index.tolist()
 
     # Creating two subplots
     fig = make_subplots(rows=1, cols=2, specs=[[{}, {}]], shared_xaxes=False,
@@ -290,16 +748,12 @@ def avg_funding_duration(lp_df):
     return fig
 
 ## Create Loan Constant Graph
-def loan_constant(lp_df, purpose='All'):
-    if purpose=='All':
-        df_mortgage_constant = lp_df.groupby('year_month')['mortgage_constant'].mean().round(decimals = 3).reset_index()
-        df_mortgage_constant['purpose'] = "All"
-        fig = px.line(df_mortgage_constant, x='year_month', y="mortgage_constant", title='Mortgage Ratio', color='purpose')
-
-    else:
-        df_mortgage_constant_year = lp_df.groupby(['purpose', 'year_month'])['mortgage_constant'].mean().round(decimals = 3).reset_index()
-        df_mortgage_constant_year = df_mortgage_constant_year[df_mortgage_constant_year['purpose'] == purpose]
-        fig = px.line(df_mortgage_constant_year, x='year_month', y="mortgage_constant", color="purpose", title='Mortgage Ratio')
+@timed_figure
+@lean.leaned
+def loan_constant(cube, purpose='All'):
+    df_mortgage_constant = cube_series(cube, 'mortgage_constant', purpose).round(decimals = 3).reset_index()
+    df_mortgage_constant['purpose'] = purpose
+    fig = px.line(df_mortgage_constant, x='year_month', y="mortgage_constant", title='Mortgage Ratio', color='purpose')
     
     fig.update_layout(
             xaxis_title=None,
@@ -336,16 +790,12 @@ def loan_constant(lp_df, purpose='All'):
     return fig
 
 ## Loan to Value Ratio
-def loan_value(lp_df, purpose='All'):
-    if purpose=='All':
-        df_ltv_avg = lp_df.groupby('year_month')['ltv'].mean().round(decimals = 2).reset_index()
-        df_ltv_avg['purpose'] = "All"
-        fig = px.line(df_ltv_avg, x='year_month', y="ltv", title='Loan to Value Ratio', color='purpose')
-
-    else:
-        df_ltv_avg_year = lp_df.groupby(['purpose', 'year_month'])['ltv'].mean().round(decimals = 2).reset_index()
-        df_ltv_avg_year = df_ltv_avg_year[df_ltv_avg_year['purpose'] == purpose]
-        fig = px.line(df_ltv_avg_year, x='year_month', y="ltv", color="purpose", title='Loan to Value Ratio')
+@timed_figure
+@lean.leaned
+def loan_value(cube, purpose='All'):
+    df_ltv_avg = cube_series(cube, 'ltv', purpose).round(decimals = 2).reset_index()
+    df_ltv_avg['purpose'] = purpose
+    fig = px.line(df_ltv_avg, x='year_month', y="ltv", title='Loan to Value Ratio', color='purpose')
     
     fig.update_layout(
             xaxis_title=None,
@@ -380,259 +830,1194 @@ def loan_value(lp_df, purpose='All'):
     # fig.update_xaxes(zeroline=True, zerolinewidth=2, zerolinecolor='#3A3A3A')
     fig.update_yaxes(zeroline=True, zerolinewidth=2, zerolinecolor='#3A3A3A')
     return fig
-    
 
-# Create App Dash
+## Percentile bands: the p5 to p95 band and the median line of one purpose, or only the
+## median lines when several purposes are drawn
+@timed_figure
+@lean.leaned
+def band_graph(bands, decimals=2):
+    fig = go.Figure()
+    for purpose, band in bands.items():
+        band = band.round(decimals = decimals)
+        if len(bands) == 1:
+            fig.add_trace(go.Scatter(x=band.index, y=band['p95'], name='p95', mode='lines', line=dict(width=0),
+                                     showlegend=False))
+            fig.add_trace(go.Scatter(x=band.index, y=band['p5'], name='p5 - p95', mode='lines', line=dict(width=0),
+                                     fill='tonexty', fillcolor='rgba(60, 164, 255, 0.3)'))
+        fig.add_trace(go.Scatter(x=band.index, y=band['p50'], name=f'{purpose} p50', mode='lines'))
 
-app.layout = html.Div(
-    html.Div([
-        # Header display
-        html.Div(
-            [
-                html.H1(children='Luxury Loan Dashboard',
-                        style={
-                            'textAlign': 'center',
-                            'color': colors['text'],
-                            'backgroundColor': colors['background'],
-                        },
-                        className='title',
+    fig.update_layout(
+            xaxis_title=None,
+            yaxis_title=None,
+            colorway=px.colors.qualitative.Light24,
+            font=dict(
+                family="Courier New, monospace",
+                size=14,
+                color=colors['figure_text'],
+            ),
+            legend=dict(
+                x=0.02,
+                y=1.25,
+                orientation='h',
+                font=dict(
+                    family="sans-serif",
+                    size=9,
+                    color=colors['figure_text']
+                ),
+            ),
+            paper_bgcolor=colors['background'],
+            plot_bgcolor=colors['background'],
+            margin=dict(l=0, 
+                        r=0, 
+                        t=0, 
+                        b=0
                         ),
+            height=300,
+        )
+    fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='#3A3A3A')
+    fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='#3A3A3A')
+    fig.update_yaxes(zeroline=True, zerolinewidth=2, zerolinecolor='#3A3A3A')
+    return fig
 
-                html.Div([html.Span('Dashboard by: Rheco Paradhika Kusuma',
-                             style={'color': colors['text'],
-                             }),
+## Distribution of a metric over the selection, from the histogram bins that hold loans
+@timed_figure
+@lean.leaned
+def distribution_graph(histogram):
+    held = np.flatnonzero(histogram.to_numpy())
+    if len(held):
+        histogram = histogram.iloc[held[0]:held[-1] + 1]
+    fig = go.Figure(go.Bar(x=histogram.index, y=histogram.values, name='Loans',
+                           marker_color=colors['number_of_loan']))
 
-                         ],
-                         className='sub-title'
-                         ),
+    fig.update_layout(
+            bargap=0,
+            xaxis_title=None,
+            yaxis_title='Loans',
+            font=dict(
+                family="Courier New, monospace",
+                size=14,
+                color=colors['figure_text'],
+            ),
+            paper_bgcolor=colors['background'],
+            plot_bgcolor=colors['background'],
+            margin=dict(l=0, 
+                        r=0, 
+                        t=0, 
+                        b=0
+                        ),
+            height=300,
+        )
+    fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='#3A3A3A')
+    fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='#3A3A3A')
+    return fig
 
-                html.Div([html.Span('Created: 18-06-2022',
-                             style={'color': colors['text'],
-                             }),
+## Geographic exposure: one marker per ZIP (or per bin of ZIPs), sized by the funded
+## amount and colored by the metric
+@timed_figure
+@lean.leaned
+def geo_map(points, metric):
+    fig = go.Figure(go.Scattergeo(
+        lat=points['lat'], lon=points['lon'], text=points['label'],
+        customdata=np.stack([points['funded_amount'], points['loans'], points[metric]], axis=-1),
+        hovertemplate='%{text}<br>Funded %{customdata[0]:$,.0f}<br>%{customdata[1]} loans<br>'
+                      + ZIP_METRICS[metric] + ' %{customdata[2]:,.3f}<extra></extra>',
+        marker=dict(size=points['funded_amount'], sizemode='area', sizemin=3,
+                    sizeref=2 * points['funded_amount'].max() / 30 ** 2 if len(points) else 1,
+                    color=points[metric], colorscale='Blues', showscale=True,
+                    colorbar=dict(thickness=10, tickfont=dict(color=colors['figure_text']))),
+    ))
+
+    fig.update_geos(
+            scope='usa',
+            fitbounds='locations',
+            bgcolor=colors['background'],
+            landcolor='#393939',
+            showlakes=False,
+            subunitcolor='#3A3A3A',
+        )
+    fig.update_layout(
+            font=dict(
+                family="Courier New, monospace",
+                size=14,
+                color=colors['figure_text'],
+            ),
+            paper_bgcolor=colors['background'],
+            margin=dict(l=0, 
+                        r=0, 
+                        t=0, 
+                        b=0
+                        ),
+            height=400,
+        )
+    return fig
 
-                         ],
-                         className='sub-title'
-                         ),
+## Top ZIP codes by the metric (works without the centroid lookup)
+@timed_figure
+@lean.leaned
+def geo_zip_graph(totals, metric, top=20):
+    totals = totals[totals['loans'] > 0].nlargest(top, metric)
+    fig = go.Figure(go.Bar(x=[f"{zip_code:05d}" for zip_code in totals.index], y=totals[metric].round(4),
+                           name=ZIP_METRICS[metric], marker_color=colors['total_funded_amount']))
 
-            ], className="header"
-        ),
+    fig.update_layout(
+            xaxis_title=None,
+            yaxis_title=ZIP_METRICS[metric],
+            xaxis_type='category',
+            font=dict(
+                family="Courier New, monospace",
+                size=14,
+                color=colors['figure_text'],
+            ),
+            paper_bgcolor=colors['background'],
+            plot_bgcolor=colors['background'],
+            margin=dict(l=0, 
+                        r=0, 
+                        t=0, 
+                        b=0
+                        ),
+            height=300,
+        )
+    fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='#3A3A3A')
+    fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='#3A3A3A')
+    return fig
 
-        # Top column display of confirmed, death and recovered total numbers
-        html.Div([
-            html.Div([
-                html.H4(children='Number of Loan Given: ',
-                       style={
-                           'textAlign': 'center',
-                           'color': colors['number_of_loan'],
-                       }
-                       ),
-                html.P(f"{lp_df['loan_id'].nunique()}",
-                       style={
-                    'textAlign': 'center',
-                    'color': colors['number_of_loan'],
-                    'fontSize': 30,
-                }
-                ),
-            ],
-                style=divBorderStyle,
-                className='loan descriptive columns',
+## Projected Cash Flows
+@timed_figure
+@lean.leaned
+def projected_cash_flows(projection, purpose='All'):
+    if purpose in projection.index.get_level_values('purpose'):
+        df_projection = (projection.loc[purpose] / 1000000).round(decimals = 3).reset_index()
+    else:
+        df_projection = pd.DataFrame(columns=['month', 'interest', 'principal', 'balance'])
+
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    fig.add_trace(go.Bar(x=df_projection['month'], y=df_projection['principal'], name='Principal',
+                         marker_color=colors['total_funded_amount']), secondary_y=False)
+    fig.add_trace(go.Bar(x=df_projection['month'], y=df_projection['interest'], name='Interest',
+                         marker_color=colors['interest_rate']), secondary_y=False)
+    fig.add_trace(go.Scatter(x=df_projection['month'], y=df_projection['balance'], name='Outstanding Balance',
+                             line=dict(color=colors['number_of_loan'])), secondary_y=True)
+
+    fig.update_layout(
+            barmode='stack',
+            xaxis_title=None,
+            font=dict(
+                family="Courier New, monospace",
+                size=14,
+                color=colors['figure_text'],
             ),
-            html.Div([
-                html.H4(children='Total Funded Amount: ',
-                       style={
-                           'textAlign': 'center',
-                           'color': colors['total_funded_amount'],
-                       }
-                       ),
-                html.P(f"{np.round(lp_df['funded_amount'].sum() / 1000000, 2)}" + "M",
-                       style={
-                    'textAlign': 'center',
-                    'color': colors['total_funded_amount'],
-                    'fontSize': 30,
-                }
-                ),
-            ],
-                style=divBorderStyle,
-                className='loan descriptive columns'),
-            html.Div([
-                html.H4(children='Average Interest Rate: ',
-                       style={
-                           'textAlign': 'center',
-                           'color': colors['interest_rate'],
-                       }
-                       ),
-                html.P(f"{np.round(lp_df['interest rate percent'].mean(), 2)}" + "%",
-                       style={
-                    'textAlign': 'center',
-                    'color': colors['interest_rate'],
-                    'fontSize': 30,
-                }
+            legend=dict(
+                x=0.02,
+                y=1.25,
+                orientation='h',
+                font=dict(
+                    family="sans-serif",
+                    size=9,
+                    color=colors['figure_text']
                 ),
-            ],
-                style=divBorderStyle,
-                className='loan descriptive columns'),
+            ),
+            paper_bgcolor=colors['background'],
+            plot_bgcolor=colors['background'],
+            margin=dict(l=0, 
+                        r=0, 
+                        t=0, 
+                        b=0
+                        ),
+            height=300,
+        )
+    fig.update_yaxes(title_text='Monthly Payment (M)', secondary_y=False)
+    fig.update_yaxes(title_text='Balance (M)', showgrid=False, secondary_y=True)
+    fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='#3A3A3A')
+    fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='#3A3A3A', secondary_y=False)
+    fig.update_yaxes(zeroline=True, zerolinewidth=2, zerolinecolor='#3A3A3A')
+    return fig
 
-            # Graph of Demographic
-            html.Div(
-                [
-                    html.H4(children='Purpose Demographic',
-                            style={
-                                'textAlign': 'center',
-                                'color': colors['text'],
-                                'backgroundColor': colors['background'],
+## Vintage curves: outstanding balance as a share of the funded amount by months on book
+@timed_figure
+@lean.leaned
+def vintage_graph(curves):
+    df_vintage = (curves * 100).round(decimals = 2).stack().dropna().rename('outstanding').reset_index()
+    fig = px.line(df_vintage, x='months_on_book', y='outstanding', color='cohort',
+                  color_discrete_sequence = px.colors.qualitative.Light24)
 
-                            },
-                            className='title demographic columns'
-                            ),
-                    html.Div([
-                        dcc.Graph(
-                            id='demographic-graph',
-                            figure=demographic(lp_df)
-                        )
-                    ], className='graph demographic columns',
-                    ),
+    fig.update_layout(
+            xaxis_title='Months on Book',
+            yaxis_title='Outstanding (% of Funded)',
+            font=dict(
+                family="Courier New, monospace",
+                size=14,
+                color=colors['figure_text'],
+            ),
+            legend=dict(
+                x=1.02,
+                y=1,
+                traceorder="normal",
+                font=dict(
+                    family="sans-serif",
+                    size=9,
+                    color=colors['figure_text']
+                ),
+            ),
+            paper_bgcolor=colors['background'],
+            plot_bgcolor=colors['background'],
+            margin=dict(l=0, 
+                        r=0, 
+                        t=0, 
+                        b=0
+                        ),
+            height=300,
+        )
+    fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='#3A3A3A')
+    fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='#3A3A3A')
+    fig.update_yaxes(zeroline=True, zerolinewidth=2, zerolinecolor='#3A3A3A')
+    return fig
 
-                ], className="demographic",
-                
+## Rate-shock scenarios side by side: one box per scenario (5th to 95th percentile whiskers)
+@timed_figure
+@lean.leaned
+def scenario_comparison(results, metric, purpose='All'):
+    fig = go.Figure()
+    for name, result in results.items():
+        summary = result[metric].get(purpose)
+        if summary is None:
+            continue
+        low, q1, median, q3, high = summary['quantiles']
+        fig.add_trace(go.Box(x=[name], name=name, q1=[q1], median=[median], q3=[q3],
+                             lowerfence=[low], upperfence=[high], mean=[summary['mean']]))
+
+    fig.update_layout(
+            showlegend=False,
+            xaxis_title=None,
+            yaxis_title=None,
+            font=dict(
+                family="Courier New, monospace",
+                size=14,
+                color=colors['figure_text'],
             ),
+            paper_bgcolor=colors['background'],
+            plot_bgcolor=colors['background'],
+            margin=dict(l=0, 
+                        r=0, 
+                        t=0, 
+                        b=0
+                        ),
+            height=300,
+        )
+    fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='#3A3A3A')
+    fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='#3A3A3A')
+    fig.update_yaxes(zeroline=True, zerolinewidth=2, zerolinecolor='#3A3A3A')
+    return fig
+    
+
+# Create App Dash
+
+## Static figures and KPI cards of a whole portfolio: built on first use (or by
+## the warm-up thread) instead of at import, and cached until the data changes
+figure_lock = threading.Lock()
+
+
+def static_figures(portfolio=None):
+    lp = portfolio_state(portfolio)
+    with figure_lock:
+        if 'figures' not in lp['memo']:
+            first_build = 'figure build' not in startup_timings
+            with startup_phase('figure build'):
+                totals = range_totals(lp['index'])
+                lp['memo']['figures'] = (kpi_values(totals, loan_count(lp)),
+                                         (demographic(totals), draw_interest_purpose_graph(lp['cube']),
+                                          draw_interest_graph(lp['cube']), avg_funding_duration(totals)))
+            if first_build:
+                print(startup_report())
+        return lp['memo']['figures']
+
+
+# Set LOAN_WARMUP=0 to build the figures on the first page load instead of in a
+# background thread right after startup
+WARMUP = os.environ.get('LOAN_WARMUP', '1') not in ('', '0')
+
 
-            # Graph of Interest Rate
+def start_warmup():
+    threading.Thread(target=static_figures, name='figure-warmup', daemon=True).start()
+
+
+# Layout is served per page load from the cached figures
+def serve_layout():
+    lp = portfolio_state()
+    kpis, figures = static_figures()
+    return html.Div(
+        html.Div([
+            # Header display
             html.Div(
                 [
-                    html.H4(children='Interest Rate',
+                    html.H1(children='Luxury Loan Dashboard',
                             style={
                                 'textAlign': 'center',
                                 'color': colors['text'],
                                 'backgroundColor': colors['background'],
-
                             },
-                            className='twelve columns'
+                            className='title',
                             ),
-                    html.Div([
-                        dcc.Graph(
-                            id='interest-purpose-graph',
-                            figure=draw_interest_purpose_graph(lp_df)
 
-                        )
-                    ], className='interest columns'
-                    ),
-                    html.Div([
-                        dcc.Graph(
-                            id='interest-graph',
-                            figure=draw_interest_graph(lp_df)
+                    html.Div([html.Span('Dashboard by: Rheco Paradhika Kusuma',
+                                 style={'color': colors['text'],
+                                 }),
 
-                        )
-                    ], className='interest columns'
-                    ),
+                             ],
+                             className='sub-title'
+                             ),
+
+                    html.Div([html.Span('Created: 18-06-2022',
+                                 style={'color': colors['text'],
+                                 }),
 
-                ], className="row",
-                style={
-                    'textAlign': 'left',
-                    'color': colors['text'],
-                    'backgroundColor': colors['background'],
-                },
+                             ],
+                             className='sub-title'
+                             ),
+
+                ], className="header"
             ),
 
-            # Graph of Average Funding and Duration
-            html.Div(
-                [
-                    html.H4(children='Average Funding and Duration',
-                            style={
-                                'textAlign': 'center',
-                                'color': colors['text'],
-                                'backgroundColor': colors['background'],
+            # Portfolio selector, each one is loaded on first pick
+            html.Div([
+                dcc.Dropdown(list(PORTFOLIOS), DEFAULT_PORTFOLIO, id='portfolio-dropdown', clearable=False,
+                             disabled=len(PORTFOLIOS) < 2,
+                             style=dict(color="#000000"))
+            ], style={'width': '30%', 'margin': 'auto', 'padding-bottom': 10}),
 
-                            },
-                            className='twelve columns'
-                            ),
-                    html.Div([
-                        dcc.Graph(
-                            id='funding-duration-graph',
-                            figure=avg_funding_duration(lp_df)
-                        )
-                    ], className='graph average funding duration columns',
-                    style={'padding-right': '130px'}
+            # Live refresh: polls for new loans, the store holds the data version shown on this page
+            dcc.Interval(id='refresh-interval', interval=max(REFRESH_SECONDS, 1) * 1000, disabled=not REFRESH_SECONDS),
+            dcc.Store(id='refresh-version', data=0),
+
+            # Top column display of confirmed, death and recovered total numbers
+            html.Div([
+                html.Div([
+                    html.H4(children='Number of Loan Given: ',
+                           style={
+                               'textAlign': 'center',
+                               'color': colors['number_of_loan'],
+                           }
+                           ),
+                    html.P(kpis[0], id='loan-count',
+                           style={
+                        'textAlign': 'center',
+                        'color': colors['number_of_loan'],
+                        'fontSize': 30,
+                    }
                     ),
+                ],
+                    style=divBorderStyle,
+                    className='loan descriptive columns',
+                ),
+                html.Div([
+                    html.H4(children='Total Funded Amount: ',
+                           style={
+                               'textAlign': 'center',
+                               'color': colors['total_funded_amount'],
+                           }
+                           ),
+                    html.P(kpis[1], id='total-funded-amount',
+                           style={
+                        'textAlign': 'center',
+                        'color': colors['total_funded_amount'],
+                        'fontSize': 30,
+                    }
+                    ),
+                ],
+                    style=divBorderStyle,
+                    className='loan descriptive columns'),
+                html.Div([
+                    html.H4(children='Average Interest Rate: ',
+                           style={
+                               'textAlign': 'center',
+                               'color': colors['interest_rate'],
+                           }
+                           ),
+                    html.P(kpis[2], id='average-interest-rate',
+                           style={
+                        'textAlign': 'center',
+                        'color': colors['interest_rate'],
+                        'fontSize': 30,
+                    }
+                    ),
+                ],
+                    style=divBorderStyle,
+                    className='loan descriptive columns'),
+
+                # Funded date range, filters every chart and the cards above
+                html.Div(
+                    [
+                        html.H4(children='Funded Date',
+                                style={
+                                    'textAlign': 'center',
+                                    'color': colors['text'],
+                                    'backgroundColor': colors['background'],
+                                },
+                                className='twelve columns'
+                                ),
+                        dcc.RangeSlider(
+                            id='date-range',
+                            min=slider_range(lp['index'])[0],
+                            max=slider_range(lp['index'])[1],
+                            step=1,
+                            marks=slider_range(lp['index'])[2],
+                            value=list(slider_range(lp['index'])[:2]),
+                        ),
+                        # Periods of the time-series charts
+                        dcc.RadioItems(
+                            id='granularity',
+                            options=[{'label': label, 'value': value} for label, value in
+                                     zip(['Weekly', 'Monthly', 'Quarterly', 'Yearly'], GRANULARITIES)],
+                            value='month',
+                            inline=True,
+                            style={'textAlign': 'center', 'color': colors['text']},
+                        ),
+                        # Means, or percentile bands read from the distribution sketches
+                        dcc.RadioItems(
+                            id='line-style',
+                            options=[{'label': 'Mean', 'value': 'mean'},
+                                     {'label': 'Percentile Bands (p5, p50, p95)', 'value': 'bands'}],
+                            value='mean',
+                            inline=True,
+                            style={'textAlign': 'center', 'color': colors['text']},
+                        ),
+                    ], className='twelve columns',
+                ),
 
-                ], className="average funding duration columns",
+                # Cross-filters: click a purpose on the pie or the funding bars, or pick values below
+                dcc.Store(id='cross-filter', data={}),
+                html.Div(
+                    [
+                        html.Div([
+                            dcc.Dropdown(
+                                options=filter_options(column, lp),
+                                value=[],
+                                multi=True,
+                                placeholder=column.title(),
+                                disabled=lp['bitmaps'] is None and lp['database'] is None,
+                                id=filter_id(column),
+                                style=dict(color="#000000"),
+                            )
+                        ], className='three columns')
+                        for column in FILTER_COLUMNS[1:]
+                    ], className='twelve columns',
+                    style={'padding-top': 10},
+                ),
+
+                # Graph of Demographic
+                html.Div(
+                    [
+                        html.H4(children='Purpose Demographic',
+                                style={
+                                    'textAlign': 'center',
+                                    'color': colors['text'],
+                                    'backgroundColor': colors['background'],
+
+                                },
+                                className='title demographic columns'
+                                ),
+                        html.Div([
+                            dcc.Graph(
+                                id='demographic-graph',
+                                figure=figures[0]
+                            )
+                        ], className='graph demographic columns',
+                        ),
+
+                    ], className="demographic",
                 
-            ),
+                ),
 
-            # Graph of LTV and Loan Constant
-            html.Div(
-                [
-                    html.H4(children='Mortgage Constant and Loan to Value Ratio',
-                            style={
-                                'textAlign': 'center',
-                                'color': colors['text'],
-                                'backgroundColor': colors['background'],
+                # Graph of Interest Rate
+                html.Div(
+                    [
+                        html.H4(children='Interest Rate',
+                                style={
+                                    'textAlign': 'center',
+                                    'color': colors['text'],
+                                    'backgroundColor': colors['background'],
+
+                                },
+                                className='twelve columns'
+                                ),
+                        html.Div([
+                            dcc.Graph(
+                                id='interest-purpose-graph',
+                                figure=figures[1]
+
+                            )
+                        ], className='interest columns'
+                        ),
+                        html.Div([
+                            dcc.Graph(
+                                id='interest-graph',
+                                figure=figures[2]
 
-                            },
-                            className='twelve columns'
-                            ),
-                    html.Div([
-                            dcc.Dropdown(['All', 'Boat', 'Commerical Property', 
-                            'Home', 'Investment Property', 'Plane'], 'All', id='demo-dropdown',
-                            style=dict(
-                                width='50%',
-                                left='25%',
-                                textAlign= 'center',
-                                right='auto',
-                                display='block',
-                                verticalAlign="middle",
-                                color= "#000000"
-                            ))
-                    ], style = {'width': '100%', 'display': 'flex', 'align-items': 'center', 'justify-content': 'center'}),
-
-                    html.Div([
-                        dcc.Graph(
-                            id='loan-constant-graph',
+                            )
+                        ], className='interest columns'
+                        ),
 
+                    ], className="row",
+                    style={
+                        'textAlign': 'left',
+                        'color': colors['text'],
+                        'backgroundColor': colors['background'],
+                    },
+                ),
+
+                # Graph of Average Funding and Duration
+                html.Div(
+                    [
+                        html.H4(children='Average Funding and Duration',
+                                style={
+                                    'textAlign': 'center',
+                                    'color': colors['text'],
+                                    'backgroundColor': colors['background'],
+
+                                },
+                                className='twelve columns'
+                                ),
+                        html.Div([
+                            dcc.Graph(
+                                id='funding-duration-graph',
+                                figure=figures[3]
+                            )
+                        ], className='graph average funding duration columns',
+                        style={'padding-right': '130px'}
+                        ),
+
+                    ], className="average funding duration columns",
+                
+                ),
+
+                # Graph of LTV and Loan Constant
+                html.Div(
+                    [
+                        html.H4(children='Mortgage Constant and Loan to Value Ratio',
+                                style={
+                                    'textAlign': 'center',
+                                    'color': colors['text'],
+                                    'backgroundColor': colors['background'],
+
+                                },
+                                className='twelve columns'
+                                ),
+                        html.Div([
+                                dcc.Dropdown(PURPOSE_OPTIONS, 'All', id='demo-dropdown',
+                                style=dict(
+                                    width='50%',
+                                    left='25%',
+                                    textAlign= 'center',
+                                    right='auto',
+                                    display='block',
+                                    verticalAlign="middle",
+                                    color= "#000000"
+                                ))
+                        ], style = {'width': '100%', 'display': 'flex', 'align-items': 'center', 'justify-content': 'center'}),
+
+                        dcc.Store(id='purpose-series'),
+                        html.Div([
+                            dcc.Graph(
+                                id='loan-constant-graph',
+
+                            )
+                        ], className='lc ltv columns'
+                        ),
+                        html.Div([
+                            dcc.Graph(
+                                id='ltv-graph',
+
+                            )
+                        ], className='lc ltv columns'
                         )
-                    ], className='lc ltv columns'
-                    ),
-                    html.Div([
-                        dcc.Graph(
-                            id='ltv-graph',
+                    ]
+                ),
 
+                # Distribution of a metric for the purpose picked above
+                html.Div(
+                    [
+                        html.H4(children='Distribution',
+                                style={
+                                    'textAlign': 'center',
+                                    'color': colors['text'],
+                                    'backgroundColor': colors['background'],
+
+                                },
+                                className='twelve columns'
+                                ),
+                        html.Div([
+                                dcc.Dropdown([{'label': label, 'value': metric} for metric, label in
+                                              zip(SKETCH_METRICS, ['Interest Rate', 'Loan to Value Ratio', 'Mortgage Constant'])],
+                                'interest rate percent', id='distribution-dropdown', clearable=False,
+                                style=dict(
+                                    width='50%',
+                                    left='25%',
+                                    textAlign= 'center',
+                                    right='auto',
+                                    display='block',
+                                    verticalAlign="middle",
+                                    color= "#000000"
+                                ))
+                        ], style = {'width': '100%', 'display': 'flex', 'align-items': 'center', 'justify-content': 'center'}),
+
+                        html.Div([
+                            dcc.Graph(
+                                id='distribution-graph',
+
+                            )
+                        ], className='twelve columns'
                         )
-                    ], className='lc ltv columns'
-                    )
-                ]
-            ),
+                    ]
+                ),
 
-            html.Div(
-                [
-                        html.Hr(),
-                        html.P('Social Media:  ',
-                               style={'display': 'block'}),
-                        html.A([html.Img(src=app.get_asset_url('Linkedin.png'), style={'height':'1%', 'width':'2%'})],
-                               href='https://www.linkedin.com/in/rheco-paradhika-kusuma/?originalSubdomain=id'),
-                        html.A([html.Img(src=app.get_asset_url('Gmail.png'), style={'height':'8%', 'width':'2.6%'})],
-                               href='mailto:rhecopk@gmail.com'),
-                        html.Hr(),
-                    ], className="twelve columns",
-                    style={'fontSize': 18, 'padding-top': 20}
+                # Geographic exposure by ZIP code, over the date range and cross-filters
+                html.Div(
+                    [
+                        html.H4(children='Geographic Exposure',
+                                style={
+                                    'textAlign': 'center',
+                                    'color': colors['text'],
+                                    'backgroundColor': colors['background'],
+
+                                },
+                                className='twelve columns'
+                                ),
+                        html.Div([
+                                dcc.Dropdown([{'label': label, 'value': metric} for metric, label in ZIP_METRICS.items()],
+                                'funded_amount', id='geo-dropdown', clearable=False,
+                                style=dict(
+                                    width='50%',
+                                    left='25%',
+                                    textAlign= 'center',
+                                    right='auto',
+                                    display='block',
+                                    verticalAlign="middle",
+                                    color= "#000000"
+                                ))
+                        ], style = {'width': '100%', 'display': 'flex', 'align-items': 'center', 'justify-content': 'center'}),
+
+                        html.Div([
+                            dcc.Graph(
+                                id='geo-map',
+
+                            )
+                        ], className='twelve columns',
+                        style={} if len(ZIP_CENTROIDS) else {'display': 'none'}
+                        ),
+                        # Without the lookup, say how to build it instead of the map
+                        html.Div([
+                            html.P('The map needs the ZIP centroid lookup: run `python geography.py` once to build '
+                                   'it from the Census gazetteer.',
+                                   style={'textAlign': 'center', 'color': colors['text']})
+                        ], className='twelve columns',
+                        style={'display': 'none'} if len(ZIP_CENTROIDS) else {}
+                        ),
+                        html.Div([
+                            dcc.Graph(
+                                id='geo-zip-graph',
+
+                            )
+                        ], className='twelve columns'
+                        )
+                    ]
+                ),
+
+                # Graph of Projected Cash Flows
+                html.Div(
+                    [
+                        html.H4(children='Projected Cash Flows',
+                                style={
+                                    'textAlign': 'center',
+                                    'color': colors['text'],
+                                    'backgroundColor': colors['background'],
+
+                                },
+                                className='twelve columns'
+                                ),
+                        whole_portfolio_note(),
+                        html.Div([
+                                dcc.Dropdown(PURPOSE_OPTIONS, 'All', id='cashflow-dropdown',
+                                style=dict(
+                                    width='50%',
+                                    left='25%',
+                                    textAlign= 'center',
+                                    right='auto',
+                                    display='block',
+                                    verticalAlign="middle",
+                                    color= "#000000"
+                                ))
+                        ], style = {'width': '100%', 'display': 'flex', 'align-items': 'center', 'justify-content': 'center'}),
+                        html.Progress(id='cashflow-progress', value='0', max='1', style={'display': 'none'}),
+
+                        html.Div([
+                            dcc.Graph(
+                                id='cashflow-graph',
+
+                            )
+                        ], className='twelve columns'
+                        )
+                    ]
                 ),
 
+                # Rate-shock scenarios: Mortgage Constant and Loan to Value Ratio per scenario
+                html.Div(
+                    [
+                        html.H4(children='Rate-Shock Scenarios',
+                                style={
+                                    'textAlign': 'center',
+                                    'color': colors['text'],
+                                    'backgroundColor': colors['background'],
+
+                                },
+                                className='twelve columns'
+                                ),
+                        whole_portfolio_note(),
+                        html.Div([
+                                dcc.Dropdown(list(SCENARIOS), list(SCENARIOS), id='scenario-dropdown', multi=True,
+                                disabled=not scenario_enabled(lp),
+                                style=dict(
+                                    width='100%',
+                                    color= "#000000"
+                                )),
+                                dcc.Dropdown(PURPOSE_OPTIONS, 'All', id='scenario-purpose-dropdown',
+                                style=dict(
+                                    width='50%',
+                                    color= "#000000"
+                                ))
+                        ], style = {'width': '100%', 'display': 'flex', 'align-items': 'center', 'justify-content': 'center'}),
+                        html.Progress(id='scenario-progress', value='0', max='1', style={'display': 'none'}),
+
+                        html.Div([
+                            dcc.Graph(
+                                id='scenario-mortgage-constant-graph',
+
+                            )
+                        ], className='lc ltv columns'
+                        ),
+                        html.Div([
+                            dcc.Graph(
+                                id='scenario-ltv-graph',
+
+                            )
+                        ], className='lc ltv columns'
+                        )
+                    ]
+                ),
+
+                # Vintage curves of the picked origination quarters
+                html.Div(
+                    [
+                        html.H4(children='Vintage Curves',
+                                style={
+                                    'textAlign': 'center',
+                                    'color': colors['text'],
+                                    'backgroundColor': colors['background'],
+
+                                },
+                                className='twelve columns'
+                                ),
+                        whole_portfolio_note(),
+                        html.Div([
+                                dcc.Dropdown(cohort_labels(cohort_matrix(lp)),
+                                default_cohorts(cohort_labels(cohort_matrix(lp))), id='cohort-dropdown', multi=True,
+                                placeholder='Origination Quarter',
+                                style=dict(
+                                    width='100%',
+                                    color= "#000000"
+                                ))
+                        ], style = {'width': '100%', 'display': 'flex', 'align-items': 'center', 'justify-content': 'center'}),
+
+                        html.Div([
+                            dcc.Graph(
+                                id='vintage-graph',
+
+                            )
+                        ], className='twelve columns'
+                        )
+                    ]
+                ),
+
+                # Loan drill-down, paged, sorted and filtered on the server
+                html.Div(
+                    [
+                        html.H4(children='Loans',
+                                style={
+                                    'textAlign': 'center',
+                                    'color': colors['text'],
+                                    'backgroundColor': colors['background'],
+                                },
+                                className='twelve columns'
+                                ),
+                        dt.DataTable(
+                            id='loan-table',
+                            columns=[{'name': column.title(), 'id': column} for column in TABLE_COLUMNS],
+                            page_current=0,
+                            page_size=15,
+                            page_action='custom',
+                            sort_action='custom',
+                            sort_mode='single',
+                            sort_by=[],
+                            filter_action='custom',
+                            filter_query='',
+                            style_header={'backgroundColor': '#393939', 'color': colors['text']},
+                            style_cell={'backgroundColor': colors['background'], 'color': colors['text'],
+                                        'fontFamily': 'sans-serif'},
+                            style_filter={'backgroundColor': '#E1E2E5'},
+                        ),
+                    ], className='twelve columns',
+                ),
+
+                html.Div(
+                    [
+                            html.Hr(),
+                            html.P('Social Media:  ',
+                                   style={'display': 'block'}),
+                            html.A([html.Img(src=app.get_asset_url('Linkedin.png'), style={'height':'1%', 'width':'2%'})],
+                                   href='https://www.linkedin.com/in/rheco-paradhika-kusuma/?originalSubdomain=id'),
+                            html.A([html.Img(src=app.get_asset_url('Gmail.png'), style={'height':'8%', 'width':'2.6%'})],
+                                   href='mailto:rhecopk@gmail.com'),
+                            html.Hr(),
+                        ], className="twelve columns",
+                        style={'fontSize': 18, 'padding-top': 20}
+                    ),
+
+
+            ], className='row'),]),
+            style={
+            'textAlign': 'left',
+            'color': colors['text'],
+            'backgroundColor': colors['background'],
+            "display": "block"
+        },)
+
+
+app.layout = serve_layout
+
+@app.callback(
+    [Output('refresh-version', 'data'),
+     Output('date-range', 'min'), Output('date-range', 'max'), Output('date-range', 'marks'), Output('date-range', 'value')]
+    + [Output(filter_id(column), 'options') for column in FILTER_COLUMNS[1:]]
+    + [Output(filter_id(column), 'value') for column in FILTER_COLUMNS[1:]],
+    [Input('refresh-interval', 'n_intervals'), Input('portfolio-dropdown', 'value')],
+    [State('refresh-version', 'data'), State('date-range', 'value'), State('date-range', 'max')]
+)
+@timed_callback
+def refresh_dashboard(n_intervals, portfolio, version, date_range, previous_max):
+    lp = portfolio_state(portfolio)
+    unchanged = [dash.no_update] * (2 * len(FILTER_COLUMNS[1:]))
+
+    # Another portfolio picked: its whole date range and filter values, no filter set
+    if 'portfolio-dropdown.value' in [t['prop_id'] for t in dash.callback_context.triggered]:
+        first, last, marks = slider_range(lp['index'])
+        return (data_version(lp), first, last, marks, [first, last],
+                *[filter_options(column, lp) for column in FILTER_COLUMNS[1:]],
+                *[[] for column in FILTER_COLUMNS[1:]])
+
+    if lp['watch'] is None:
+        raise PreventUpdate
+    lp = refresh_portfolio(lp)
+    current = data_version(lp)
+    if current == version:
+        raise PreventUpdate
+
+    first, last, marks = slider_range(lp['index'])
+    # A range that reached the newest month keeps following it
+    if date_range and date_range[1] >= previous_max:
+        date_range = [date_range[0], last]
+    return (current, first, last, marks, date_range, *unchanged)
 
-        ], className='row'),]),
-        style={
-        'textAlign': 'left',
-        'color': colors['text'],
-        'backgroundColor': colors['background'],
-        "display": "block"
-    },)
 
 @app.callback(
-    [Output('loan-constant-graph', 'figure'), Output('ltv-graph', 'figure')],
-    [Input('demo-dropdown', 'value')]
+    [Output('loan-count', 'children'), Output('total-funded-amount', 'children'), Output('average-interest-rate', 'children'),
+     Output('demographic-graph', 'figure'), Output('interest-purpose-graph', 'figure'),
+     Output('interest-graph', 'figure'), Output('funding-duration-graph', 'figure')],
+    [Input('date-range', 'value'), Input('cross-filter', 'data'), Input('refresh-version', 'data'),
+     Input('portfolio-dropdown', 'value'), Input('granularity', 'value'), Input('line-style', 'value')]
 )
-def purpose_selection(value):
-    fig1 = loan_constant(lp_df, value)
-    fig2 = loan_value(lp_df, value)
+@timed_callback
+def date_range_selection(date_range, filters=None, version=None, portfolio=None, granularity='month', line_style='mean'):
+    lp = portfolio_state(portfolio)
+    if full_selection(lp, date_range, filters) and granularity == 'month' and line_style == 'mean':
+        kpis, figures = static_figures(portfolio)
+        return (*kpis, *figures)
+
+    with timer('date_range_selection', 'aggregation'):
+        cube, totals = date_selection(date_range, filters, portfolio, granularity)
+        # The per-purpose charts are where purposes get picked, so they ignore that filter
+        _, purpose_totals = date_selection(date_range, dict(filters or {}, purpose=[]), portfolio)
+    count = loan_count(lp) if full_selection(lp, date_range, filters) else None
+
+    if line_style == 'bands':
+        with timer('date_range_selection', 'sketches'):
+            medians = {purpose: band_selection('interest rate percent', purpose, date_range, filters, portfolio, granularity)
+                       for purpose in cube_purposes(cube)}
+            bands = band_selection('interest rate percent', ALL_PURPOSE, date_range, filters, portfolio, granularity)
+        interest_figures = band_graph(medians, 1), band_graph({ALL_PURPOSE: bands}, 1)
+    else:
+        interest_figures = draw_interest_purpose_graph(cube), draw_interest_graph(cube)
+    return (*kpi_values(totals, count),
+            demographic(purpose_totals), *interest_figures, avg_funding_duration(purpose_totals))
+
+
+## Cross-filter: clicks on the purpose charts toggle purposes, dropdowns set the rest
+@app.callback(
+    Output('cross-filter', 'data'),
+    [Input('demographic-graph', 'clickData'), Input('funding-duration-graph', 'clickData')]
+    + [Input(filter_id(column), 'value') for column in FILTER_COLUMNS[1:]],
+    [State('cross-filter', 'data')]
+)
+@timed_callback
+def cross_filter_selection(pie_click, bar_click, *values_and_state):
+    *values, filters = values_and_state
+    filters = dict(filters or {})
+    for column, selected in zip(FILTER_COLUMNS[1:], values):
+        filters[column] = selected or []
+
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    click = None
+    if 'demographic-graph.clickData' in triggered and pie_click:
+        click = pie_click['points'][0].get('label')
+    elif 'funding-duration-graph.clickData' in triggered and bar_click:
+        click = bar_click['points'][0].get('y')
+    if click is not None:
+        purposes = list(filters.get('purpose', []))
+        purposes.remove(click) if click in purposes else purposes.append(click)
+        filters['purpose'] = purposes
+    return filters
+
+
+@timed_callback
+def purpose_selection(value, date_range=None, filters=None, version=None, portfolio=None, granularity='month',
+                      line_style='mean'):
+    if line_style == 'bands':
+        with timer('purpose_selection', 'sketches'):
+            return purpose_bands(value, date_range, filters, portfolio, granularity)
+
+    with timer('purpose_selection', 'aggregation'):
+        cube, _ = date_selection(date_range, filters, portfolio, granularity)
+    fig1 = loan_constant(cube, value)
+    fig2 = loan_value(cube, value)
     return fig1, fig2
 
 
+def purpose_bands(value, date_range=None, filters=None, portfolio=None, granularity='month'):
+    constant = band_selection('mortgage_constant', value, date_range, filters, portfolio, granularity)
+    ltv = band_selection('ltv', value, date_range, filters, portfolio, granularity)
+    return band_graph({value: constant}, 3), band_graph({value: ltv}, 2)
+
+
+## Series of every purpose for the clientside dropdown: the "All" figure is sent as
+## the template (layout and trace style), the other purposes only as x / y lists
+def purpose_series(cube):
+    store = {}
+    for metric, figure in (('mortgage_constant', loan_constant), ('ltv', loan_value)):
+        template = figure(cube, 'All').to_plotly_json()
+        trace = template['data'][0] if template['data'] else {}
+        trace = {k: v for k, v in trace.items() if k not in ('x', 'y')}
+        decimals = 3 if metric == 'mortgage_constant' else 2
+
+        series = {}
+        for purpose in PURPOSE_OPTIONS:
+            values = cube_series(cube, metric, purpose).round(decimals = decimals)
+            if len(values):
+                series[purpose] = {'x': values.index.tolist(), 'y': values.tolist()}
+        store[metric] = {'trace': trace, 'layout': template['layout'], 'series': series}
+    return store
+
+
+if CLIENTSIDE_PURPOSE:
+    @app.callback(
+        Output('purpose-series', 'data'),
+        [Input('date-range', 'value'), Input('cross-filter', 'data'), Input('refresh-version', 'data'),
+         Input('portfolio-dropdown', 'value'), Input('granularity', 'value'), Input('line-style', 'value')]
+    )
+    @timed_callback
+    def purpose_series_selection(date_range=None, filters=None, version=None, portfolio=None, granularity='month',
+                                 line_style='mean'):
+        # Percentile bands are drawn on the server, one pair of figures per purpose
+        if line_style == 'bands':
+            with timer('purpose_series_selection', 'sketches'):
+                return {'bands': {purpose: purpose_bands(purpose, date_range, filters, portfolio, granularity)
+                                  for purpose in PURPOSE_OPTIONS}}
+        with timer('purpose_series_selection', 'aggregation'):
+            cube, _ = date_selection(date_range, filters, portfolio, granularity)
+        return purpose_series(cube)
+
+    app.clientside_callback(
+        """
+        function(value, store) {
+            if (!store) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            if (store.bands) {
+                return store.bands[value] || [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            return ['mortgage_constant', 'ltv'].map(function(metric) {
+                var spec = store[metric];
+                var series = spec.series[value];
+                if (!series) {
+                    return {data: [], layout: spec.layout};
+                }
+                var trace = Object.assign({}, spec.trace, {x: series.x, y: series.y, name: value, legendgroup: value});
+                if (trace.hovertemplate) {
+                    trace.hovertemplate = trace.hovertemplate.replace('purpose=All', 'purpose=' + value);
+                }
+                return {data: [trace], layout: spec.layout};
+            });
+        }
+        """,
+        [Output('loan-constant-graph', 'figure'), Output('ltv-graph', 'figure')],
+        [Input('demo-dropdown', 'value'), Input('purpose-series', 'data')]
+    )
+else:
+    app.callback(
+        [Output('loan-constant-graph', 'figure'), Output('ltv-graph', 'figure')],
+        [Input('demo-dropdown', 'value'), Input('date-range', 'value'), Input('cross-filter', 'data'),
+         Input('refresh-version', 'data'), Input('portfolio-dropdown', 'value'), Input('granularity', 'value'),
+         Input('line-style', 'value')]
+    )(purpose_selection)
+
+
+@app.callback(
+    Output('distribution-graph', 'figure'),
+    [Input('distribution-dropdown', 'value'), Input('demo-dropdown', 'value'), Input('date-range', 'value'),
+     Input('cross-filter', 'data'), Input('refresh-version', 'data'), Input('portfolio-dropdown', 'value')]
+)
+@timed_callback
+def distribution_selection(metric, purpose, date_range=None, filters=None, version=None, portfolio=None):
+    with timer('distribution_selection', 'sketches'):
+        histogram = histogram_selection(metric, purpose or ALL_PURPOSE, date_range, filters, portfolio)
+    return distribution_graph(histogram)
+
+
+@app.callback(
+    [Output('geo-map', 'figure'), Output('geo-zip-graph', 'figure')],
+    [Input('geo-dropdown', 'value'), Input('date-range', 'value'), Input('cross-filter', 'data'),
+     Input('refresh-version', 'data'), Input('portfolio-dropdown', 'value')]
+)
+@timed_callback
+def geo_selection(metric, date_range=None, filters=None, version=None, portfolio=None):
+    with timer('geo_selection', 'zips'):
+        totals = zip_selection(date_range, filters, portfolio)
+        points = map_points(totals, ZIP_CENTROIDS, MAX_MAP_POINTS) if len(ZIP_CENTROIDS) else None
+    return (geo_map(points, metric) if points is not None else dash.no_update), geo_zip_graph(totals, metric)
+
+
+## Heavy callbacks: in background processes when LOAN_BACKGROUND is set, with their
+## results cached on disk per inputs and portfolio files, else in the request
+background_manager = None
+if BACKGROUND:
+    background_manager = callback_manager(cache_path(DATA_PATH) + '-callbacks', cache_by=[portfolio_sources])
+    if background_manager is None:
+        print("LOAN_BACKGROUND needs diskcache (pip install dash[diskcache]); running callbacks in the request")
+
+
+def progress_bar(component_id):
+    return dict(progress=[Output(component_id, 'value'), Output(component_id, 'max')],
+                running=[(Output(component_id, 'style'), {'width': '100%'}, {'display': 'none'})])
+
+
+@heavy_callback(app, background_manager,
+    Output('cashflow-graph', 'figure'),
+    [Input('cashflow-dropdown', 'value'), Input('refresh-version', 'data'), Input('portfolio-dropdown', 'value')],
+    **progress_bar('cashflow-progress')
+)
+@timed_callback
+def cash_flow_selection(set_progress, value, version=None, portfolio=None):
+    with timer('cash_flow_selection', 'projection'):
+        projection = cash_flow_projection(portfolio, set_progress)
+    return projected_cash_flows(projection, value)
+
+
+@heavy_callback(app, background_manager,
+    [Output('scenario-mortgage-constant-graph', 'figure'), Output('scenario-ltv-graph', 'figure')],
+    [Input('scenario-dropdown', 'value'), Input('scenario-purpose-dropdown', 'value'), Input('refresh-version', 'data'),
+     Input('portfolio-dropdown', 'value')],
+    **progress_bar('scenario-progress')
+)
+@timed_callback
+def scenario_selection(set_progress, names, purpose, version=None, portfolio=None):
+    with timer('scenario_selection', 'scenarios'):
+        results = scenario_results(names or [], set_progress, portfolio)
+    return scenario_comparison(results, 'mortgage_constant', purpose), scenario_comparison(results, 'ltv', purpose)
+
+
+## Cohort picker follows the data: new vintages appear, another portfolio gets its own defaults
+@app.callback(
+    [Output('cohort-dropdown', 'options'), Output('cohort-dropdown', 'value')],
+    [Input('refresh-version', 'data'), Input('portfolio-dropdown', 'value')],
+    [State('cohort-dropdown', 'value')]
+)
+@timed_callback
+def cohort_options(version, portfolio, selected):
+    labels = cohort_labels(cohort_matrix(portfolio_state(portfolio)))
+    selected = [label for label in selected or [] if label in labels]
+    return labels, selected or default_cohorts(labels)
+
+
+@app.callback(
+    Output('vintage-graph', 'figure'),
+    [Input('cohort-dropdown', 'value'), Input('refresh-version', 'data'), Input('portfolio-dropdown', 'value')]
+)
+@timed_callback
+def vintage_selection(labels, version=None, portfolio=None):
+    with timer('vintage_selection', 'aggregation'):
+        curves = vintage_curves(cohort_matrix(portfolio_state(portfolio)), labels or [])
+    return vintage_graph(curves)
+
+
+@app.callback(
+    [Output('loan-table', 'data'), Output('loan-table', 'page_count')],
+    [Input('loan-table', 'page_current'), Input('loan-table', 'page_size'),
+     Input('loan-table', 'sort_by'), Input('loan-table', 'filter_query'),
+     Input('date-range', 'value'), Input('cross-filter', 'data'), Input('refresh-version', 'data'),
+     Input('portfolio-dropdown', 'value')]
+)
+@timed_callback
+def loan_table_page(page_current, page_size, sort_by, filter_query, date_range, filters, version=None, portfolio=None):
+    lp = portfolio_state(portfolio)
+    if lp['database'] is not None:
+        days = [ordinal_month(date_range[0]) + '-01', ordinal_month(date_range[1] + 1) + '-01'] if date_range else None
+        with timer('loan_table_page', 'aggregation'):
+            return query_table_page(lp['database'], days, filters, sort_by, filter_query, page_current or 0,
+                                    page_size)
+    if lp['df'] is None:
+        return [], 1
+    with timer('loan_table_page', 'aggregation'):
+        return table_page(lp['df'], lp['sort_index'], selected_loans(lp, date_range, filters),
+                          sort_by, filter_query, page_current or 0, page_size)
+
+
+if LEAN:
+    lean.install_compression(app.server, report=saved_bytes('compression'))
+
+
+## /metrics endpoint, with the builder behind each graph for the per-figure payload sizes
+install_metrics(app.server, {
+    'demographic-graph': 'demographic',
+    'interest-purpose-graph': 'draw_interest_purpose_graph',
+    'interest-graph': 'draw_interest_graph',
+    'funding-duration-graph': 'avg_funding_duration',
+    'loan-constant-graph': 'loan_constant',
+    'ltv-graph': 'loan_value',
+    'cashflow-graph': 'projected_cash_flows',
+    'scenario-mortgage-constant-graph': 'scenario_comparison',
+    'scenario-ltv-graph': 'scenario_comparison',
+    'vintage-graph': 'vintage_graph',
+    'distribution-graph': 'distribution_graph',
+    'geo-map': 'geo_map',
+    'geo-zip-graph': 'geo_zip_graph',
+}, slow_seconds=float(SLOW_CALLBACK_MS) / 1000 if SLOW_CALLBACK_MS else None)
+
+
+## Loaded portfolios and the hit / miss / eviction counts of their cache
+@app.server.route('/portfolios')
+def portfolio_report():
+    return flask.jsonify(dict(lru_stats(portfolio_cache), registered=PORTFOLIOS))
+
+
+if WARMUP:
+    start_warmup()
+
+
 if __name__ == '__main__':
     app.run_server(debug= True)
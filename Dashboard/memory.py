@@ -0,0 +1,61 @@
+import os
+import resource
+
+import numpy as np
+import pandas as pd
+
+SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+## Memory of one process in MB, from /proc (Linux).
+## Rss counts the shared pages (mapped cache files, pages inherited from the
+## preloading master) in every worker; Pss splits them between the processes
+## sharing them, so the sum of Pss over the workers is what the host really uses.
+def process_memory(pid='self'):
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            lines = f.readlines()
+    except OSError:
+        if pid != 'self':
+            return None
+        # No /proc: peak RSS of this process only (KB on Linux, bytes on macOS)
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'pid': os.getpid(), 'max_rss_mb': round(maxrss / 1024, 1)}
+
+    memory = {'pid': os.getpid() if pid == 'self' else int(pid)}
+    for line in lines:
+        name, _, value = line.partition(':')
+        if name in SMAPS_FIELDS:
+            memory[name.lower() + '_mb'] = round(int(value.split()[0]) / 1024, 1)
+    return memory
+
+
+# Pids of the other workers: the children of our parent (the WSGI master)
+def sibling_pids():
+    ppid = os.getppid()
+    try:
+        with open(f'/proc/{ppid}/task/{ppid}/children') as f:
+            return [int(pid) for pid in f.read().split()]
+    except OSError:
+        return [os.getpid()]
+
+
+## Memory of every worker of this server, plus totals
+def workers_memory():
+    workers = [m for m in (process_memory(pid) for pid in sibling_pids()) if m is not None]
+    totals = {key: round(sum(w.get(key, 0) for w in workers), 1) for key in ('rss_mb', 'pss_mb')}
+    return {'master_pid': os.getppid(), 'served_by': os.getpid(), 'workers': workers, 'total': totals}
+
+
+## Columns of a frame still backed by a memory-mapped file (LOAN_MMAP): those are the
+## pages the workers share; a column copied out of its mapping is private to each one
+def mapped_columns(lp_df):
+    mapped = []
+    for column in lp_df.columns:
+        values = lp_df[column].array
+        values = values.codes if isinstance(values, pd.Categorical) else lp_df[column].to_numpy()
+        while values is not None and not isinstance(values, np.memmap):
+            values = getattr(values, 'base', None)
+        if values is not None:
+            mapped.append(column)
+    return {'mapped': len(mapped), 'columns': len(lp_df.columns), 'copied': [c for c in lp_df.columns if c not in mapped]}
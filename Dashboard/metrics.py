@@ -0,0 +1,156 @@
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+
+import flask
+
+# Prometheus-style histograms for the callbacks and figure builders, served as text
+# on /metrics. No client library needed: the exposition format is written here.
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+HISTOGRAMS = {
+    'dashboard_phase_seconds': ('Time spent per callback or figure builder and phase', SECONDS_BUCKETS),
+    'dashboard_payload_bytes': ('Size of the JSON sent to the browser per callback or figure', BYTES_BUCKETS),
+    'dashboard_saved_bytes': ('Bytes saved per figure by lean figures and per path by compression', BYTES_BUCKETS),
+}
+
+logger = logging.getLogger('dashboard.metrics')
+
+metrics_lock = threading.Lock()
+histograms = {name: {} for name in HISTOGRAMS}
+
+# Callback responses slower than this many seconds are logged (None: off)
+slow_callback_seconds = None
+
+
+## Recording
+def observe(name, value, **labels):
+    buckets = HISTOGRAMS[name][1]
+    key = tuple(sorted(labels.items()))
+    with metrics_lock:
+        series = histograms[name].setdefault(key, {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0})
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                series['buckets'][i] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+
+# Time spent by callbacks in the current request, per phase, for the serialization split
+def request_phases():
+    if not flask.has_request_context():
+        return None
+    if not hasattr(flask.g, 'dashboard_phases'):
+        flask.g.dashboard_phases = {}
+    return flask.g.dashboard_phases
+
+
+@contextlib.contextmanager
+def timer(target, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('dashboard_phase_seconds', elapsed, target=target, phase=phase)
+        phases = request_phases()
+        if phases is not None:
+            phases[(target, phase)] = phases.get((target, phase), 0) + elapsed
+
+
+## Decorators for figure builders (figure_build phase) and callbacks (compute phase)
+def timed_figure(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with timer(function.__name__, 'figure_build'):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def timed_callback(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if flask.has_request_context():
+            flask.g.dashboard_callback = function.__name__
+        with timer(function.__name__, 'compute'):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+## Request hooks: whatever the callback request spent outside the callback itself
+## is Dash validating inputs and serializing the outputs to JSON
+def start_request():
+    flask.g.dashboard_start = time.perf_counter()
+
+
+def end_request(response, figure_outputs):
+    callback = getattr(flask.g, 'dashboard_callback', None)
+    if callback is None or response.status_code != 200:
+        return response
+
+    total = time.perf_counter() - flask.g.dashboard_start
+    phases = request_phases()
+    compute = phases.get((callback, 'compute'), 0)
+    observe('dashboard_phase_seconds', total, target=callback, phase='total')
+    observe('dashboard_phase_seconds', max(total - compute, 0), target=callback, phase='serialization')
+
+    body = response.get_data()
+    observe('dashboard_payload_bytes', len(body), target=callback)
+    try:
+        outputs = json.loads(body).get('response', {})
+    except ValueError:
+        outputs = {}
+    for component, props in outputs.items():
+        if component in figure_outputs and 'figure' in props:
+            observe('dashboard_payload_bytes', len(json.dumps(props['figure'])), target=figure_outputs[component])
+
+    if slow_callback_seconds is not None and total > slow_callback_seconds:
+        breakdown = ', '.join(f"{target}.{phase} {seconds * 1000:.0f}ms" for (target, phase), seconds in phases.items())
+        logger.warning("slow callback %s: %.0fms total, %d bytes (%s)", callback, total * 1000, len(body), breakdown)
+    return response
+
+
+def saved_bytes(stage):
+    return lambda target, saved: observe('dashboard_saved_bytes', saved, target=target, stage=stage)
+
+
+## Prometheus text exposition format
+def format_labels(key, extra=()):
+    labels = list(key) + list(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+def render():
+    lines = []
+    with metrics_lock:
+        for name, (description, buckets) in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, series in sorted(histograms[name].items()):
+                for bound, count in zip(buckets, series['buckets']):
+                    lines.append(f"{name}_bucket{format_labels(key, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{format_labels(key, [('le', '+Inf')])} {series['count']}")
+                lines.append(f"{name}_sum{format_labels(key)} {series['sum']}")
+                lines.append(f"{name}_count{format_labels(key)} {series['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+## Hook everything onto the Dash app's Flask server.
+## figure_outputs maps a graph id to the name of the builder drawing it.
+def install_metrics(server, figure_outputs, slow_seconds=None):
+    global slow_callback_seconds
+    slow_callback_seconds = slow_seconds
+
+    server.before_request(start_request)
+    server.after_request(lambda response: end_request(response, figure_outputs))
+
+    @server.route('/metrics')
+    def metrics():
+        return flask.Response(render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,153 @@
+import collections
+import glob
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# Several portfolios in one deployment: a registry of the portfolios that can be served
+# and an LRU of the loaded ones, evicting by the memory they hold rather than by count.
+
+logger = logging.getLogger('dashboard.portfolios')
+
+
+## Registry: portfolio name -> CSV path.
+## spec is "desk-a=Data/a.csv,desk-b=Data/b.csv"; without it every CSV in the folder of
+## the default portfolio is registered under its file name, as long as its header has
+## the loan columns (the folder also holds lookups such as the ZIP centroids).
+## The default comes first.
+def portfolio_registry(default_path, spec=None, columns=()):
+    registry = {}
+    if spec:
+        for entry in spec.split(','):
+            name, _, path = entry.strip().partition('=')
+            if path:
+                registry[name.strip()] = path.strip()
+    else:
+        registry[portfolio_name(default_path)] = default_path
+        for path in sorted(glob.glob(os.path.join(os.path.dirname(default_path) or '.', '*.csv'))):
+            if has_columns(path, columns):
+                registry.setdefault(portfolio_name(path), path)
+    return registry
+
+
+def has_columns(path, columns):
+    try:
+        header = pd.read_csv(path, nrows=0).columns
+    except (OSError, ValueError):
+        return False
+    return set(columns) <= set(header)
+
+
+def portfolio_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+## Memory held by a loaded portfolio: frames, arrays and the containers around them
+def deep_size(value, seen=None):
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True).sum() if isinstance(value, pd.DataFrame) else value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(deep_size(k, seen) + deep_size(v, seen) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(deep_size(v, seen) for v in value)
+    return sys.getsizeof(value)
+
+
+## LRU of loaded portfolios within a memory budget (bytes). The entry just loaded is
+## never evicted, so a single portfolio bigger than the budget is still served.
+## on_evict, if given, is called with the name of every evicted portfolio.
+def memory_lru(budget, on_evict=None):
+    return {
+        'budget': budget,
+        'on_evict': on_evict,
+        'entries': collections.OrderedDict(),
+        'sizes': {},
+        'loading': {},
+        'lock': threading.Lock(),
+        'stats': {'hits': 0, 'misses': 0, 'loads': 0, 'evictions': 0, 'evicted_bytes': 0, 'load_seconds': 0.0},
+    }
+
+
+def lru_get(lru, name, load, size=deep_size):
+    with lru['lock']:
+        if name in lru['entries']:
+            lru['entries'].move_to_end(name)
+            lru['stats']['hits'] += 1
+            return lru['entries'][name]
+        lru['stats']['misses'] += 1
+        name_lock = lru['loading'].setdefault(name, threading.Lock())
+
+    # One load per portfolio at a time; whoever waited finds it loaded
+    with name_lock:
+        with lru['lock']:
+            if name in lru['entries']:
+                lru['entries'].move_to_end(name)
+                return lru['entries'][name]
+
+        start = time.perf_counter()
+        value = load(name)
+        seconds = time.perf_counter() - start
+        nbytes = size(value)
+
+        with lru['lock']:
+            lru['entries'][name] = value
+            lru['sizes'][name] = nbytes
+            lru['stats']['loads'] += 1
+            lru['stats']['load_seconds'] += seconds
+            evict(lru, keep=name)
+    logger.info("loaded portfolio %s: %.1f MB in %.2fs", name, nbytes / 2 ** 20, seconds)
+    return value
+
+
+# Least recently used first, until the total fits the budget (lock held by the caller)
+def evict(lru, keep):
+    while sum(lru['sizes'].values()) > lru['budget'] and len(lru['entries']) > 1:
+        name = next(iter(lru['entries']))
+        if name == keep:
+            lru['entries'].move_to_end(name)
+            continue
+        del lru['entries'][name]
+        nbytes = lru['sizes'].pop(name)
+        lru['stats']['evictions'] += 1
+        lru['stats']['evicted_bytes'] += nbytes
+        logger.info("evicted portfolio %s (%.1f MB)", name, nbytes / 2 ** 20)
+        if lru['on_evict'] is not None:
+            lru['on_evict'](name)
+
+
+# Swap in a new value of a loaded entry (live refresh): grown bytes are added to its
+# size, else it is measured again. An entry evicted meanwhile stays out.
+def lru_replace(lru, name, value, grown=None, size=deep_size):
+    nbytes = size(value) if grown is None else None
+    with lru['lock']:
+        if name in lru['entries']:
+            lru['entries'][name] = value
+            lru['sizes'][name] = nbytes if grown is None else lru['sizes'][name] + grown
+            evict(lru, keep=name)
+
+
+def lru_peek(lru, name):
+    with lru['lock']:
+        return lru['entries'].get(name)
+
+
+def lru_stats(lru):
+    with lru['lock']:
+        stats = dict(lru['stats'])
+        requests = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / requests, 4) if requests else None
+        stats['budget_mb'] = round(lru['budget'] / 2 ** 20, 1)
+        stats['used_mb'] = round(sum(lru['sizes'].values()) / 2 ** 20, 1)
+        stats['loaded'] = {name: round(lru['sizes'][name] / 2 ** 20, 1) for name in lru['entries']}
+        return stats
@@ -0,0 +1,62 @@
+import io
+import os
+
+import pandas as pd
+
+from loader import read_portfolio_csv, preprocess
+
+
+## Watch state for live refresh.
+## The data CSV is followed like a log: only bytes past `offset` are read on the
+## next poll. Every CSV dropped into `drop_dir` is ingested once.
+def watch_state(path, drop_dir=None):
+    return {
+        'path': path,
+        'header': list(pd.read_csv(path, nrows=0).columns),
+        'offset': os.path.getsize(path),
+        'drop_dir': drop_dir,
+        'seen': set(),
+    }
+
+
+# Rows appended to the data file since the last poll; a trailing partial line is
+# left for the next poll. Returns None when the file shrank (rewritten in place).
+def read_appended_rows(state):
+    size = os.path.getsize(state['path'])
+    if size < state['offset']:
+        return None
+    if size == state['offset']:
+        return []
+
+    with open(state['path'], 'rb') as f:
+        f.seek(state['offset'])
+        data = f.read(size - state['offset'])
+    end = data.rfind(b'\n') + 1
+    if not data[:end].strip():
+        return []
+
+    state['offset'] += end
+    rows = read_portfolio_csv(io.BytesIO(data[:end]), header=None, names=state['header'])
+    return [preprocess(rows)]
+
+
+def read_dropped_files(state):
+    if not state['drop_dir'] or not os.path.isdir(state['drop_dir']):
+        return []
+
+    frames = []
+    for name in sorted(os.listdir(state['drop_dir'])):
+        if not name.endswith('.csv') or name in state['seen']:
+            continue
+        frames.append(preprocess(read_portfolio_csv(os.path.join(state['drop_dir'], name))))
+        state['seen'].add(name)
+    return frames
+
+
+## New loans since the last poll, as preprocessed frames.
+## None means the data file was replaced and a full reload is needed.
+def poll_new_loans(state):
+    appended = read_appended_rows(state)
+    if appended is None:
+        return None
+    return appended + read_dropped_files(state)
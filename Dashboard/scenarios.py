@@ -0,0 +1,169 @@
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from cube import ALL_PURPOSE
+
+# Rate-shock stress tests: payments, mortgage constant and LTV of the whole portfolio
+# recalculated under shocked terms, one vectorized pass per scenario. Independent
+# scenarios run in parallel in a process pool and results are cached by parameters.
+
+# name: (shock on the 10 yr treasury baseline in basis points, drop in property value)
+SCENARIOS = {
+    'Baseline': (0, 0.0),
+    '+100bp': (100, 0.0),
+    '+200bp': (200, 0.0),
+    '+300bp': (300, 0.0),
+    'Value -10%': (0, 0.10),
+    'Value -20%': (0, 0.20),
+    'Value -30%': (0, 0.30),
+    '+200bp, Value -20%': (200, 0.20),
+}
+
+SCENARIO_METRICS = ['mortgage_constant', 'ltv']
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+INPUT_COLUMNS = ['funded_amount', 'interest rate', 'duration months', 'property value']
+
+
+## Only the columns the scenarios need, as plain arrays (cheap to send to the pool),
+## with the loans grouped by purpose so each purpose is a contiguous slice
+def scenario_inputs(lp_df):
+    purposes = pd.Categorical(lp_df['purpose'])
+    order = np.argsort(purposes.codes, kind='stable')
+    inputs = {column: lp_df[column].to_numpy(dtype='float64')[order] for column in INPUT_COLUMNS}
+    codes = np.asarray(purposes.codes)[order]
+    inputs['purposes'] = [str(purpose) for purpose in purposes.categories]
+    inputs['offsets'] = np.searchsorted(codes, np.arange(len(purposes.categories) + 1)).tolist()
+    return inputs
+
+
+## One scenario over the whole portfolio. The spread over the treasury index is kept,
+## so a shock on the baseline moves every loan's rate by the same amount.
+def shocked_metrics(inputs, rate_bp, value_drop):
+    amount = inputs['funded_amount']
+    months = inputs['duration months']
+    monthly = (inputs['interest rate'] + rate_bp / 10000) / 12
+
+    growth = (1 + monthly) ** months
+    paying = monthly > 0
+    payments = np.divide(amount * monthly * growth, growth - 1, out=amount / months, where=paying)
+
+    return {
+        'mortgage_constant': payments * 12 / amount,
+        'ltv': amount / (inputs['property value'] * (1 - value_drop)),
+    }
+
+
+# Quantiles and mean of a metric per purpose (and "All")
+def distribution(values, offsets, purposes):
+    summary = {}
+    bounds = list(zip(offsets[:-1], offsets[1:])) + [(0, len(values))]
+    for (start, end), purpose in zip(bounds, list(purposes) + [ALL_PURPOSE]):
+        selected = values[start:end]
+        selected = selected[np.isfinite(selected)]
+        if len(selected):
+            summary[purpose] = {'quantiles': np.quantile(selected, QUANTILES).tolist(), 'mean': float(selected.mean())}
+    return summary
+
+
+def run_scenario(inputs, rate_bp, value_drop):
+    metrics = shocked_metrics(inputs, rate_bp, value_drop)
+    return {metric: distribution(metrics[metric], inputs['offsets'], inputs['purposes']) for metric in SCENARIO_METRICS}
+
+
+## Process pool. The portfolio arrays are handed to each worker once, when it starts,
+## and every task only carries the scenario parameters. Workers are started from a
+## fork server (or spawned), never forked from the threaded web worker, where a child
+## could inherit a lock held by another thread.
+POOL_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+worker_inputs = None
+
+
+def init_worker(inputs):
+    global worker_inputs
+    worker_inputs = inputs
+
+
+def pool_scenario(rate_bp, value_drop):
+    return run_scenario(worker_inputs, rate_bp, value_drop)
+
+
+## One pool per portfolio, for its current data version: a request on another portfolio
+## never stops this one's pool. A pool replaced by a new version finishes the tasks it
+## was given before exiting.
+pool_lock = threading.Lock()
+pools = {}
+
+
+def scenario_pool(inputs, portfolio, version, workers):
+    with pool_lock:
+        pool = pools.get(portfolio)
+        if pool is None or pool['version'] != version:
+            if pool is not None:
+                pool['executor'].shutdown(wait=False)
+            executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=POOL_CONTEXT, initializer=init_worker,
+                                                              initargs=(inputs,))
+            pool = pools[portfolio] = {'version': version, 'executor': executor}
+        return pool['executor']
+
+
+## Results of the named scenarios, computing only the ones not cached yet.
+## Results are cached per portfolio, for its data version; the pool follows the same key.
+## progress, if given, is called with (scenarios done, scenarios to compute).
+scenario_cache = {}
+cache_lock = threading.Lock()
+
+
+def run_scenarios(inputs, names, portfolio=None, version=0, workers=None, progress=None):
+    workers = workers or os.cpu_count() or 1
+    params = {name: SCENARIOS[name] for name in names}
+    with cache_lock:
+        cached = scenario_cache.get(portfolio)
+        if cached is None or cached['version'] != version:
+            cached = scenario_cache[portfolio] = {'version': version, 'results': {}}
+        missing = sorted({p for p in params.values() if p not in cached['results']})
+
+    computed = {}
+    if len(missing) > 1 and workers > 1:
+        executor = scenario_pool(inputs, portfolio, version, min(workers, len(SCENARIOS)))
+        futures = {executor.submit(pool_scenario, *p): p for p in missing}
+        for future in concurrent.futures.as_completed(futures):
+            computed[futures[future]] = future.result()
+            if progress is not None:
+                progress(len(computed), len(missing))
+    else:
+        for p in missing:
+            computed[p] = run_scenario(inputs, *p)
+            if progress is not None:
+                progress(len(computed), len(missing))
+
+    with cache_lock:
+        cached['results'].update(computed)
+        return {name: cached['results'][p] for name, p in params.items()}
+
+
+# Every pool stopped and its processes and threads joined, the cached results kept
+# (before forking the process, see export.py)
+def shutdown_pools():
+    with pool_lock:
+        stopped = list(pools.values())
+        pools.clear()
+    for pool in stopped:
+        pool['executor'].shutdown(wait=True)
+
+
+# A portfolio evicted from memory: its pool and cached results go with it
+def release_portfolio(portfolio):
+    with pool_lock:
+        pool = pools.pop(portfolio, None)
+    if pool is not None:
+        pool['executor'].shutdown(wait=False)
+    with cache_lock:
+        scenario_cache.pop(portfolio, None)
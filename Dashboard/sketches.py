@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+from cube import ALL_PURPOSE, period_labels
+
+# Distribution sketches: fixed-bin histograms of the rate, LTV and mortgage constant per
+# purpose x month. Histograms over the same bins add up, so any selection of purposes and
+# months is a sum of rows, and its percentiles are read from (bins) cumulative counts:
+# the cost of a query depends on the number of months and bins, not of loans.
+
+# metric: (low, high) of its bins; values outside fall in the first / last bin
+SKETCH_METRICS = {
+    'interest rate percent': (0.0, 15.0),
+    'ltv': (0.0, 1.5),
+    'mortgage_constant': (0.0, 0.3),
+}
+BINS = 600
+BANDS = [0.05, 0.5, 0.95]
+
+SKETCH_COLUMNS = ['purpose', 'funded_date'] + list(SKETCH_METRICS)
+SKETCH_KEYS = ['purpose', 'month']
+
+
+## Histograms: keys (purpose, month ordinal year * 12 + month - 1) and their counts,
+## a (keys x metrics x bins) array
+def empty_histograms():
+    keys = pd.MultiIndex.from_arrays([pd.Index([], dtype=object), pd.Index([], dtype='int64')], names=SKETCH_KEYS)
+    return {'keys': keys, 'counts': np.zeros((0, len(SKETCH_METRICS), BINS), dtype='int64')}
+
+
+def bin_edges(metric):
+    low, high = SKETCH_METRICS[metric]
+    return np.linspace(low, high, BINS + 1)
+
+
+## Histograms of preprocessed loans: one bincount over (cell, metric, bin) for every metric
+def build_histograms(lp_df):
+    if not len(lp_df):
+        return empty_histograms()
+    dates = lp_df['funded_date'].dt
+    grouped = lp_df.groupby([lp_df['purpose'], (dates.year * 12 + dates.month - 1).rename('month')], observed=True)
+    cells = grouped.ngroup().to_numpy()
+    keys = grouped.size().index
+    keys = pd.MultiIndex.from_arrays([keys.get_level_values(0).astype(str).astype(object),
+                                      keys.get_level_values(1).astype('int64')], names=SKETCH_KEYS)
+
+    flat = []
+    for position, (metric, (low, high)) in enumerate(SKETCH_METRICS.items()):
+        values = lp_df[metric].to_numpy(dtype='float64')
+        valid = np.isfinite(values)
+        bins = np.clip(((values[valid] - low) * (BINS / (high - low))).astype('int64'), 0, BINS - 1)
+        flat.append((cells[valid] * len(SKETCH_METRICS) + position) * BINS + bins)
+    counts = np.bincount(np.concatenate(flat), minlength=len(keys) * len(SKETCH_METRICS) * BINS)
+    return {'keys': keys, 'counts': counts.reshape(len(keys), len(SKETCH_METRICS), BINS)}
+
+
+## Merge two histogram sets: the keys are unioned and the counts of shared keys added
+def merge_histograms(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    keys = left['keys'].append(right['keys']).unique().sort_values()
+    counts = np.zeros((len(keys),) + left['counts'].shape[1:], dtype='int64')
+    for part in (left, right):
+        counts[keys.get_indexer(part['keys'])] += part['counts']
+    return {'keys': keys, 'counts': counts}
+
+
+## Counts of a selection per period: purposes (None or "All" for every one) and months
+## between two ordinals (inclusive). Months roll up to quarters and years; a week is
+## finer than the sketches, so weekly selections get monthly periods.
+def selection_counts(histograms, purposes=None, start=None, end=None, granularity='month'):
+    keys = histograms['keys']
+    months = keys.get_level_values('month').to_numpy()
+    keep = np.ones(len(keys), dtype=bool)
+    if purposes is not None and ALL_PURPOSE not in purposes:
+        keep &= keys.get_level_values('purpose').isin(purposes)
+    if start is not None:
+        keep &= months >= start
+    if end is not None:
+        keep &= months <= end
+
+    month_starts = (months[keep] - 1970 * 12).astype('datetime64[M]').astype('datetime64[D]').astype('int64')
+    labels, rows = np.unique(period_labels(month_starts, 'month' if granularity == 'week' else granularity),
+                             return_inverse=True)
+    counts = np.zeros((len(labels),) + histograms['counts'].shape[1:], dtype='int64')
+    np.add.at(counts, rows, histograms['counts'][keep])
+    return labels, counts
+
+
+## Quantiles of (..., bins) counts of one metric, interpolated inside the bin; NaN if empty
+def count_quantiles(counts, metric, quantiles=BANDS):
+    low, high = SKETCH_METRICS[metric]
+    width = (high - low) / BINS
+    cumulative = np.cumsum(counts, axis=-1)
+    total = cumulative[..., -1]
+
+    values = []
+    for quantile in quantiles:
+        target = quantile * total
+        below = (cumulative < target[..., None]).sum(axis=-1)
+        below = np.minimum(below, BINS - 1)
+        before = np.take_along_axis(cumulative, below[..., None], axis=-1)[..., 0] - \
+            np.take_along_axis(counts, below[..., None], axis=-1)[..., 0]
+        inside = np.take_along_axis(counts, below[..., None], axis=-1)[..., 0]
+        fraction = np.divide(target - before, inside, out=np.zeros(total.shape), where=inside > 0)
+        values.append(np.where(total > 0, low + (below + fraction) * width, np.nan))
+    return np.stack(values, axis=-1)
+
+
+## Percentile bands of a metric per period: p5 / p50 / p95 columns indexed by period
+def percentile_bands(histograms, metric, purposes=None, start=None, end=None, granularity='month'):
+    labels, counts = selection_counts(histograms, purposes, start, end, granularity)
+    bands = count_quantiles(counts[:, list(SKETCH_METRICS).index(metric)], metric)
+    return pd.DataFrame(bands, index=pd.Index(labels, name='year_month'),
+                        columns=[f"p{round(quantile * 100)}" for quantile in BANDS])
+
+
+## Histogram of a metric over a whole selection: bin centers and counts
+def selection_histogram(histograms, metric, purposes=None, start=None, end=None):
+    _, counts = selection_counts(histograms, purposes, start, end)
+    counts = counts[:, list(SKETCH_METRICS).index(metric)].sum(axis=0)
+    edges = bin_edges(metric)
+    return pd.Series(counts, index=pd.Index((edges[:-1] + edges[1:]) / 2, name=metric), name='loans')
@@ -0,0 +1,112 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# Synthetic portfolios with the same 32 columns as LuxuryLoanPortfolio.csv, for
+# scaling tests. Every synthetic loan starts from a randomly drawn real loan (so the
+# purpose mix, funding dates, treasury baseline, rate spread and LTV keep their real
+# distribution) and is then perturbed; payments, past payments and balance are
+# recomputed from the perturbed terms so each row stays internally consistent.
+#
+#   python synthetic.py --rows 1M --out Data/synthetic/LuxuryLoanPortfolio_1M.csv
+
+SOURCE_PATH = "Data/LuxuryLoanPortfolio.csv"
+AS_OF = pd.Timestamp('2020-01-01')
+CHUNK_ROWS = 500000
+
+SIZES = {'k': 1000, 'm': 1000000}
+
+
+# "10k" / "1M" / "2500" to a number of rows
+def parse_rows(text):
+    text = str(text).strip().lower()
+    if text[-1] in SIZES:
+        return int(float(text[:-1]) * SIZES[text[-1]])
+    return int(text)
+
+
+def read_source(path=SOURCE_PATH):
+    source = pd.read_csv(path, dtype=str, keep_default_na=False)
+    source['funded_date'] = pd.to_datetime(source['funded_date'])
+    return source
+
+
+## One chunk of synthetic loans, loan ids starting at first_id
+def synthetic_chunk(source, rows, first_id, rng):
+    template = source.iloc[rng.integers(0, len(source), rows)].reset_index(drop=True)
+    chunk = template.copy()
+
+    chunk['loan_id'] = [f"LS{i:09d}" for i in range(first_id, first_id + rows)]
+
+    # Funding date within a month of the template loan, inside the source period
+    days = rng.integers(-30, 31, rows)
+    funded_date = (template['funded_date'] + pd.to_timedelta(days, unit='D')).clip(
+        source['funded_date'].min(), source['funded_date'].max())
+    chunk['funded_date'] = funded_date.dt.strftime('%Y-%m-%d')
+
+    funded_amount = template['funded_amount'].astype(float) * rng.lognormal(0, 0.15, rows)
+    funded_amount = np.maximum(np.round(funded_amount / 500) * 500, 500)
+
+    treasury = template['10 yr treasury index date funded'].astype(float)
+    spread = template['interest rate percent'].astype(float) - treasury
+    rate_percent = np.round(treasury + spread + rng.normal(0, 0.05, rows), 3)
+    rate = rate_percent / 100
+
+    ltv = template['funded_amount'].astype(float) / template['property value'].astype(float)
+    ltv = np.clip(ltv * rng.normal(1, 0.02, rows), 0.5, 0.9999)
+    property_value = np.round(funded_amount / ltv, 2)
+
+    # Level-payment amortization on the perturbed terms
+    months = template['duration months'].astype(int).to_numpy()
+    monthly = rate.to_numpy() / 12
+    growth = (1 + monthly) ** months
+    payments = funded_amount * monthly * growth / (growth - 1)
+
+    elapsed = ((AS_OF.year - funded_date.dt.year) * 12 + (AS_OF.month - funded_date.dt.month)).to_numpy()
+    past = np.clip(elapsed, 0, months)
+    paid_growth = (1 + monthly) ** past
+    balance = np.maximum(funded_amount * paid_growth - payments * (paid_growth - 1) / monthly, 0)
+
+    chunk['funded_amount'] = np.char.mod('%.2f', funded_amount)
+    chunk['interest rate percent'] = np.char.mod('%.3f', rate_percent)
+    chunk['interest rate'] = np.char.mod('%.5f', rate)
+    chunk['payments'] = np.char.mod('%.2f', payments)
+    chunk['total past payments'] = past
+    chunk['loan balance'] = np.char.mod('%.2f', balance)
+    chunk['property value'] = np.char.mod('%.2f', property_value)
+    return chunk
+
+
+## Write a synthetic portfolio of `rows` loans to `out`, chunk by chunk
+def generate(rows, out, seed=0, source_path=SOURCE_PATH, chunk_rows=CHUNK_ROWS):
+    source = read_source(source_path)
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+
+    tmp = out + '.tmp'
+    written = 0
+    with open(tmp, 'w', encoding='utf-8-sig', newline='') as f:
+        while written < rows:
+            size = min(chunk_rows, rows - written)
+            chunk = synthetic_chunk(source, size, written + 1, rng)
+            chunk.to_csv(f, index=False, header=written == 0)
+            written += size
+    os.replace(tmp, out)
+    return out
+
+
+def synthetic_path(rows, directory="Data/synthetic"):
+    return os.path.join(directory, f"LuxuryLoanPortfolio_{rows}.csv")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic loan portfolio with the schema of LuxuryLoanPortfolio.csv')
+    parser.add_argument('--rows', default='10k', help='number of loans, e.g. 10k, 1M, 10M')
+    parser.add_argument('--out', help='CSV to write (default Data/synthetic/LuxuryLoanPortfolio_<rows>.csv)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = parse_rows(args.rows)
+    print(generate(rows, args.out or synthetic_path(rows), seed=args.seed))
@@ -0,0 +1,32 @@
+import os
+import sys
+
+# main.py reads its data and assets relative to the Dashboard folder
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import jsonify
+
+from main import app, startup_timings, portfolio_state
+from memory import process_memory, workers_memory, mapped_columns
+
+# WSGI entry point for production serving:
+#   gunicorn -c gunicorn.conf.py wsgi:server
+server = app.server
+
+
+## Memory report of the workers, to size hosts
+@server.route('/memory')
+def memory_report():
+    return jsonify(workers_memory())
+
+
+@server.route('/memory/self')
+def worker_memory_report():
+    lp_df = portfolio_state()['df']
+    return jsonify(dict(process_memory(), mapped_columns=mapped_columns(lp_df) if lp_df is not None else None))
+
+
+@server.route('/startup')
+def startup_report():
+    return jsonify({name: round(seconds, 3) for name, seconds in startup_timings.items()})